@@ -8,7 +8,14 @@ sys.path.insert(
 import argparse
 import settings
 
-from batch_jobs.dcf_replication.dcf_replication_job import run_job
+from batch_jobs.dcf_replication.dcf_replication_job import (
+    merge_shard_manifests,
+    run_job,
+    run_tracking,
+    verify_replication,
+    write_throughput_report,
+)
+from batch_jobs.dcf_replication.sharding import default_run_id
 
 
 def parse_arguments():
@@ -42,8 +49,123 @@ def parse_arguments():
     dcf_replication_cmd.add_argument(
         "--chunk_size",
         required=False,
-        default=256,
-        help="Size in MB. Chunk size at of each part for multipart upload.",
+        default=0,
+        help="Size in MB. Chunk size at of each part for multipart upload. 0 lets each job size its parts from the file size, its memory and the measured throughput.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--part_concurrency",
+        required=False,
+        default=8,
+        help="Number of parts transferred at the same time by each multipart copy job. Jobs lower it to fit in their memory and while the GDC API is throttling.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--bundle_max_files",
+        required=False,
+        default=1,
+        help="Maximum number of small files copied by one job. 1 submits one job per file.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--bundle_max_size",
+        required=False,
+        default=1024,
+        help="Size in MB. Maximum total size of the small files copied by one job.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--bundle_concurrency",
+        required=False,
+        default=8,
+        help="Number of files of a bundle copied at the same time",
+    )
+    dcf_replication_cmd.add_argument(
+        "--split_threshold",
+        required=False,
+        default=0,
+        help="Size in MB. Files at least this large are copied by several jobs, each uploading a range of parts. 0 disables splitting.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--split_job_size",
+        required=False,
+        default=32 * 1024,
+        help="Size in MB. Amount of data uploaded by each job of a split file.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--track_jobs",
+        required=False,
+        action="store_true",
+        help="Wait for the submitted jobs and write the final completed and failed manifests",
+    )
+    dcf_replication_cmd.add_argument(
+        "--output_gzip",
+        required=False,
+        action="store_true",
+        help="Gzip the output manifests",
+    )
+    dcf_replication_cmd.add_argument(
+        "--output_shard_size",
+        required=False,
+        default=0,
+        help="Size in MB. Output manifests are split into files of at most this size. 0 writes a single file.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--submission_order",
+        required=False,
+        default="manifest",
+        choices=["manifest", "largest_first", "smallest_first"],
+        help="Order in which files are submitted. largest_first shortens the total wall time, smallest_first completes the most files early.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--fair_share",
+        required=False,
+        action="store_true",
+        help="Set the scheduling priority of the jobs from the file size and their share identifier from the project. Requires job queues with a fair share scheduling policy.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--large_file_job_queue",
+        required=False,
+        default=None,
+        help="The name of the job queue of the files of at least --large_file_threshold",
+    )
+    dcf_replication_cmd.add_argument(
+        "--large_file_threshold",
+        required=False,
+        default=0,
+        help="Size in MB. Files at least this large are copied by --large_file_job_queue.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--shard_count",
+        required=False,
+        default=1,
+        help="Number of coordinators the manifest is split across, e.g. the size of the Batch array job running them",
+    )
+    dcf_replication_cmd.add_argument(
+        "--shard_index",
+        required=False,
+        default=os.environ.get("AWS_BATCH_JOB_ARRAY_INDEX", 0),
+        help="Shard copied by this coordinator. Defaults to its Batch array index.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--run_id",
+        required=False,
+        default=default_run_id(),
+        help="Id shared by the coordinators of a sharded run. Defaults to the Batch array job id.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--ledger_location",
+        required=False,
+        default=None,
+        help="Local directory or s3://bucket/prefix of the submission ledger that lets a rerun of the same manifest resume. Defaults to the output bucket, none disables it.",
+    )
+    dcf_replication_cmd.add_argument(
+        "--copy_from_replicas",
+        required=False,
+        action="store_true",
+        help="Copy files whose md5 and size are in the output manifests of previous runs from that replica with an S3 server-side copy, instead of downloading them from GDC",
+    )
+    dcf_replication_cmd.add_argument(
+        "--gdc_throttle",
+        required=False,
+        action="store_true",
+        help="Probe the GDC API before each chunk of jobs and pause submission while it is throttling or slow",
     )
 
     dcf_replication_cmd.add_argument(
@@ -57,6 +179,80 @@ def parse_arguments():
         required=True,
         help="The name of the bucket for output manifest",
     )
+
+    track_cmd = subparsers.add_parser("track_dcf_replication")
+    track_cmd.add_argument(
+        "--jobs_manifest",
+        required=True,
+        help="s3 path to the dcf_aws_batch_jobs manifest written at submission",
+    )
+    track_cmd.add_argument(
+        "--output_manifest_bucket",
+        required=True,
+        help="The name of the bucket for output manifest",
+    )
+
+    report_cmd = subparsers.add_parser("throughput_report")
+    report_cmd.add_argument(
+        "--metrics_location",
+        required=True,
+        help="s3://bucket/prefix where the gdc_copy jobs of a run wrote their transfer metrics",
+    )
+    report_cmd.add_argument(
+        "--output_manifest_bucket",
+        required=True,
+        help="The name of the bucket for output manifest",
+    )
+
+    merge_cmd = subparsers.add_parser("merge_dcf_replication_shards")
+    merge_cmd.add_argument(
+        "--run_id", required=True, help="Id of the sharded run to merge"
+    )
+    merge_cmd.add_argument(
+        "--shard_count", required=True, help="Number of shards of the run"
+    )
+    merge_cmd.add_argument(
+        "--output_manifest_bucket",
+        required=True,
+        help="The name of the bucket for output manifest",
+    )
+    merge_cmd.add_argument(
+        "--output_gzip",
+        required=False,
+        action="store_true",
+        help="Gzip the merged manifests",
+    )
+    merge_cmd.add_argument(
+        "--output_shard_size",
+        required=False,
+        default=0,
+        help="Size in MB. Merged manifests are split into files of at most this size. 0 writes a single file.",
+    )
+
+    verify_cmd = subparsers.add_parser("verify_replication")
+    verify_cmd.add_argument(
+        "--manifest_paths",
+        required=True,
+        nargs="+",
+        help="s3 paths of the output manifests to verify, e.g. the files of a dcf_aws_batch_completed manifest",
+    )
+    verify_cmd.add_argument(
+        "--output_manifest_bucket",
+        required=True,
+        help="The name of the bucket for the verification report",
+    )
+    verify_cmd.add_argument(
+        "--hash_threads",
+        required=False,
+        default=8,
+        help="Number of objects without checksum downloaded and hashed at the same time",
+    )
+    verify_cmd.add_argument(
+        "--max_hash_size",
+        required=False,
+        default=0,
+        help="Size in GB. Maximum size downloaded to hash objects without checksum, 0 for no limit",
+    )
     return parser.parse_args()
 
 
@@ -72,4 +268,42 @@ if __name__ == "__main__":
             args.chunk_size,
             args.thread_count,
             args.max_retries,
+            args.bundle_max_files,
+            args.bundle_max_size,
+            args.bundle_concurrency,
+            args.split_threshold,
+            args.split_job_size,
+            args.track_jobs,
+            args.output_gzip,
+            args.output_shard_size,
+            args.submission_order,
+            args.fair_share,
+            args.large_file_job_queue,
+            args.large_file_threshold,
+            args.shard_count,
+            args.shard_index,
+            args.run_id,
+            args.ledger_location,
+            args.copy_from_replicas,
+            args.gdc_throttle,
+            args.part_concurrency,
+        )
+    elif args.action == "track_dcf_replication":
+        run_tracking(args.jobs_manifest, args.output_manifest_bucket)
+    elif args.action == "throughput_report":
+        write_throughput_report(args.metrics_location, args.output_manifest_bucket)
+    elif args.action == "merge_dcf_replication_shards":
+        merge_shard_manifests(
+            args.output_manifest_bucket,
+            args.run_id,
+            args.shard_count,
+            args.output_gzip,
+            args.output_shard_size,
+        )
+    elif args.action == "verify_replication":
+        verify_replication(
+            args.manifest_paths,
+            args.output_manifest_bucket,
+            args.hash_threads,
+            args.max_hash_size,
         )
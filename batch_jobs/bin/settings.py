@@ -4,39 +4,58 @@ import json
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-INDEXD = {
-    "host": "",
-    "version": "",
-    "auth": {"username": "", "password": ""},
+# The credentials and the project map are read on first use, through the
+# module __getattr__, so that short lived jobs that import this module
+# without using them do not pay for it.
+CREDENTIALS_FILE = "/secrets/dcf_dataservice_credentials.json"
+PROJECT_MAP_FILE = "/dcf_dataservice/GDC_project_map.json"
+
+# settings read from CREDENTIALS_FILE, with their defaults
+CREDENTIALS_DEFAULTS = {
+    "INDEXD": {
+        "host": "",
+        "version": "",
+        "auth": {"username": "", "password": ""},
+    },
+    "SLACK_URL": "",
+    "GDC_TOKEN": "",
+    "POSTFIX_1_EXCEPTION": [],
+    "POSTFIX_2_EXCEPTION": [],
 }
 
-SLACK_URL = ""
-
-GDC_TOKEN = ""
-
-POSTFIX_1_EXCEPTION = []
-
-POSTFIX_2_EXCEPTION = []
-
-try:
-    with open("/secrets/dcf_dataservice_credentials.json", "r") as f:
-        data = json.loads(f.read())
-        INDEXD = data.get("INDEXD", {})
-        SLACK_URL = data.get("SLACK_URL", "")
-        GDC_TOKEN = data.get("GDC_TOKEN", "")
-        POSTFIX_1_EXCEPTION = data.get("POSTFIX_1_EXCEPTION", [])
-        POSTFIX_2_EXCEPTION = data.get("POSTFIX_2_EXCEPTION", [])
-except Exception as e:
-    print("Can not read dcf_dataservice_credentials.json file. Detail {}".format(e))
-
-
-PROJECT_ACL = {}
-try:
-    with open("/dcf_dataservice/GDC_project_map.json", "r") as f:
-        PROJECT_ACL = json.loads(f.read())
-except Exception as e:
-    print("Can not read GDC_project_map.json file. Detail {}".format(e))
-
 IGNORED_FILES = "/dcf_dataservice/ignored_files_manifest.csv"
 
 DATA_ENDPT = "https://api.gdc.cancer.gov/data/"
+
+
+def _load_credentials():
+    settings = dict(CREDENTIALS_DEFAULTS)
+    try:
+        with open(CREDENTIALS_FILE, "r") as f:
+            data = json.loads(f.read())
+            settings["INDEXD"] = data.get("INDEXD", {})
+            for name in CREDENTIALS_DEFAULTS:
+                if name != "INDEXD":
+                    settings[name] = data.get(name, CREDENTIALS_DEFAULTS[name])
+    except Exception as e:
+        print("Can not read dcf_dataservice_credentials.json file. Detail {}".format(e))
+    return settings
+
+
+def _load_project_acl():
+    try:
+        with open(PROJECT_MAP_FILE, "r") as f:
+            return json.loads(f.read())
+    except Exception as e:
+        print("Can not read GDC_project_map.json file. Detail {}".format(e))
+    return {}
+
+
+def __getattr__(name):
+    if name in CREDENTIALS_DEFAULTS:
+        globals().update(_load_credentials())
+    elif name == "PROJECT_ACL":
+        globals()["PROJECT_ACL"] = _load_project_acl()
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return globals()[name]
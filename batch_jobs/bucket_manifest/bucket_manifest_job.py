@@ -16,6 +16,7 @@ import boto3
 from botocore.exceptions import ClientError
 
 from ..utils import utils
+from ..utils.clients import get_client, init_clients
 
 logging.basicConfig(level=logging.INFO)
 # logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
@@ -42,7 +43,7 @@ def run_job(bucket, job_queue, job_definition, sqs, out_bucket, authz_file=None)
     """
     purge_queue(sqs)
     keys = list_objects(bucket)
-    submit_jobs(job_queue, job_definition, keys)
+    submit_jobs(job_queue, job_definition, keys, sqs)
     write_messages_to_tsv(sqs, len(keys), out_bucket, authz_file)
 
 
@@ -58,7 +59,7 @@ def purge_queue(queue_url):
         sys.exit(1)
 
 
-def submit_job(job_queue, job_definition, key):
+def submit_job(job_queue, job_definition, key, queue_url=None):
     """
     Submit job to the job queue
 
@@ -66,11 +67,15 @@ def submit_job(job_queue, job_definition, key):
         job_queue(str): job queue name
         job_definition(str): job definition name
         key(str): S3 object key
+        queue_url(str): SQS url the job sends its result to
 
     Returns:
         bool: True if the job was submitted successfully
     """
-    client = boto3.client("batch", region_name=REGION)
+    client = get_client("batch", region_name=REGION)
+    environment = [{"value": key, "name": "KEY"}]
+    if queue_url:
+        environment.append({"value": queue_url, "name": "QUEUE_URL"})
     n_tries = 0
 
     while n_tries < MAX_RETRIES:
@@ -79,7 +84,7 @@ def submit_job(job_queue, job_definition, key):
                 jobName="bucket_manifest",
                 jobQueue=job_queue,
                 jobDefinition=job_definition,
-                containerOverrides={"environment": [{"value": key, "name": "KEY"}]},
+                containerOverrides={"environment": environment},
             )
             logging.info("submitting job to compute metadata of {}".format(key))
             return True
@@ -99,7 +104,7 @@ def submit_job(job_queue, job_definition, key):
     return False
 
 
-def submit_jobs(job_queue, job_definition, keys):
+def submit_jobs(job_queue, job_definition, keys, queue_url=None):
     """
     Submit jobs to the queue
 
@@ -107,12 +112,17 @@ def submit_jobs(job_queue, job_definition, keys):
         job_queue(str): job queue name
         job_definition(str): job definition name
         keys(list(str)): list of object keys
+        queue_url(str): SQS url the jobs send their results to
 
     Returns:
         None
     """
-    par_submit_job = partial(submit_job, job_queue, job_definition)
-    with Pool(NUMBER_OF_THREADS) as pool:
+    par_submit_job = partial(submit_job, job_queue, job_definition, queue_url=queue_url)
+    with Pool(
+        NUMBER_OF_THREADS,
+        initializer=init_clients,
+        initargs=([{"service_name": "batch", "region_name": REGION}],),
+    ) as pool:
         pool.map(par_submit_job, keys)
 
 
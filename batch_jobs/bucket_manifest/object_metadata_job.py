@@ -20,6 +20,8 @@ ACCESS_KEY_ID = os.environ.get("ACCESS_KEY_ID")
 SECRET_ACCESS_KEY = os.environ.get("SECRET_ACCESS_KEY")
 AWS_SESSION_TOKEN = os.environ.get("AWS_SESSION_TOKEN")
 SQS_NAME = os.environ.get("SQS_NAME")
+# passed by the coordinator so that the queue does not have to be looked up
+QUEUE_URL = os.environ.get("QUEUE_URL")
 REGION = os.environ.get("REGION", "us-east-1")
 BUCKET = os.environ.get("BUCKET")
 S3KEY = os.environ.get("KEY")
@@ -32,7 +34,7 @@ def run_job():
     The bucket and the key are stored as environment variables.
     """
     output = compute_object_metadata()
-    send_message(SQS_NAME, output)
+    send_message(SQS_NAME, output, QUEUE_URL)
 
 
 def compute_object_metadata():
@@ -95,27 +97,33 @@ def compute_object_metadata():
     return output
 
 
-def send_message(queue_name, msg_body):
+def send_message(queue_name, msg_body, queue_url=None):
     """
     send a message to sqs
 
+    A low-level client is used rather than an SQS resource, whose models take
+    longer to load than this job takes to run.
+
     Args:
         queue_name(str): SQS name
         msg_body(dict): message content
+        queue_url(str): SQS url, looked up from queue_name if None
 
     Returns:
         bool: True if the message was sent successfully
     """
 
-    sqs = boto3.resource("sqs", region_name=REGION)
-    # Get the queue. This returns an SQS.Queue instance
-    queue = sqs.get_queue_by_name(QueueName=queue_name)
+    sqs = boto3.client("sqs", region_name=REGION)
+    if not queue_url:
+        queue_url = sqs.get_queue_url(QueueName=queue_name)["QueueUrl"]
 
     # send msg
     n_tries = 0
     while n_tries < MAX_RETRIES:
         try:
-            queue.send_message(MessageBody="{}".format(json.dumps(msg_body)))
+            sqs.send_message(
+                QueueUrl=queue_url, MessageBody="{}".format(json.dumps(msg_body))
+            )
             return True
         except ClientError as e:
             if e.response["Error"]["Code"] == "AccessDeniedException":
@@ -15,6 +15,8 @@ from urllib.parse import urlparse
 import boto3
 from botocore.exceptions import ClientError
 
+from ..utils.clients import get_client, init_clients
+
 logging.basicConfig(level=logging.INFO)
 # logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
 
@@ -55,7 +57,7 @@ def submit_job(source_bucket, destination_bucket, job_queue, job_definition, key
     Returns:
         bool: True if the job was submitted successfully
     """
-    client = boto3.client("batch", region_name=REGION)
+    client = get_client("batch", region_name=REGION)
     n_tries = 0
 
     while n_tries < MAX_RETRIES:
@@ -107,7 +109,11 @@ def submit_jobs(source_bucket, destination_bucket, job_queue, job_definition, ke
     par_submit_job = partial(
         submit_job, source_bucket, destination_bucket, job_queue, job_definition
     )
-    with Pool(NUMBER_OF_THREADS) as pool:
+    with Pool(
+        NUMBER_OF_THREADS,
+        initializer=init_clients,
+        initargs=([{"service_name": "batch", "region_name": REGION}],),
+    ) as pool:
         pool.map(par_submit_job, keys)
 
 
@@ -1 +1,9 @@
-from . import dcf_replication_job
+import importlib
+
+
+def __getattr__(name):
+    # the coordinator is only imported when it is used, so that the gdc_copy
+    # jobs importing the modules of this package do not load its settings
+    if name == "dcf_replication_job":
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
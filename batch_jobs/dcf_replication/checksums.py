@@ -0,0 +1,89 @@
+"""
+S3 additional checksums of the copied objects.
+
+Every part of a multipart upload is sent with its checksum, so that S3
+rejects a part corrupted on its way and only that part is uploaded again.
+S3 keeps the checksum of the object, which can later be read with a HEAD
+request instead of downloading the object.
+
+CRC32C is used when the awscrt extension of botocore is installed, SHA256
+otherwise. Uploads shared by several jobs use SPLIT_CHECKSUM_ALGORITHM since
+the jobs may not all have awscrt.
+"""
+import base64
+import hashlib
+
+try:
+    from awscrt import checksums as crt_checksums
+except ImportError:
+    crt_checksums = None
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+CHECKSUM_ALGORITHMS = ("CRC32C", "SHA256")
+CHECKSUM_ALGORITHM = "CRC32C" if crt_checksums else "SHA256"
+SPLIT_CHECKSUM_ALGORITHM = "SHA256"
+
+
+def checksum_key(algorithm):
+    """
+    Returns:
+        str: name of the S3 field holding a checksum, e.g. ChecksumSHA256
+    """
+    return f"Checksum{algorithm}"
+
+
+CHECKSUM_KEYS = tuple(checksum_key(algorithm) for algorithm in CHECKSUM_ALGORITHMS)
+
+
+def part_checksum(data, algorithm=CHECKSUM_ALGORITHM):
+    """
+    Checksum of a part, as extra arguments of upload_part or put_object
+
+    Args:
+        data(bytes): content of the part
+        algorithm(str): CRC32C, SHA256, or None for no checksum
+
+    Returns:
+        dict: e.g. {"ChecksumSHA256": "<base64 digest>"}, empty without algorithm
+    """
+    if algorithm is None:
+        return {}
+    if algorithm == "CRC32C":
+        if crt_checksums is None:
+            raise ValueError("CRC32C checksums require awscrt")
+        digest = crt_checksums.crc32c(data).to_bytes(4, "big")
+    elif algorithm == "SHA256":
+        digest = hashlib.sha256(data).digest()
+    else:
+        raise ValueError(f"Unsupported checksum algorithm {algorithm}")
+    return {checksum_key(algorithm): base64.b64encode(digest).decode("ascii")}
+
+
+def format_checksum(response):
+    """
+    Returns:
+        str: the checksum of an S3 response as "<algorithm>:<value>", empty if
+        it has none. Checksums of multipart objects are checksums of the part
+        checksums and end with -<number of parts>.
+    """
+    for algorithm in CHECKSUM_ALGORITHMS:
+        value = response.get(checksum_key(algorithm))
+        if value:
+            return f"{algorithm}:{value}"
+    return ""
+
+
+def object_checksum(s3, bucket, key):
+    """
+    Read the checksum S3 stored for an object, without downloading it
+
+    Returns:
+        str: see `format_checksum`, empty if the object has no checksum or
+        can not be read
+    """
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    except (ClientError, BotoCoreError):
+        return ""
+    return format_checksum(response)
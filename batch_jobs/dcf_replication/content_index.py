@@ -0,0 +1,141 @@
+"""
+Index of the content already replicated to our buckets.
+
+The output manifests of previous runs list, for every file that was copied,
+skipped because it was already in place, or copied from a replica, its md5,
+size and S3 url, and the completed manifests the checksum S3 stored for the
+copy. They are loaded into a sqlite table of (md5, size) -> S3 urls, so that
+a file of a new manifest whose content is already in one of our buckets,
+e.g. after a re-release or a move between the -open and -controlled buckets
+of a project, can be copied inside S3 instead of being downloaded from GDC
+again. The checksum is what a multipart replica, whose ETag is not an md5,
+is checked against before it is reused, see `replica_copy.check_replica`.
+"""
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+
+from batch_jobs.dcf_replication.manifest_writer import open_s3_manifest
+from batch_jobs.dcf_replication.sharding import MANIFEST_KEY_REGEX
+
+# output manifests whose files are known to be in place
+CONTENT_MANIFEST_KINDS = (
+    "dcf_aws_batch_completed",
+    "dcf_aws_batch_skipped",
+    "dcf_aws_batch_copied",
+)
+S3_URL_REGEX = re.compile(r"s3://[^\s'\",\]]+")
+INSERT_BATCH_SIZE = 10000
+
+
+class ContentIndex:
+    """
+    (md5, size) -> S3 urls index of replicated files
+
+    Args:
+        path(str): sqlite database file. A temporary file is used if None,
+            ":memory:" keeps the index in memory
+    """
+
+    def __init__(self, path=None):
+        self._tmp_path = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="dcf_content_index_", suffix=".db")
+            os.close(fd)
+            self._tmp_path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS content "
+            "(md5 TEXT, size INTEGER, url TEXT, checksum TEXT, "
+            "PRIMARY KEY (md5, size, url))"
+        )
+
+    def close(self):
+        self.db.close()
+        if self._tmp_path:
+            os.remove(self._tmp_path)
+            self._tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, rows):
+        """
+        Args:
+            rows(iterable(tuple)): (md5, size, url, checksum) of replicated
+                files, with an empty checksum if none was recorded
+        """
+        self.db.executemany("INSERT OR IGNORE INTO content VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def add_manifest(self, reader):
+        """
+        Index the rows of an output manifest
+
+        Args:
+            reader(csv.DictReader): rows with md5, size and urls columns, and
+                optionally a checksum column
+
+        Returns:
+            int: number of rows read
+        """
+        count = 0
+        batch = []
+        for row in reader:
+            count += 1
+            if not row.get("md5") or not (row.get("size") or "").isdigit():
+                continue
+            for url in S3_URL_REGEX.findall(row.get("urls") or ""):
+                batch.append(
+                    (row["md5"], int(row["size"]), url, row.get("checksum") or "")
+                )
+            if len(batch) >= INSERT_BATCH_SIZE:
+                self.add(batch)
+                batch = []
+        self.add(batch)
+        return count
+
+    def build(self, s3, bucket, kinds=CONTENT_MANIFEST_KINDS):
+        """
+        Index the output manifests of previous runs in `bucket`
+
+        Args:
+            s3(S3.Client): s3 client of the bucket
+            bucket(str): output manifest bucket
+            kinds(tuple(str)): kinds of manifests to index
+
+        Returns:
+            int: number of manifest rows read
+        """
+        count = 0
+        paginator = s3.get_paginator("list_objects_v2")
+        for kind in kinds:
+            for page in paginator.paginate(Bucket=bucket, Prefix=kind):
+                for obj in page.get("Contents", []):
+                    match = MANIFEST_KEY_REGEX.match(obj["Key"])
+                    if not match or match.group("kind") != kind:
+                        continue
+                    with open_s3_manifest(s3, bucket, obj["Key"]) as reader:
+                        count += self.add_manifest(reader)
+        logging.info(f"Indexed the content of {count} replicated files")
+        return count
+
+    def lookup(self, md5, size, exclude=None):
+        """
+        Returns:
+            tuple(str, str): S3 url and recorded checksum of a replica of the
+            file other than `exclude`, replicas with a checksum first. None if
+            there is none
+        """
+        row = self.db.execute(
+            "SELECT url, checksum FROM content "
+            "WHERE md5 = ? AND size = ? AND url != ? "
+            "ORDER BY checksum = '' LIMIT 1",
+            (md5, int(size), exclude or ""),
+        ).fetchone()
+        return tuple(row) if row else None
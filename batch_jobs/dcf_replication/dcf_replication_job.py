@@ -2,16 +2,81 @@ import os
 import sys
 
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from multiprocessing.pool import Pool
 import time
 import logging
 import io
 import datetime
+import gzip
+import json
+import re
+from collections import Counter
+from contextlib import ExitStack
+from itertools import zip_longest
+from operator import itemgetter
 
-import boto3
 from botocore.exceptions import ClientError
 
+from batch_jobs.dcf_replication.checksums import (
+    CHECKSUM_ALGORITHM,
+    SPLIT_CHECKSUM_ALGORITHM,
+    object_checksum,
+)
+from batch_jobs.dcf_replication.content_index import ContentIndex
+from batch_jobs.dcf_replication.destination_index import (
+    PREFIX_LISTING_THRESHOLD,
+    DestinationIndex,
+)
+from batch_jobs.dcf_replication.gdc_client import GDCClient, SubmissionThrottle
+from batch_jobs.dcf_replication.ledger import SubmissionLedger, ledger_key
+from batch_jobs.dcf_replication.manifest_writer import (
+    S3ManifestWriter,
+    open_s3_manifest,
+)
+from batch_jobs.dcf_replication.part_planner import MB, plan_part_size
+from batch_jobs.dcf_replication.replica_copy import (
+    check_replica,
+    copy_replica_object,
+    split_s3_url,
+)
+from batch_jobs.dcf_replication.routing import (
+    compile_routing_table,
+    find_unknown_projects,
+    route,
+)
+from batch_jobs.dcf_replication.scheduling import (
+    MANIFEST_ORDER,
+    order_files,
+    scheduling_parameters,
+)
+from batch_jobs.dcf_replication.sharding import (
+    SHARDS_PREFIX,
+    group_shard_keys,
+    shard_of,
+    shard_prefix,
+)
+from batch_jobs.dcf_replication.transfer_metrics import merge_summaries
+from batch_jobs.dcf_replication.upload_state import (
+    delete_part_digests,
+    find_in_progress_upload,
+    list_uploaded_parts,
+    upload_checksum_algorithm,
+)
+from batch_jobs.dcf_replication.verification import (
+    DISCREPANCY_FIELDS,
+    HASH_THREADS,
+    manifest_objects,
+    verify_objects,
+)
+from batch_jobs.utils.clients import get_bucket_client, get_client, init_clients
+from batch_jobs.utils.job_tracker import (
+    POLL_INTERVAL_MAX,
+    POLL_INTERVAL_MIN,
+    poll_jobs,
+)
+
 from batch_jobs.bin.settings import (
     POSTFIX_1_EXCEPTION,
     POSTFIX_2_EXCEPTION,
@@ -23,9 +88,85 @@ logging.basicConfig(level=logging.INFO)
 # logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
 
 JOB_STATUS_KEY = "job_status"
+JOB_ID_KEY = "job_id"
+# multipart upload shared by the jobs of a split file
+UPLOAD_ID_KEY = "upload_id"
+# s3 url of the per-file results of the job of a bundle
+BUNDLE_RESULTS_KEY = "bundle_results"
+# statuses of the result records of copy_bundle for files in place
+BUNDLE_COPIED_STATUSES = ("SUCCESS", "SKIPPED")
 REGION = os.environ.get("REGION", "us-east-1")
 NUMBER_OF_THREADS = 5
 MAX_RETRIES = 3
+UPLOAD_STATE_LOCATION = "/tmp/gdc_upload_state"
+# parts transferred at the same time by each multipart copy job, lowered by
+# the job to fit in its memory and while the GDC API is throttling
+PART_CONCURRENCY = 8
+# local directory or s3://bucket/prefix of the submission ledgers, None to
+# disable them
+LEDGER_LOCATION = None
+# copy files whose content is already in one of our buckets with an S3
+# server-side copy, see content_index.py
+COPY_FROM_REPLICAS = False
+REPLICA_COPY_CONCURRENCY = 10
+# replicas of at least REPLICA_JOB_THRESHOLD bytes are copied by a Batch job
+# rather than by the submission workers
+REPLICA_JOB_THRESHOLD = 1024 * MB
+# probe the GDC API before each chunk of jobs and pause submission while it is
+# under load, see gdc_client.SubmissionThrottle
+GDC_THROTTLE = False
+# s3://bucket/prefix where multipart transfers write their metrics summary
+TRANSFER_METRICS_LOCATION = None
+# Bundling of small files, a BUNDLE_MAX_FILES of 1 submits one job per file
+BUNDLE_MAX_FILES = 1
+BUNDLE_MAX_SIZE = 1024
+BUNDLE_CONCURRENCY = 8
+BUNDLE_FIELDS = ["id", "file_name", "size", "md5", "destination_bucket"]
+# Files of at least SPLIT_THRESHOLD MB are copied by an array of part-range
+# jobs of SPLIT_JOB_SIZE MB each, a SPLIT_THRESHOLD of 0 disables splitting
+SPLIT_THRESHOLD = 0
+SPLIT_JOB_SIZE = 32 * 1024
+MAX_ARRAY_SIZE = 10000
+OUTPUT_MANIFEST_FIELDS = ["guid", "md5", "size", "authz", "acl", "file_name", "urls"]
+# the completed manifest also has the checksum S3 stored for each object
+COMPLETED_MANIFEST_FIELDS = OUTPUT_MANIFEST_FIELDS + ["checksum"]
+GDC_MANIFEST_FIELDS = [
+    "id",
+    "file_name",
+    "size",
+    "acl",
+    "md5",
+    "baseid",
+    "url",
+    "project_id",
+]
+JOBS_MANIFEST_FIELDS = (
+    [JOB_ID_KEY]
+    + GDC_MANIFEST_FIELDS
+    + ["destination_bucket", UPLOAD_ID_KEY, BUNDLE_RESULTS_KEY]
+)
+# Output manifests are gzipped if OUTPUT_COMPRESS is set and split into
+# shards of OUTPUT_SHARD_SIZE MB, 0 writes a single file
+OUTPUT_COMPRESS = False
+OUTPUT_SHARD_SIZE = 0
+# Number of files handed to the submission pool at a time
+SUBMIT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+MD5_REGEX = re.compile(r"^[a-f0-9]{32}$", re.I)
+# Order in which files are submitted, see scheduling.order_files. With
+# FAIR_SHARE set jobs get a priority and a share identifier, which requires
+# job queues with a fair share scheduling policy
+SUBMISSION_ORDER = MANIFEST_ORDER
+FAIR_SHARE = False
+# Files of at least LARGE_FILE_THRESHOLD MB are copied by jobs of
+# LARGE_FILE_JOB_QUEUE if it is set
+LARGE_FILE_JOB_QUEUE = None
+LARGE_FILE_THRESHOLD = 0
+# sharded runs: each coordinator copies the rows of its shard and writes its
+# manifests under OUTPUT_PREFIX, see sharding.py
+SHARD_COUNT = 1
+SHARD_INDEX = 0
+OUTPUT_PREFIX = ""
 
 
 def run_job(
@@ -37,6 +178,25 @@ def run_job(
     chunk_size,
     thread_count=NUMBER_OF_THREADS,
     max_retries=MAX_RETRIES,
+    bundle_max_files=BUNDLE_MAX_FILES,
+    bundle_max_size=BUNDLE_MAX_SIZE,
+    bundle_concurrency=BUNDLE_CONCURRENCY,
+    split_threshold=SPLIT_THRESHOLD,
+    split_job_size=SPLIT_JOB_SIZE,
+    track=False,
+    output_compress=OUTPUT_COMPRESS,
+    output_shard_size=OUTPUT_SHARD_SIZE,
+    submission_order=SUBMISSION_ORDER,
+    fair_share=FAIR_SHARE,
+    large_file_job_queue=LARGE_FILE_JOB_QUEUE,
+    large_file_threshold=LARGE_FILE_THRESHOLD,
+    shard_count=SHARD_COUNT,
+    shard_index=SHARD_INDEX,
+    run_id=None,
+    ledger_location=None,
+    copy_from_replicas=COPY_FROM_REPLICAS,
+    gdc_throttle=GDC_THROTTLE,
+    part_concurrency=PART_CONCURRENCY,
 ):
     """
     Start to run an job to generate bucket manifest
@@ -46,7 +206,28 @@ def run_job(
         job_definition(str): job definition name
         output_manifest_bucket(str): output bucket for failure and success manifests
         multi_part_threshold(int): Size in MB. Threshold at which to use single part for small files and multi-part for large files.
-        chunk_size(int): Size in MB. Chunk size at of each part for multipart upload.
+        chunk_size(int): Size in MB. Chunk size at of each part for multipart upload, 0 lets each job size its parts.
+        thread_count(int): number of submission workers
+        max_retries(int): number of attempts to submit a job
+        bundle_max_files(int): maximum number of small files copied by one job, 1 disables bundling
+        bundle_max_size(int): Size in MB. Maximum total size of a bundle of small files.
+        bundle_concurrency(int): number of files of a bundle copied at the same time
+        split_threshold(int): Size in MB. Files at least this large are split across several jobs, 0 disables splitting
+        split_job_size(int): Size in MB. Amount of data uploaded by each job of a split file
+        track(bool): wait for the submitted jobs and write the final manifests
+        output_compress(bool): gzip the output manifests
+        output_shard_size(int): Size in MB. Maximum size of an output manifest file, 0 writes a single file
+        submission_order(str): manifest, largest_first or smallest_first
+        fair_share(bool): set the scheduling priority and share identifier of the jobs
+        large_file_job_queue(str): job queue of the files of at least large_file_threshold, None uses job_queue
+        large_file_threshold(int): Size in MB. Threshold at which files are copied by large_file_job_queue
+        shard_count(int): number of coordinators the manifest is split across
+        shard_index(int): shard copied by this coordinator, between 0 and shard_count - 1
+        run_id(str): id shared by the coordinators of a sharded run, e.g. the Batch array job id
+        ledger_location(str): local directory or s3 location of the submission ledger, defaults to the output bucket. "none" disables it.
+        copy_from_replicas(bool): copy files already replicated by previous runs with an S3 server-side copy
+        gdc_throttle(bool): pause submission while the GDC API is throttling or slow
+        part_concurrency(int): number of parts transferred at the same time by each multipart copy job
 
     Returns:
         bool: True if the job was submitted successfully
@@ -55,13 +236,70 @@ def run_job(
     global MAX_RETRIES
     global MULTI_PART_THRESHOLD
     global CHUNK_SIZE
+    global PART_CONCURRENCY
+    global UPLOAD_STATE_LOCATION
+    global LEDGER_LOCATION
+    global COPY_FROM_REPLICAS
+    global GDC_THROTTLE
+    global TRANSFER_METRICS_LOCATION
+    global BUNDLE_MAX_FILES
+    global BUNDLE_MAX_SIZE
+    global BUNDLE_CONCURRENCY
+    global SPLIT_THRESHOLD
+    global SPLIT_JOB_SIZE
+    global OUTPUT_COMPRESS
+    global OUTPUT_SHARD_SIZE
+    global SUBMISSION_ORDER
+    global FAIR_SHARE
+    global LARGE_FILE_JOB_QUEUE
+    global LARGE_FILE_THRESHOLD
+    global SHARD_COUNT
+    global SHARD_INDEX
+    global OUTPUT_PREFIX
 
     NUMBER_OF_THREADS = int(thread_count)
     MAX_RETRIES = int(max_retries)
     MULTI_PART_THRESHOLD = multi_part_threshold
     CHUNK_SIZE = chunk_size
+    PART_CONCURRENCY = int(part_concurrency)
+    # multipart upload checkpoints are kept next to the output manifests so
+    # that a gdc_copy job restarted on another host can resume its upload
+    UPLOAD_STATE_LOCATION = f"s3://{output_manifest_bucket}/upload_state"
+    if ledger_location is None:
+        ledger_location = f"s3://{output_manifest_bucket}/submission_ledger"
+    LEDGER_LOCATION = None if ledger_location == "none" else ledger_location
+    COPY_FROM_REPLICAS = bool(copy_from_replicas)
+    GDC_THROTTLE = bool(gdc_throttle)
+    BUNDLE_MAX_FILES = int(bundle_max_files)
+    BUNDLE_MAX_SIZE = int(bundle_max_size)
+    BUNDLE_CONCURRENCY = int(bundle_concurrency)
+    SPLIT_THRESHOLD = int(split_threshold)
+    SPLIT_JOB_SIZE = int(split_job_size)
+    OUTPUT_COMPRESS = bool(output_compress)
+    OUTPUT_SHARD_SIZE = int(output_shard_size)
+    SUBMISSION_ORDER = submission_order
+    FAIR_SHARE = bool(fair_share)
+    LARGE_FILE_JOB_QUEUE = large_file_job_queue or None
+    LARGE_FILE_THRESHOLD = int(large_file_threshold)
+    SHARD_COUNT = int(shard_count)
+    SHARD_INDEX = int(shard_index)
+    if not 0 <= SHARD_INDEX < SHARD_COUNT:
+        raise ValueError(f"Shard index {SHARD_INDEX} not in [0, {SHARD_COUNT})")
+    if SHARD_COUNT > 1 and not run_id:
+        raise ValueError("A sharded run needs a run id")
 
     START_TIME = int(time.time())
+    if SHARD_COUNT > 1:
+        OUTPUT_PREFIX = shard_prefix(run_id, SHARD_INDEX)
+        # the shards of a run share their transfer metrics
+        TRANSFER_METRICS_LOCATION = (
+            f"s3://{output_manifest_bucket}/transfer_metrics/{run_id}"
+        )
+    else:
+        OUTPUT_PREFIX = ""
+        TRANSFER_METRICS_LOCATION = (
+            f"s3://{output_manifest_bucket}/transfer_metrics/{START_TIME}"
+        )
     logging.info(
         f"Submission Job started at {START_TIME} with {NUMBER_OF_THREADS} threads and {MAX_RETRIES} retries."
     )
@@ -70,17 +308,71 @@ def run_job(
         f"Number of threads: {NUMBER_OF_THREADS} \n"
         f"Multi-part threashold: {MULTI_PART_THRESHOLD} GB \n"
         f"Multi-part chunk size: {CHUNK_SIZE} \n"
+        f"Part concurrency: {PART_CONCURRENCY} \n"
+        f"Bundle size: {BUNDLE_MAX_FILES} files / {BUNDLE_MAX_SIZE} MB \n"
+        f"Split threshold: {SPLIT_THRESHOLD} MB, {SPLIT_JOB_SIZE} MB per job \n"
+        f"Submission order: {SUBMISSION_ORDER}, fair share: {FAIR_SHARE} \n"
+        f"Large file job queue: {LARGE_FILE_JOB_QUEUE} from {LARGE_FILE_THRESHOLD} MB \n"
+        f"Shard: {SHARD_INDEX} of {SHARD_COUNT}, run {run_id} \n"
+        f"Copy from replicas: {COPY_FROM_REPLICAS} \n"
+        f"GDC throttle: {GDC_THROTTLE} \n"
         f"==========================="
     )
 
     local_manifest = get_manifest_from_bucket(manifest_file)
-    parsed_data = parse_manifest_file(local_manifest)
-    submitted, skipped, failed = submit_jobs(
-        parsed_data,
-        job_queue,
-        job_definition,
-        output_manifest_bucket,
-    )
+    routing = get_routing_table()
+    unknown_projects = find_unknown_projects(local_manifest, routing)
+    if unknown_projects:
+        raise ValueError(
+            f"Projects not found in the mapping: {unknown_projects}. "
+            f"Available projects: {list(PROJECT_ACL.keys())}"
+        )
+    manifest_rows = ManifestRows(local_manifest, routing, (SHARD_INDEX, SHARD_COUNT))
+    ledger = None
+    if LEDGER_LOCATION:
+        ledger_bucket = LEDGER_LOCATION.replace("s3://", "", 1).split("/")[0]
+        ledger = SubmissionLedger(
+            get_bucket_client(ledger_bucket, profile_name="default")
+            if LEDGER_LOCATION.startswith("s3://")
+            else None,
+            LEDGER_LOCATION,
+            ledger_key(manifest_file, SHARD_INDEX, SHARD_COUNT),
+        )
+        resumed = ledger.load()
+        if resumed:
+            logging.info(
+                f"Resuming from ledger {ledger.run_key}: {resumed} files already skipped or submitted"
+            )
+    content_index = None
+    if COPY_FROM_REPLICAS:
+        content_index = ContentIndex()
+        content_index.build(
+            get_bucket_client(output_manifest_bucket, profile_name="default"),
+            output_manifest_bucket,
+        )
+    gdc = GDCClient(GDC_TOKEN) if GDC_THROTTLE else None
+    try:
+        submitted, skipped, failed = submit_jobs(
+            manifest_rows,
+            job_queue,
+            job_definition,
+            output_manifest_bucket,
+            track,
+            ledger,
+            content_index,
+            SubmissionThrottle(gdc) if gdc else None,
+        )
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if content_index is not None:
+            content_index.close()
+        if gdc is not None:
+            gdc.close()
+    write_validation_report(manifest_rows.report, output_manifest_bucket)
+    # the throughput of a sharded run is reported by merge_shard_manifests
+    if track and SHARD_COUNT == 1:
+        write_throughput_report(TRANSFER_METRICS_LOCATION, output_manifest_bucket)
 
     logging.info(f"Job submission summary:")
     logging.info(f"Submitted: {submitted} jobs")
@@ -90,65 +382,132 @@ def run_job(
     logging.info(f"Job ending time is {int(time.time())}")
 
 
-def submit_job(job_queue, job_definition, file):
-    key = file["id"] + "/" + file["file_name"]
-    session = boto3.Session(profile_name="default")
+def index_destinations(file_info):
+    """
+    Check and list the destination buckets of the files
 
-    s3 = session.client("s3")
+    Each destination bucket is checked once and listed into a
+    DestinationIndex, instead of a head_bucket and a head_object per file.
 
-    # Pre-check if bucket exists
-    if not check_bucket_exists(s3, file["destination_bucket"]):
-        logging.error(
-            "Destination bucket does not exist in s3: {}".format(
-                file["destination_bucket"]
-            )
-        )
-        file[JOB_STATUS_KEY] = "FAILED"
-        return file
+    Args:
+        file_info(iterable(dict)): parsed manifest rows
+
+    Returns:
+        tuple(DestinationIndex, dict): the index and bucket -> whether it exists
+    """
+    # only the keys of buckets listed by prefix are needed, a bucket with more
+    # rows than PREFIX_LISTING_THRESHOLD is listed entirely
+    keys_by_bucket = {}
+    for fi in file_info:
+        keys = keys_by_bucket.setdefault(fi["destination_bucket"], [])
+        if len(keys) <= PREFIX_LISTING_THRESHOLD:
+            keys.append(fi["id"] + "/" + fi["file_name"])
 
-    # Pre-check if file already exists
-    exists, message = check_file_exists(
-        s3,
-        file["destination_bucket"],
-        key,
-        int(file["size"]),
-        file["md5"],
+    # each bucket is listed in its own region
+    clients = {
+        bucket: get_bucket_client(bucket, profile_name="default")
+        for bucket in keys_by_bucket
+    }
+    bucket_exists = {}
+    for bucket in keys_by_bucket:
+        bucket_exists[bucket] = check_bucket_exists(clients[bucket], bucket)
+
+    index = DestinationIndex(clients=clients.get)
+    index.build(
+        {
+            bucket: keys
+            for bucket, keys in keys_by_bucket.items()
+            if bucket_exists[bucket]
+        }
     )
+    return index, bucket_exists
+
 
+def check_destination(index, bucket_exists, fi):
+    """
+    Check whether a file still has to be copied
+
+    Files whose bucket does not exist are marked FAILED and files that
+    already exist with the expected size are marked SKIPPED.
+
+    Returns:
+        bool: True if the file has to be copied
+    """
+    bucket = fi["destination_bucket"]
+    key = fi["id"] + "/" + fi["file_name"]
+    if not bucket_exists.get(bucket):
+        logging.error("Destination bucket does not exist in s3: {}".format(bucket))
+        fi[JOB_STATUS_KEY] = "FAILED"
+        return False
+
+    if bucket in index.indexed_buckets:
+        exists, message = index.check_file_exists(bucket, key, int(fi["size"]))
+    else:
+        s3 = get_bucket_client(bucket, profile_name="default")
+        exists, message = check_file_exists(s3, bucket, key, int(fi["size"]), fi["md5"])
     if exists:
         logging.info(f"Skipping {key}: {message}")
-        file[JOB_STATUS_KEY] = "SKIPPED"
-        return file
+        fi[JOB_STATUS_KEY] = "SKIPPED"
+        return False
+    return True
+
+
+def precheck_files(file_info):
+    """
+    Check the destination of every file before submission, see
+    `index_destinations` and `check_destination`
 
-    client = boto3.client("batch", region_name=REGION)
+    Args:
+        file_info(list(dict)): parsed manifest rows
+
+    Returns:
+        list(dict): the files that still have to be copied
+    """
+    start_time = time.time()
+    index, bucket_exists = index_destinations(file_info)
+    with index:
+        pending = [
+            fi for fi in file_info if check_destination(index, bucket_exists, fi)
+        ]
+
+    logging.info(
+        f"Pre-checked {len(file_info)} files in {int(time.time() - start_time)}s, "
+        f"{len(pending)} to be copied"
+    )
+    return pending
+
+
+def submit_batch_job(job_queue, job_definition, job_name, environment, **kwargs):
+    """
+    Submit a Batch job, retrying throttled and failed calls
+
+    Args:
+        job_queue(str): job queue name
+        job_definition(str): job definition name
+        job_name(str): job name
+        environment(dict): container environment variables
+        kwargs: extra arguments for Batch submit_job
+
+    Returns:
+        str: the job id, None if the job could not be submitted
+    """
+    client = get_client("batch", region_name=REGION)
     n_tries = 0
     while n_tries < MAX_RETRIES:
         try:
-            client.submit_job(
-                jobName="gdc_copy",
+            response = client.submit_job(
+                jobName=job_name,
                 jobQueue=job_queue,
                 jobDefinition=job_definition,
                 containerOverrides={
                     "environment": [
-                        {"value": file["id"], "name": "ID"},
-                        {"value": file["file_name"], "name": "FILE_NAME"},
-                        {"value": file["size"], "name": "SIZE"},
-                        {"value": file["md5"], "name": "MD5SUM"},
-                        {
-                            "value": file["destination_bucket"],
-                            "name": "DESTINATION_BUCKET",
-                        },
-                        {"value": key, "name": "KEY"},
-                        {"value": GDC_TOKEN, "name": "GDC_TOKEN"},
-                        {"value": "default", "name": "PROFILE_NAME"},
-                        {"value": MULTI_PART_THRESHOLD, "name": "MULTI_PART_THRESHOLD"},
-                        {"value": CHUNK_SIZE, "name": "CHUNK_SIZE"},
+                        {"value": str(value), "name": name}
+                        for name, value in environment.items()
                     ]
                 },
+                **kwargs,
             )
-            logging.info("submitting job to copy file {}".format(key))
-            file[JOB_STATUS_KEY] = "SUBMITTED"
-            return file
+            return response["jobId"]
         except ClientError as e:
             if e.response["Error"]["Code"] == "AccessDeniedException":
                 logging.error(
@@ -162,7 +521,439 @@ def submit_job(job_queue, job_definition, file):
                 logging.info("{}. Retry {}".format(e, n_tries))
 
         time.sleep(2**n_tries)
-    file[JOB_STATUS_KEY] = "FAILED"
+    return None
+
+
+def job_placement(job_queue, file):
+    """
+    Choose the job queue and the scheduling parameters of the job of a file
+
+    Args:
+        job_queue(str): default job queue name
+        file(dict): file info, or the total size and project of a bundle
+
+    Returns:
+        tuple(str, dict): the job queue and extra arguments for Batch submit_job
+    """
+    size = int(file["size"])
+    if LARGE_FILE_JOB_QUEUE and size >= LARGE_FILE_THRESHOLD * 1024 * 1024:
+        job_queue = LARGE_FILE_JOB_QUEUE
+    if not FAIR_SHARE:
+        return job_queue, {}
+    return job_queue, scheduling_parameters(file, SUBMISSION_ORDER)
+
+
+def submit_job(job_queue, job_definition, file):
+    key = file["id"] + "/" + file["file_name"]
+    job_queue, placement = job_placement(job_queue, file)
+    job_id = submit_batch_job(
+        job_queue,
+        job_definition,
+        "gdc_copy",
+        {
+            "ID": file["id"],
+            "FILE_NAME": file["file_name"],
+            "SIZE": file["size"],
+            "MD5SUM": file["md5"],
+            "DESTINATION_BUCKET": file["destination_bucket"],
+            "KEY": key,
+            "GDC_TOKEN": GDC_TOKEN,
+            "PROFILE_NAME": "default",
+            "MULTI_PART_THRESHOLD": MULTI_PART_THRESHOLD,
+            "CHUNK_SIZE": CHUNK_SIZE,
+            "CONCURRENCY": PART_CONCURRENCY,
+            "UPLOAD_STATE_LOCATION": UPLOAD_STATE_LOCATION,
+            "METRICS_LOCATION": TRANSFER_METRICS_LOCATION or "",
+        },
+        **placement,
+    )
+    if job_id is None:
+        file[JOB_STATUS_KEY] = "FAILED"
+        return file
+
+    logging.info("submitting job to copy file {}".format(key))
+    file[JOB_STATUS_KEY] = "SUBMITTED"
+    file[JOB_ID_KEY] = job_id
+    return file
+
+
+def copy_replica(job_queue, job_definition, item):
+    """
+    Copy a file from a replica already in one of our buckets with an S3
+    server-side copy
+
+    The replica must have the size of the file and a content that can be
+    checked, see `replica_copy.check_replica`; otherwise a gdc_copy job is
+    submitted instead, see `submit_job`. Replicas of at least
+    REPLICA_JOB_THRESHOLD bytes are copied by a gdc_copy_replica job, so that
+    a long copy does not hold up a submission worker.
+
+    Args:
+        job_queue(str): job queue name
+        job_definition(str): job definition name
+        item(tuple(dict, str, str)): file info, s3 url of the replica and the
+            checksum recorded for it
+
+    Returns:
+        dict: the file info with a COPIED, SUBMITTED or FAILED job status
+    """
+    file, source, checksum = item
+    key = file["id"] + "/" + file["file_name"]
+    size = int(file["size"])
+    try:
+        source_s3 = get_bucket_client(split_s3_url(source)[0], profile_name="default")
+        check_replica(source_s3, source, size, file["md5"], checksum)
+        if size >= REPLICA_JOB_THRESHOLD:
+            return submit_replica_job(job_queue, job_definition, file, source, checksum)
+        s3 = get_bucket_client(file["destination_bucket"], profile_name="default")
+        copy_replica_object(
+            source_s3,
+            s3,
+            source,
+            file["destination_bucket"],
+            key,
+            size,
+            REPLICA_COPY_CONCURRENCY,
+        )
+    except (ClientError, ValueError) as e:
+        logging.warning(f"Can not copy {key} from {source}, submitting a job. {e}")
+        return submit_job(job_queue, job_definition, file)
+
+    logging.info(f"Copied {key} from {source}")
+    file[JOB_STATUS_KEY] = "COPIED"
+    return file
+
+
+def submit_replica_job(job_queue, job_definition, file, source, checksum):
+    """
+    Submit a job copying a file from a checked replica, see
+    `file_get_upload.copy_from_replica`
+
+    Returns:
+        dict: the file info with a SUBMITTED or FAILED job status
+    """
+    key = file["id"] + "/" + file["file_name"]
+    job_queue, placement = job_placement(job_queue, file)
+    job_id = submit_batch_job(
+        job_queue,
+        job_definition,
+        "gdc_copy_replica",
+        {
+            "ID": file["id"],
+            "SIZE": file["size"],
+            "MD5SUM": file["md5"],
+            "DESTINATION_BUCKET": file["destination_bucket"],
+            "KEY": key,
+            "REPLICA_SOURCE": source,
+            "REPLICA_CHECKSUM": checksum,
+            "CONCURRENCY": REPLICA_COPY_CONCURRENCY,
+            "PROFILE_NAME": "default",
+        },
+        **placement,
+    )
+    if job_id is None:
+        file[JOB_STATUS_KEY] = "FAILED"
+        return file
+
+    logging.info(f"submitting job to copy {key} from {source}")
+    file[JOB_STATUS_KEY] = "SUBMITTED"
+    file[JOB_ID_KEY] = job_id
+    return file
+
+
+class Bundler:
+    """
+    Group files by destination bucket into bundles as they arrive
+
+    Args:
+        max_files(int): maximum number of files in a bundle
+        max_bytes(int): maximum total size of a bundle, a file larger than
+            this gets a bundle of its own
+    """
+
+    def __init__(self, max_files, max_bytes):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._open_bundles = {}
+
+    def add(self, fi):
+        """
+        Returns:
+            list(dict): a full bundle of the file's bucket, None if not full yet
+        """
+        full = None
+        bucket = fi["destination_bucket"]
+        bundle, size = self._open_bundles.get(bucket, ([], 0))
+        if bundle and (
+            len(bundle) >= self.max_files or size + int(fi["size"]) > self.max_bytes
+        ):
+            full = bundle
+            bundle, size = [], 0
+        bundle.append(fi)
+        self._open_bundles[bucket] = (bundle, size + int(fi["size"]))
+        return full
+
+    def flush(self):
+        """
+        Returns:
+            list(list(dict)): the bundles that are not full
+        """
+        bundles = [bundle for bundle, _ in self._open_bundles.values() if bundle]
+        self._open_bundles = {}
+        return bundles
+
+
+def make_bundles(file_info, max_files, max_bytes):
+    """
+    Group files by destination bucket into bundles, see `Bundler`
+
+    Yields:
+        list(dict): the files of a bundle, all with the same destination bucket
+    """
+    bundler = Bundler(max_files, max_bytes)
+    for fi in file_info:
+        bundle = bundler.add(fi)
+        if bundle:
+            yield bundle
+    yield from bundler.flush()
+
+
+def submit_bundle_job(
+    job_queue, job_definition, output_manifest_bucket, run_id, numbered_bundle
+):
+    """
+    Write a bundle of files to a shard file on s3 and submit one job copying it
+
+    The worker copies the files of the shard concurrently and writes one
+    result record per file next to the shard, under bundle_results/.
+
+    Args:
+        job_queue(str): job queue name
+        job_definition(str): job definition name
+        output_manifest_bucket(str): bucket the shard and results are written to
+        run_id(str): identifier of this submission run
+        numbered_bundle(tuple(int, list(dict))): bundle number and files
+
+    Returns:
+        list(dict): the files of the bundle with their job status
+    """
+    number, bundle = numbered_bundle
+    name = f"{bundle[0]['destination_bucket']}_{number:06d}"
+    shard_key = f"bundles/{run_id}/{name}.tsv"
+    results_key = f"bundle_results/{run_id}/{name}.jsonl"
+    job_queue, placement = job_placement(
+        job_queue,
+        {
+            "size": sum(int(fi["size"]) for fi in bundle),
+            "project_id": bundle[0].get("project_id"),
+        },
+    )
+
+    csv_buffer = io.StringIO()
+    writer = csv.DictWriter(
+        csv_buffer, fieldnames=BUNDLE_FIELDS, delimiter="\t", extrasaction="ignore"
+    )
+    writer.writeheader()
+    writer.writerows(bundle)
+
+    job_id = None
+    try:
+        s3 = get_bucket_client(output_manifest_bucket, profile_name="default")
+        s3.put_object(
+            Bucket=output_manifest_bucket, Key=shard_key, Body=csv_buffer.getvalue()
+        )
+        job_id = submit_batch_job(
+            job_queue,
+            job_definition,
+            "gdc_copy_bundle",
+            {
+                "BUNDLE_MANIFEST": f"s3://{output_manifest_bucket}/{shard_key}",
+                "BUNDLE_RESULTS": f"s3://{output_manifest_bucket}/{results_key}",
+                "BUNDLE_CONCURRENCY": BUNDLE_CONCURRENCY,
+                "GDC_TOKEN": GDC_TOKEN,
+                "PROFILE_NAME": "default",
+            },
+            **placement,
+        )
+    except ClientError as e:
+        logging.error(f"Can not write bundle {shard_key}. Detail {e}")
+
+    for fi in bundle:
+        if job_id is None:
+            fi[JOB_STATUS_KEY] = "FAILED"
+        else:
+            fi[JOB_STATUS_KEY] = "SUBMITTED"
+            fi[JOB_ID_KEY] = job_id
+            fi[BUNDLE_RESULTS_KEY] = f"s3://{output_manifest_bucket}/{results_key}"
+    if job_id is not None:
+        logging.info(
+            f"submitting job to copy bundle {shard_key} of {len(bundle)} files"
+        )
+    return bundle
+
+
+def split_digest_location(output_manifest_bucket, file_id):
+    """
+    Returns:
+        str: s3 location of the part digests of the split upload of a file
+    """
+    return f"s3://{output_manifest_bucket}/split_parts/{file_id}"
+
+
+def abort_split_upload(output_manifest_bucket, file, upload_id):
+    """
+    Abort the multipart upload of a split file and delete its part digests
+
+    Returns:
+        bool: True if the upload was aborted or no longer exists
+    """
+    key = file["id"] + "/" + file["file_name"]
+    s3 = get_bucket_client(file["destination_bucket"], profile_name="default")
+    try:
+        s3.abort_multipart_upload(
+            Bucket=file["destination_bucket"], Key=key, UploadId=upload_id
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchUpload":
+            logging.error(f"Can not abort multipart upload of {key}. Detail {e}")
+            return False
+    try:
+        delete_part_digests(
+            get_bucket_client(output_manifest_bucket, profile_name="default"),
+            split_digest_location(output_manifest_bucket, file["id"]),
+        )
+    except ClientError as e:
+        logging.warning(f"Can not delete the part digests of {key}. Detail {e}")
+    return True
+
+
+def find_split_upload(output_manifest_bucket, file, chunk_size):
+    """
+    Find the multipart upload of a split file left in progress by an earlier
+    run, e.g. one whose part jobs failed before the tracking could abort it
+
+    The upload is reused only if it has the checksum algorithm of split
+    uploads and its parts have `chunk_size`, otherwise it is aborted.
+
+    Returns:
+        str: id of the upload to reuse, None if there is none
+    """
+    key = file["id"] + "/" + file["file_name"]
+    bucket = file["destination_bucket"]
+    size = int(file["size"])
+    s3 = get_bucket_client(bucket, profile_name="default")
+    upload_id = find_in_progress_upload(s3, bucket, key)
+    if upload_id is None:
+        return None
+    algorithm = upload_checksum_algorithm(s3, bucket, key, upload_id)
+    part_count = -(-size // chunk_size)
+    last_size = size - (part_count - 1) * chunk_size
+    parts = list_uploaded_parts(s3, bucket, key, upload_id)
+    if algorithm == SPLIT_CHECKSUM_ALGORITHM and all(
+        part["PartNumber"] <= part_count
+        and part["Size"]
+        == (last_size if part["PartNumber"] == part_count else chunk_size)
+        for part in parts
+    ):
+        return upload_id
+    logging.info(f"Multipart upload {upload_id} of {key} can not be reused")
+    abort_split_upload(output_manifest_bucket, file, upload_id)
+    return None
+
+
+def submit_split_job(job_queue, job_definition, output_manifest_bucket, file):
+    """
+    Copy a large file with an array of part-range jobs and a finalize job
+
+    The multipart upload is created here and shared by the jobs of the array,
+    job i uploading the parts i * parts_per_job + 1 to (i + 1) * parts_per_job
+    and recording their digests under split_parts/ in the output manifest
+    bucket. The finalize job depends on the array, checks the parts against
+    the digests and completes the upload. An upload of the file left in
+    progress by an earlier run is reused, see `find_split_upload`, and the
+    part jobs only transfer the parts it does not have a digest for.
+
+    Args:
+        job_queue(str): job queue name
+        job_definition(str): job definition name
+        output_manifest_bucket(str): bucket the part digests are written to
+        file(dict): file info
+
+    Returns:
+        dict: the file info with its job status, the job id is the finalize job
+    """
+    key = file["id"] + "/" + file["file_name"]
+    # the jobs of the array share one part size, large enough for the file
+    # to fit in the S3 part limit
+    chunk_size = plan_part_size(int(file["size"]), int(CHUNK_SIZE) * MB)
+    part_count = -(-int(file["size"]) // chunk_size)
+    parts_per_job = max(1, SPLIT_JOB_SIZE // (chunk_size // MB))
+    parts_per_job = max(parts_per_job, -(-part_count // MAX_ARRAY_SIZE))
+    job_count = -(-part_count // parts_per_job)
+    if job_count < 2:
+        return submit_job(job_queue, job_definition, file)
+    split_job_queue, placement = job_placement(job_queue, file)
+
+    s3 = get_bucket_client(file["destination_bucket"], profile_name="default")
+    try:
+        upload_id = find_split_upload(output_manifest_bucket, file, chunk_size)
+        if upload_id:
+            logging.info(f"Resuming multipart upload {upload_id} of {key}")
+        else:
+            upload_id = s3.create_multipart_upload(
+                Bucket=file["destination_bucket"],
+                Key=key,
+                ACL="bucket-owner-full-control",
+                ChecksumAlgorithm=SPLIT_CHECKSUM_ALGORITHM,
+            )["UploadId"]
+    except ClientError as e:
+        logging.error(f"Can not start multipart upload of {key}. Detail {e}")
+        file[JOB_STATUS_KEY] = "FAILED"
+        return file
+
+    environment = {
+        "ID": file["id"],
+        "SIZE": file["size"],
+        "MD5SUM": file["md5"],
+        "DESTINATION_BUCKET": file["destination_bucket"],
+        "KEY": key,
+        "GDC_TOKEN": GDC_TOKEN,
+        "PROFILE_NAME": "default",
+        "CHUNK_SIZE": chunk_size // MB,
+        "CONCURRENCY": PART_CONCURRENCY,
+        "SPLIT_UPLOAD_ID": upload_id,
+        "SPLIT_PARTS_PER_JOB": parts_per_job,
+        "SPLIT_DIGESTS": split_digest_location(output_manifest_bucket, file["id"]),
+    }
+    finalize_job_id = None
+    parts_job_id = submit_batch_job(
+        split_job_queue,
+        job_definition,
+        "gdc_copy_parts",
+        {**environment, "SPLIT_ACTION": "upload_parts"},
+        arrayProperties={"size": job_count},
+        **placement,
+    )
+    if parts_job_id is not None:
+        finalize_job_id = submit_batch_job(
+            split_job_queue,
+            job_definition,
+            "gdc_copy_finalize",
+            {**environment, "SPLIT_ACTION": "finalize_upload"},
+            dependsOn=[{"jobId": parts_job_id}],
+            **placement,
+        )
+
+    if finalize_job_id is None:
+        # part jobs that were submitted fail once the upload is aborted
+        abort_split_upload(output_manifest_bucket, file, upload_id)
+        file[JOB_STATUS_KEY] = "FAILED"
+        return file
+
+    logging.info(f"submitting {job_count} jobs to copy file {key}")
+    file[JOB_STATUS_KEY] = "SUBMITTED"
+    file[JOB_ID_KEY] = finalize_job_id
+    file[UPLOAD_ID_KEY] = upload_id
     return file
 
 
@@ -171,118 +962,641 @@ def submit_jobs(
     job_queue,
     job_definition,
     output_manifest_bucket,
+    track=False,
+    ledger=None,
+    content_index=None,
+    throttle=None,
 ):
     """
     Submit jobs to the queue
 
+    `file_info` is iterated twice, once to index the destination buckets and
+    once to submit, and is never held in memory: the files are handed to the
+    submission pool SUBMIT_CHUNK_SIZE at a time and the output manifests are
+    written as results come back. The ids of the submitted jobs are written to
+    a dcf_aws_batch_jobs manifest that `run_tracking` can follow later.
+    Files that are not already at their destination are submitted in
+    SUBMISSION_ORDER, see `scheduling.order_files`.
+
+    With a ledger, the outcome of every file is recorded as soon as its job
+    is submitted, see `SubmissionLedger.record`, and files the ledger holds
+    as skipped or submitted by an interrupted run are written to the
+    manifests without being checked or submitted again.
+
+    With a content index, files whose content is already in one of our
+    buckets are copied from there, see `copy_replica`, and written to a
+    dcf_aws_batch_copied manifest.
+
+    With a throttle, submission of the jobs that download from GDC pauses
+    before each chunk while the GDC API is under load.
+
     Args:
-        file_info(dict): file info
+        file_info(iterable(dict)): file info, e.g. a list or ManifestRows
         job_queue(str): job queue name
         job_definition(str): job definition name
+        output_manifest_bucket(str): output bucket for the manifests
+        track(bool): wait for the submitted jobs, see `track_jobs`. The
+            submitted files are then kept in memory until they finish.
+        ledger(SubmissionLedger): loaded ledger of the run, None to submit
+            every file
+        content_index(ContentIndex): replicas of previous runs, None to copy
+            every file from GDC
+        throttle(SubmissionThrottle): throttle of the submission, None to
+            submit as fast as the pool allows
 
     Returns:
-        bool: True if the job was submitted successfully
+        tuple(int, int, int): number of files submitted, skipped and failed
     """
-
     par_submit_job = partial(submit_job, job_queue, job_definition)
+    par_submit_bundle_job = partial(
+        submit_bundle_job,
+        job_queue,
+        job_definition,
+        output_manifest_bucket,
+        datetime.datetime.now().strftime("%Y%m%d%H%M%S%f"),
+    )
+    par_submit_split_job = partial(
+        submit_split_job, job_queue, job_definition, output_manifest_bucket
+    )
+    par_copy_replica = partial(copy_replica, job_queue, job_definition)
 
-    submitted_count = 0
-    skipped_count = 0
-    failed_count = 0
-    submitted_output_manifest = []
-    skipped_output_manifest = []
-    failed_output_manifest = []
-
-    with Pool(NUMBER_OF_THREADS) as pool:
-        results = pool.map(par_submit_job, file_info)
-
-    for result in results:
-        if result[JOB_STATUS_KEY] == "SUBMITTED":
-            submitted_count += 1
-            submitted_output_manifest.append(
-                convert_file_info_to_output_manifest(result)
+    stack = ExitStack()
+    manifests = {
+        status: stack.enter_context(
+            open_output_manifest(
+                output_manifest_bucket, f"dcf_aws_batch_{status.lower()}"
             )
-        elif result[JOB_STATUS_KEY] == "SKIPPED":
-            skipped_count += 1
-            skipped_output_manifest.append(convert_file_info_to_output_manifest(result))
-        elif result[JOB_STATUS_KEY] == "FAILED":
-            failed_count += 1
-            failed_output_manifest.append(convert_file_info_to_output_manifest(result))
-
-    write_output_manifest_to_s3_file(
-        submitted_output_manifest, output_manifest_bucket, "dcf_aws_batch_submitted"
+        )
+        for status in ("SUBMITTED", "SKIPPED", "FAILED", "COPIED")
+    }
+    jobs_manifest = stack.enter_context(
+        open_output_manifest(
+            output_manifest_bucket, "dcf_aws_batch_jobs", JOBS_MANIFEST_FIELDS
+        )
+    )
+    if ledger is not None:
+        # the records pending when submission stops on an error are written
+        stack.callback(ledger.flush)
+    submitted_files = []
+
+    def record(fi, resumed=False):
+        if ledger is not None and not resumed:
+            ledger.record(fi)
+        manifests[fi[JOB_STATUS_KEY]].writerow(convert_file_info_to_output_manifest(fi))
+        if fi[JOB_STATUS_KEY] == "SUBMITTED":
+            jobs_manifest.writerow(fi)
+            if track:
+                submitted_files.append(fi)
+
+    split_threshold = SPLIT_THRESHOLD * 1024 * 1024
+    bundle_threshold = int(MULTI_PART_THRESHOLD) * 1024 * 1024
+    bundler = Bundler(BUNDLE_MAX_FILES, BUNDLE_MAX_SIZE * 1024 * 1024)
+    queued = {"replica": [], "split": [], "single": [], "bundle": []}
+    bundle_count = 0
+
+    def submit_queued(pool):
+        # results are recorded as they come back rather than once the chunk
+        # is done, so that the ledger knows the jobs already submitted
+        for fi in pool.imap(par_copy_replica, queued["replica"]):
+            record(fi)
+        if throttle is not None and (
+            queued["split"] or queued["single"] or queued["bundle"]
+        ):
+            throttle.wait()
+        for fi in pool.imap(par_submit_split_job, queued["split"]):
+            record(fi)
+        for fi in pool.imap(par_submit_job, queued["single"]):
+            record(fi)
+        for bundle in pool.imap(par_submit_bundle_job, queued["bundle"]):
+            for fi in bundle:
+                record(fi)
+        for files in queued.values():
+            files.clear()
+
+    start_time = time.time()
+    index, bucket_exists = index_destinations(
+        fi for fi in file_info if ledger is None or fi["id"] not in ledger
+    )
+    logging.info(f"Indexed destinations in {int(time.time() - start_time)}s")
+
+    def pending_files():
+        for fi in file_info:
+            if ledger is not None and ledger.resume(fi):
+                record(fi, resumed=True)
+            elif check_destination(index, bucket_exists, fi):
+                yield fi
+            else:
+                record(fi)
+
+    with stack, index, Pool(
+        NUMBER_OF_THREADS,
+        initializer=init_clients,
+        initargs=(
+            [
+                {"service_name": "batch", "region_name": REGION},
+                {"service_name": "s3", "profile_name": "default"},
+            ],
+        ),
+    ) as pool:
+        for fi in order_files(pending_files(), SUBMISSION_ORDER):
+            size = int(fi["size"])
+            source = None
+            if content_index is not None:
+                destination = (
+                    f"s3://{fi['destination_bucket']}/{fi['id']}/{fi['file_name']}"
+                )
+                source = content_index.lookup(fi["md5"], size, exclude=destination)
+            if source:
+                # the content is already in one of our buckets
+                queued["replica"].append((fi, *source))
+            elif SPLIT_THRESHOLD > 0 and size >= split_threshold:
+                # very large files are split across several jobs
+                queued["split"].append(fi)
+            elif BUNDLE_MAX_FILES > 1 and size < bundle_threshold:
+                # small files are copied in bundles, one job per bundle
+                bundle = bundler.add(fi)
+                if bundle:
+                    queued["bundle"].append((bundle_count, bundle))
+                    bundle_count += 1
+            else:
+                queued["single"].append(fi)
+
+            if sum(len(files) for files in queued.values()) >= SUBMIT_CHUNK_SIZE:
+                submit_queued(pool)
+
+        for bundle in bundler.flush():
+            queued["bundle"].append((bundle_count, bundle))
+            bundle_count += 1
+        submit_queued(pool)
+
+    if ledger is not None:
+        ledger.complete()
+    if manifests["COPIED"].count:
+        logging.info(
+            f"Copied {manifests['COPIED'].count} files from replicas in our buckets"
+        )
+    if throttle is not None and throttle.waited:
+        logging.info(
+            f"Submission paused {throttle.waited:.0f}s while the GDC API was under load"
+        )
+    if track:
+        track_jobs(submitted_files, output_manifest_bucket)
+
+    return (
+        manifests["SUBMITTED"].count,
+        manifests["SKIPPED"].count,
+        manifests["FAILED"].count,
+    )
+
+
+def read_bundle_results(results_url):
+    """
+    Read the result records written by the job of a bundle, see
+    `file_get_upload.copy_bundle`
+
+    Returns:
+        dict: file id -> result record, None if the job wrote no results
+    """
+    bucket, _, key = results_url.replace("s3://", "", 1).partition("/")
+    try:
+        s3 = get_bucket_client(bucket, profile_name="default")
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as e:
+        logging.warning(f"Can not read bundle results {results_url}. Detail {e}")
+        return None
+    results = {}
+    for line in body.decode("utf-8").splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        results[result["id"]] = result
+    return results
+
+
+def file_outcomes(job, files):
+    """
+    Outcome of each file copied by a finished job
+
+    The files of a bundle get the status recorded for them by the bundle job,
+    since a bundle job fails if any of its files failed. Files without a
+    result record get the status of the job.
+
+    Args:
+        job(dict): the job, as described by Batch
+        files(list(dict)): the files copied by the job
+
+    Yields:
+        tuple(dict, bool, str): file info, whether the file was copied and
+        the reason it was not
+    """
+    succeeded = job["status"] == "SUCCEEDED"
+    reason = job.get("statusReason", "")
+    results = None
+    if files[0].get(BUNDLE_RESULTS_KEY):
+        results = read_bundle_results(files[0][BUNDLE_RESULTS_KEY])
+    for fi in files:
+        result = (results or {}).get(fi["id"])
+        if result is None:
+            yield fi, succeeded, "" if succeeded else reason
+        elif result["status"] in BUNDLE_COPIED_STATUSES:
+            yield fi, True, ""
+        else:
+            yield fi, False, result.get("error") or reason
+
+
+def track_jobs(
+    files,
+    output_manifest_bucket,
+    poll_interval_min=POLL_INTERVAL_MIN,
+    poll_interval_max=POLL_INTERVAL_MAX,
+):
+    """
+    Wait for the submitted jobs to finish and write the final manifests
+
+    - dcf_aws_batch_completed: output manifest of the files that were
+      copied, with the checksum S3 stored for the object ("<algorithm>:<value>"),
+      read with a HEAD request
+    - dcf_aws_batch_incomplete: output manifest of the files whose job
+      failed, with the job id and reason
+    - dcf_aws_batch_resubmit: the failed files in the GDC manifest format,
+      to be passed back as --manifest_path
+
+    The multipart upload of a split file whose jobs failed is aborted and its
+    part digests deleted, see `abort_split_upload`.
+
+    The manifests are streamed to S3 as jobs finish; when output manifests
+    are sharded, each shard is available as soon as it is full.
+
+    The files of a bundle get the status the bundle job recorded for each of
+    them, see `file_outcomes`, so that only the files it could not copy are
+    written to the incomplete and resubmit manifests.
+
+    Args:
+        files(list(dict)): submitted files, with their job id
+        output_manifest_bucket(str): output bucket for the manifests
+
+    Returns:
+        tuple(int, int): number of files copied and failed
+    """
+    files_by_job = {}
+    for fi in files:
+        files_by_job.setdefault(fi[JOB_ID_KEY], []).append(fi)
+
+    logging.info(f"Tracking {len(files_by_job)} jobs copying {len(files)} files")
+    batch = get_client("batch", region_name=REGION)
+
+    def checksum(fi):
+        key = fi["id"] + "/" + fi["file_name"]
+        s3 = get_bucket_client(fi["destination_bucket"], profile_name="default")
+        return object_checksum(s3, fi["destination_bucket"], key)
+
+    completed = open_output_manifest(
+        output_manifest_bucket, "dcf_aws_batch_completed", COMPLETED_MANIFEST_FIELDS
     )
-    write_output_manifest_to_s3_file(
-        skipped_output_manifest, output_manifest_bucket, "dcf_aws_batch_skipped"
+    incomplete = open_output_manifest(
+        output_manifest_bucket,
+        "dcf_aws_batch_incomplete",
+        OUTPUT_MANIFEST_FIELDS + [JOB_ID_KEY, "status_reason"],
     )
-    write_output_manifest_to_s3_file(
-        failed_output_manifest, output_manifest_bucket, "dcf_aws_batch_failed"
+    resubmit = open_output_manifest(
+        output_manifest_bucket, "dcf_aws_batch_resubmit", GDC_MANIFEST_FIELDS
     )
+    with completed, incomplete, resubmit, ThreadPoolExecutor(
+        NUMBER_OF_THREADS
+    ) as executor:
+        for jobs in poll_jobs(
+            batch, list(files_by_job), poll_interval_min, poll_interval_max
+        ):
+            succeeded = []
+            for job in jobs:
+                for fi, copied, reason in file_outcomes(
+                    job, files_by_job[job["jobId"]]
+                ):
+                    if copied:
+                        succeeded.append(fi)
+                        continue
+                    if fi.get(UPLOAD_ID_KEY):
+                        # the parts of a split file whose part or finalize
+                        # jobs failed are not kept
+                        abort_split_upload(
+                            output_manifest_bucket, fi, fi[UPLOAD_ID_KEY]
+                        )
+                    row = convert_file_info_to_output_manifest(fi)
+                    row[JOB_ID_KEY] = job["jobId"]
+                    row["status_reason"] = reason
+                    incomplete.writerow(row)
+                    resubmit.writerow(fi)
+            for fi, value in zip(succeeded, executor.map(checksum, succeeded)):
+                row = convert_file_info_to_output_manifest(fi)
+                row["checksum"] = value
+                completed.writerow(row)
+            logging.info(
+                f"Jobs finished: {completed.count} files copied, "
+                f"{incomplete.count} failed"
+            )
+    return completed.count, incomplete.count
+
+
+def run_tracking(jobs_manifest, output_manifest_bucket):
+    """
+    Follow the jobs of an earlier submission, see `track_jobs`
+
+    Args:
+        jobs_manifest(str): s3 location of the dcf_aws_batch_jobs manifest, or
+            of one of its shards, written at submission
+        output_manifest_bucket(str): output bucket for the final manifests
+    """
+    local_manifest = get_manifest_from_bucket(jobs_manifest)
+    open_manifest = gzip.open if local_manifest.endswith(".gz") else open
+    with open_manifest(
+        local_manifest, mode="rt", newline="", encoding="utf-8"
+    ) as csv_file:
+        files = list(csv.DictReader(csv_file, delimiter="\t"))
+    completed, failed = track_jobs(files, output_manifest_bucket)
+    logging.info(f"Tracking summary: {completed} files copied, {failed} failed")
+
+
+class ManifestRow:
+    """
+    One file of a GDC manifest
+
+    Rows are slotted objects rather than dicts, which takes a fraction of the
+    memory and of the pickling time when they are sent to the submission
+    workers. Fields are read and written with the dict syntax used
+    throughout this module; unset fields read as missing.
+    """
+
+    __slots__ = GDC_MANIFEST_FIELDS + [
+        "destination_bucket",
+        JOB_STATUS_KEY,
+        JOB_ID_KEY,
+        UPLOAD_ID_KEY,
+        BUNDLE_RESULTS_KEY,
+    ]
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
 
-    return submitted_count, skipped_count, failed_count
+    def __getitem__(self, name):
+        value = getattr(self, name, None)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return getattr(self, name, None) is not None
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def __reduce__(self):
+        # pickled as a tuple of values, without the field names
+        return (_manifest_row, tuple(getattr(self, name) for name in self.__slots__))
+
+    def to_dict(self):
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        }
+
+
+def _manifest_row(*values):
+    """
+    Build a ManifestRow from the values of its fields, in __slots__ order.
+    Fields with no value are unset.
+    """
+    fi = ManifestRow.__new__(ManifestRow)
+    for name, value in zip_longest(ManifestRow.__slots__, values):
+        setattr(fi, name, value)
+    return fi
+
+
+class ManifestReport:
+    """
+    Validation report of a manifest: number of rows, rejected rows by
+    reason and the first MAX_REPORTED_ERRORS rejected rows
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.invalid = 0
+        self.reasons = Counter()
+        self.errors = []
+
+    def reject(self, line, file_id, reason):
+        self.invalid += 1
+        self.reasons[reason.split(":")[0]] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "id": file_id, "error": reason})
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "valid": self.rows - self.invalid,
+            "invalid": self.invalid,
+            "reasons": dict(self.reasons),
+            "errors": self.errors,
+        }
+
+
+def validate_manifest_row(fi):
+    """
+    Returns:
+        str: why the row can not be copied, None if it is valid
+    """
+    for field in ("id", "file_name", "size", "md5", "acl", "project_id"):
+        if not getattr(fi, field):
+            return f"Missing field: {field}"
+    if not fi.size.isdigit():
+        return f"Invalid size: {fi.size}"
+    if not MD5_REGEX.match(fi.md5):
+        return f"Invalid md5: {fi.md5}"
+    return None
+
+
+def iter_manifest_rows(manifest_file, report=None, routing=None, shard=None):
+    """
+    Parse a GDC manifest one row at a time
+
+    Rows that fail validation, or whose project has no destination bucket,
+    are left out and recorded in `report`.
+
+    Args:
+        manifest_file(str): path to the manifest tsv
+        report(ManifestReport): validation report to fill in
+        routing(dict): routing table, compiled from the settings if None
+        shard(tuple(int, int)): shard index and count, only the rows of the
+            shard are parsed and reported. Rows without an id belong to shard 0.
+
+    Yields:
+        ManifestRow: the valid rows
+    """
+    if report is None:
+        report = ManifestReport()
+    if routing is None:
+        routing = get_routing_table()
+    intern = sys.intern
+    with open(manifest_file, mode="r", newline="", encoding="utf-8") as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter="\t")
+        header = next(csv_reader, [])
+        missing = [field for field in GDC_MANIFEST_FIELDS if field not in header]
+        if missing:
+            raise ValueError(f"Manifest {manifest_file} has no column {missing}")
+        get_fields = itemgetter(*[header.index(f) for f in GDC_MANIFEST_FIELDS])
+        id_column = header.index("id")
+
+        for line, values in enumerate(csv_reader, start=2):
+            if shard and shard[1] > 1:
+                file_id = values[id_column] if len(values) > id_column else ""
+                if shard_of(file_id, shard[1]) != shard[0]:
+                    continue
+            report.rows += 1
+            try:
+                fi = _manifest_row(*get_fields(values))
+            except IndexError:
+                report.reject(line, values[0] if values else None, "Malformed row")
+                continue
+            reason = validate_manifest_row(fi)
+            if reason:
+                report.reject(line, fi.id, reason)
+                continue
+            # to normalize the acl
+            fi.acl = intern(fi.acl.replace("u'", "'").strip())
+            fi.project_id = intern(fi.project_id)
+            bucket = route(routing, fi.project_id, fi.acl)
+            if bucket is None:
+                report.reject(line, fi.id, f"Unknown project: {fi.project_id}")
+                continue
+            fi.destination_bucket = bucket
+            yield fi
+
+
+class ManifestRows:
+    """
+    Re-iterable view of the valid rows of a manifest file
+
+    The file is parsed again on every iteration so that only the rows being
+    processed are held in memory. `report` is the validation report of the
+    last complete iteration.
+    """
+
+    def __init__(self, manifest_file, routing=None, shard=None):
+        self.manifest_file = manifest_file
+        self.routing = routing or get_routing_table()
+        self.shard = shard
+        self.report = ManifestReport()
+
+    def __iter__(self):
+        report = ManifestReport()
+        yield from iter_manifest_rows(
+            self.manifest_file, report, self.routing, self.shard
+        )
+        self.report = report
+
+
+def write_validation_report(report, bucket_name):
+    """
+    Log a manifest validation report and write it to the output bucket
+    """
+    logging.info(
+        f"Manifest validation: {report.rows} rows, {report.invalid} rejected "
+        f"{dict(report.reasons)}"
+    )
+    for error in report.errors:
+        logging.warning(f"Rejected manifest row {error}")
+    time_str = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    s3 = get_bucket_client(bucket_name, profile_name="default")
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=f"{OUTPUT_PREFIX}dcf_aws_batch_validation_{time_str}.json",
+        Body=json.dumps(report.to_dict(), indent=2),
+        ContentType="application/json",
+    )
+
+
+def write_throughput_report(metrics_location, bucket_name):
+    """
+    Combine the transfer metrics summaries written by the gdc_copy jobs into
+    a run-level throughput report, log it and write it to the output bucket
+
+    Args:
+        metrics_location(str): s3://bucket/prefix of the summaries
+        bucket_name(str): output bucket of the report
+
+    Returns:
+        dict: the report, see `transfer_metrics.merge_summaries`
+    """
+    bucket, _, prefix = metrics_location.replace("s3://", "", 1).partition("/")
+    s3 = get_bucket_client(bucket, profile_name="default")
+
+    def summaries():
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix.rstrip("/") + "/"):
+            for obj in page.get("Contents", []):
+                body = s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"]
+                yield json.loads(body.read())
+
+    report = merge_summaries(summaries())
+    report["metrics_location"] = metrics_location
+    transfer_seconds = report["transfer_seconds"]
+    logging.info(
+        f"Transfer metrics of {report['files']} files {report['statuses']}: "
+        f"{report['bytes'] / 1024 ** 3:.1f} GB in {report['parts']} parts, "
+        f"{report['bytes'] / 1024 ** 2 / transfer_seconds if transfer_seconds else 0:.1f} MB/s per file, "
+        f"retries {report['retries']}, time per stage {report['stage_share']}"
+    )
+    time_str = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    get_bucket_client(bucket_name, profile_name="default").put_object(
+        Bucket=bucket_name,
+        Key=f"dcf_aws_batch_throughput_{time_str}.json",
+        Body=json.dumps(report, indent=2),
+        ContentType="application/json",
+    )
+    return report
 
 
 def parse_manifest_file(manifest_file):
+    """
+    Parse a whole manifest into a list, see `iter_manifest_rows`
+
+    Returns:
+        list(dict): the valid rows
+    """
     try:
-        with open(manifest_file, mode="r", newline="", encoding="utf-8") as csv_file:
-            # Create a DictReader object
-            parsed_data = []
-            csv_reader = csv.DictReader(csv_file, delimiter="\t")
-            # Read the header
-            # Iterate through each row in the CSV
-            for row in csv_reader:
-                fi = {}
-                fi["id"] = row["id"]
-                fi["file_name"] = row["file_name"]
-                fi["size"] = row["size"]
-                fi["acl"] = (
-                    row["acl"].replace("u'", "'").strip()
-                )  # to normalize the acl
-                fi["md5"] = row["md5"]
-                fi["baseid"] = row["baseid"]
-                fi["url"] = row["url"]
-                fi["project_id"] = row["project_id"]
-                fi["destination_bucket"] = map_project_to_bucket(fi)
-                parsed_data.append(fi)
-            return parsed_data
+        return [fi.to_dict() for fi in iter_manifest_rows(manifest_file)]
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
 
 
-def map_project_to_bucket(fi):
+def get_routing_table():
     """
-    Maps a project ID to its corresponding AWS bucket prefix
+    Compile the project routing table from the settings, see
+    `routing.compile_routing_table`
     """
-    if fi["project_id"] in PROJECT_ACL:
-        bucket = PROJECT_ACL[fi["project_id"]]["aws_bucket_prefix"]
-    else:
-        raise ValueError(
-            f"Project ID {fi['project_id']} not found in the mapping. Available projects: {list(PROJECT_ACL.keys())}"
-        )
+    return compile_routing_table(PROJECT_ACL, POSTFIX_1_EXCEPTION, POSTFIX_2_EXCEPTION)
 
-    if fi["acl"] == "['open']":
-        if "target" in bucket:
-            bucket = "gdc-target-phs000218-2-open"
-        else:
-            if bucket not in POSTFIX_1_EXCEPTION and bucket not in POSTFIX_2_EXCEPTION:
-                bucket += "-2-open"
-            elif bucket in POSTFIX_1_EXCEPTION:
-                bucket += "-open"
-            elif bucket in POSTFIX_2_EXCEPTION:
-                bucket += "-2-open"
-    elif fi["acl"] != "['open']":
-        if "target" in bucket:
-            bucket = "target-controlled"
-        else:
-            if bucket not in POSTFIX_1_EXCEPTION and bucket not in POSTFIX_2_EXCEPTION:
-                bucket += "-controlled"
-            elif bucket in POSTFIX_1_EXCEPTION:
-                bucket += "-controlled"
-            elif bucket in POSTFIX_2_EXCEPTION:
-                bucket += "-2-controlled"
-    else:
+
+def map_project_to_bucket(fi, routing=None):
+    """
+    Maps a project ID to its corresponding AWS bucket
+
+    Args:
+        fi(dict): file info with project_id and acl
+        routing(dict): routing table, compiled from the settings if None
+    """
+    if routing is None:
+        routing = get_routing_table()
+    bucket = route(routing, fi["project_id"], fi.get("acl"))
+    if bucket is None:
         raise ValueError(
-            f"Bucket {fi['bucket']} not recognized. Expected 'open' or 'controlled'."
+            f"Project ID {fi['project_id']} not found in the mapping. Available projects: {list(PROJECT_ACL.keys())}"
         )
     return bucket
 
@@ -297,10 +1611,8 @@ def get_manifest_from_bucket(s3_location):
     Returns:
         str: path to the manifest file
     """
-    session = boto3.Session(profile_name="default")
-    s3 = session.client("s3")
-
     bucket, key = s3_location.replace("s3://", "").split("/", 1)
+    s3 = get_bucket_client(bucket, profile_name="default")
     local_manifest = "/tmp/{}".format(key.split("/")[-1])
     try:
         logging.info(f"Attempting to download manifest {key} from s3 bucket {bucket} ")
@@ -399,37 +1711,198 @@ def convert_file_info_to_output_manifest(file_info):
     }
 
 
-def write_output_manifest_to_s3_file(data, bucket_name, file_prefix):
+def open_output_manifest(bucket_name, file_prefix, fieldnames=OUTPUT_MANIFEST_FIELDS):
+    """
+    Start a streamed output manifest s3://bucket_name/file_prefix_<time>.tsv,
+    gzipped and sharded according to OUTPUT_COMPRESS and OUTPUT_SHARD_SIZE.
+    Manifests of a sharded run are written under OUTPUT_PREFIX.
+
+    Returns:
+        S3ManifestWriter: the writer, to be closed once all rows are written
+    """
+    time_str = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    return S3ManifestWriter(
+        get_bucket_client(bucket_name, profile_name="default"),
+        bucket_name,
+        f"{OUTPUT_PREFIX}{file_prefix}_{time_str}",
+        fieldnames,
+        compress=OUTPUT_COMPRESS,
+        max_shard_size=OUTPUT_SHARD_SIZE * 1024 * 1024,
+    )
+
+
+def write_output_manifest_to_s3_file(
+    data, bucket_name, file_prefix, fieldnames=OUTPUT_MANIFEST_FIELDS
+):
     """
     Write output manifest data to tsv file to s3 location
+
+    Returns:
+        list(str): keys of the manifest files
     """
     try:
-        time_str = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
-        key = f"{file_prefix}_{time_str}.tsv"
-        session = boto3.Session(profile_name="default")
-        s3 = session.client("s3")
-        # Use the s3 client that was passed to the function
+        s3 = get_bucket_client(bucket_name, profile_name="default")
         if check_bucket_exists(s3, bucket_name):
-            # Create an in-memory text buffer
-            csv_buffer = io.StringIO()
-
-            writer = csv.DictWriter(
-                csv_buffer,
-                fieldnames=["guid", "md5", "size", "authz", "acl", "file_name", "urls"],
-                delimiter="\t",
-            )
-            writer.writeheader()
-            writer.writerows(data)
-
-            s3.put_object(
-                Bucket=bucket_name,
-                Key=key,
-                Body=csv_buffer.getvalue(),
-                ContentType="text/csv",
-            )
-            logging.info(
-                f"Output Manifest File '{key}' successfully uploaded to S3 bucket '{bucket_name}'."
-            )
+            with open_output_manifest(bucket_name, file_prefix, fieldnames) as writer:
+                writer.writerows(data)
+            return writer.keys
     except ClientError as e:
         logging.error(f"Error writing output manifest to {bucket_name}: {e}")
         raise (e)
+    return []
+
+
+def merge_shard_manifests(
+    output_manifest_bucket,
+    run_id,
+    shard_count,
+    output_compress=OUTPUT_COMPRESS,
+    output_shard_size=OUTPUT_SHARD_SIZE,
+):
+    """
+    Reduce step of a sharded run: merge the output manifests and validation
+    reports written by its shards into run-level ones
+
+    Args:
+        output_manifest_bucket(str): output bucket of the shards
+        run_id(str): id of the run
+        shard_count(int): number of shards of the run
+        output_compress(bool): gzip the merged manifests
+        output_shard_size(int): Size in MB. Maximum size of a merged manifest file, 0 writes a single file
+
+    Returns:
+        dict: manifest kind -> keys of the merged manifest files
+    """
+    global OUTPUT_COMPRESS
+    global OUTPUT_SHARD_SIZE
+    global OUTPUT_PREFIX
+
+    OUTPUT_COMPRESS = bool(output_compress)
+    OUTPUT_SHARD_SIZE = int(output_shard_size)
+    OUTPUT_PREFIX = ""
+    shard_count = int(shard_count)
+
+    s3 = get_bucket_client(output_manifest_bucket, profile_name="default")
+    paginator = s3.get_paginator("list_objects_v2")
+    keys = (
+        obj["Key"]
+        for page in paginator.paginate(
+            Bucket=output_manifest_bucket, Prefix=f"{SHARDS_PREFIX}/{run_id}/"
+        )
+        for obj in page.get("Contents", [])
+    )
+    manifests, reports = group_shard_keys(keys, run_id)
+    missing = sorted(set(range(shard_count)) - set(reports))
+    if missing:
+        raise ValueError(f"Shards {missing} of run {run_id} have not finished")
+
+    merged = {}
+    for kind, shard_keys in manifests.items():
+        writer = None
+        for key in shard_keys:
+            with open_s3_manifest(s3, output_manifest_bucket, key) as reader:
+                if writer is None:
+                    writer = open_output_manifest(
+                        output_manifest_bucket, kind, reader.fieldnames
+                    )
+                writer.writerows(reader)
+        if writer is not None:
+            writer.close()
+            merged[kind] = writer.keys
+        logging.info(f"Merged {len(shard_keys)} {kind} manifests of run {run_id}")
+
+    report = ManifestReport()
+    for index in sorted(reports):
+        body = s3.get_object(Bucket=output_manifest_bucket, Key=reports[index])["Body"]
+        shard_report = json.loads(body.read())
+        report.rows += shard_report["rows"]
+        report.invalid += shard_report["invalid"]
+        report.reasons.update(shard_report["reasons"])
+        room = MAX_REPORTED_ERRORS - len(report.errors)
+        report.errors.extend(shard_report["errors"][:room])
+    write_validation_report(report, output_manifest_bucket)
+    write_throughput_report(
+        f"s3://{output_manifest_bucket}/transfer_metrics/{run_id}",
+        output_manifest_bucket,
+    )
+    return merged
+
+
+def verify_replication(
+    manifest_locations,
+    output_manifest_bucket,
+    hash_threads=HASH_THREADS,
+    max_hash_size=0,
+):
+    """
+    Verify in bulk that the objects of output manifests are in place, see
+    `verification.verify_objects`, and write
+
+    - dcf_aws_batch_discrepancies: manifest of the objects that are missing,
+      differ from the manifest or could not be verified
+    - dcf_aws_batch_verification_<time>.json: number of objects and bytes by
+      status, and the first discrepancies
+
+    Args:
+        manifest_locations(list(str)): s3 locations of the manifests, e.g. the
+            files of a dcf_aws_batch_completed manifest or a bucket manifest
+        output_manifest_bucket(str): output bucket for the report
+        hash_threads(int): number of objects hashed at the same time
+        max_hash_size(int): Size in GB. Maximum size downloaded to hash the
+            multipart objects without checksum, 0 for no limit
+
+    Returns:
+        dict: the report
+    """
+
+    def read_objects():
+        for location in manifest_locations:
+            bucket, _, key = location.replace("s3://", "", 1).partition("/")
+            s3 = get_bucket_client(bucket, profile_name="default")
+            with open_s3_manifest(s3, bucket, key) as reader:
+                yield from manifest_objects(reader)
+
+    # the manifests are read twice rather than held in memory: once for the
+    # keys to index, capped as in `index_destinations`, and once to verify
+    keys_by_bucket = {}
+    count = 0
+    for obj in read_objects():
+        count += 1
+        keys = keys_by_bucket.setdefault(obj["bucket"], [])
+        if len(keys) <= PREFIX_LISTING_THRESHOLD:
+            keys.append(obj["key"])
+    logging.info(f"Verifying {count} objects of {len(manifest_locations)} manifests")
+
+    def clients(bucket):
+        return get_bucket_client(bucket, profile_name="default")
+
+    discrepancies = open_output_manifest(
+        output_manifest_bucket, "dcf_aws_batch_discrepancies", DISCREPANCY_FIELDS
+    )
+    with DestinationIndex(clients=clients) as index, discrepancies:
+        index.build(keys_by_bucket)
+        report = verify_objects(
+            read_objects(),
+            index,
+            clients,
+            on_discrepancy=discrepancies.writerow,
+            hash_threads=int(hash_threads),
+            max_hash_bytes=int(max_hash_size) * 1024**3 or None,
+        )
+
+    result = report.to_dict()
+    result["manifests"] = list(manifest_locations)
+    result["discrepancy_manifest"] = discrepancies.keys
+    logging.info(
+        f"Verified {result['verified']} of {result['objects']} objects in "
+        f"{result['seconds']:.0f}s, {result['failed']} discrepancies "
+        f"{result['statuses']}, {report.hashed_bytes / 1024 ** 3:.1f} GB hashed"
+    )
+    time_str = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    get_bucket_client(output_manifest_bucket, profile_name="default").put_object(
+        Bucket=output_manifest_bucket,
+        Key=f"dcf_aws_batch_verification_{time_str}.json",
+        Body=json.dumps(result, indent=2),
+        ContentType="application/json",
+    )
+    return result
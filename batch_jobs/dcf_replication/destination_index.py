@@ -0,0 +1,174 @@
+"""
+Index of the objects already present in the destination buckets.
+
+Instead of one head_object per manifest row, each destination bucket is
+listed once (or, for buckets with only a few manifest rows, the `id/`
+prefixes of those rows are listed) and the keys are stored with their size
+and ETag in a sqlite table. Existence checks are then answered locally.
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+# Buckets with at most this many manifest rows are checked by listing the
+# prefix of each row rather than listing the whole bucket
+PREFIX_LISTING_THRESHOLD = 1000
+PREFIX_LISTING_THREADS = 16
+INSERT_BATCH_SIZE = 10000
+
+
+def key_prefix(key):
+    """
+    Returns:
+        str: prefix listed to find a key, its first path component, or the
+        key itself if it has none
+    """
+    head, sep, _ = key.partition("/")
+    return head + sep
+
+
+class DestinationIndex:
+    """
+    Key -> (size, ETag) index of destination objects
+
+    Args:
+        s3(S3.Client): s3 client used for listing
+        path(str): sqlite database file. A temporary file is used if None,
+            ":memory:" keeps the index in memory
+        clients(callable): bucket -> s3 client used to list the bucket, e.g.
+            a client in its region. Defaults to `s3` for every bucket.
+    """
+
+    def __init__(self, s3=None, path=None, clients=None):
+        self.s3 = s3
+        self.clients = clients
+        self._tmp_path = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="dcf_destination_index_", suffix=".db")
+            os.close(fd)
+            self._tmp_path = path
+        self.indexed_buckets = set()
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS objects "
+            "(bucket TEXT, key TEXT, size INTEGER, etag TEXT, PRIMARY KEY (bucket, key))"
+        )
+
+    def close(self):
+        self.db.close()
+        if self._tmp_path:
+            os.remove(self._tmp_path)
+            self._tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _client(self, bucket):
+        return (self.clients and self.clients(bucket)) or self.s3
+
+    def _list(self, bucket, prefix=""):
+        objects = []
+        paginator = self._client(bucket).get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                objects.append((bucket, obj["Key"], obj["Size"], obj.get("ETag")))
+        return objects
+
+    def _insert(self, objects):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)", objects
+        )
+        self.db.commit()
+
+    def index_bucket(self, bucket):
+        """
+        List the whole bucket into the index
+
+        Returns:
+            int: number of objects indexed
+        """
+        count = 0
+        batch = []
+        paginator = self._client(bucket).get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket):
+            for obj in page.get("Contents", []):
+                batch.append((bucket, obj["Key"], obj["Size"], obj.get("ETag")))
+            if len(batch) >= INSERT_BATCH_SIZE:
+                self._insert(batch)
+                count += len(batch)
+                batch = []
+        self._insert(batch)
+        return count + len(batch)
+
+    def index_prefixes(self, bucket, prefixes):
+        """
+        List each of `prefixes` in the bucket into the index
+
+        Returns:
+            int: number of objects indexed
+        """
+        count = 0
+        with ThreadPoolExecutor(PREFIX_LISTING_THREADS) as executor:
+            for objects in executor.map(
+                lambda prefix: self._list(bucket, prefix), prefixes
+            ):
+                self._insert(objects)
+                count += len(objects)
+        return count
+
+    def build(self, keys_by_bucket):
+        """
+        Index the destination buckets
+
+        A bucket that can not be listed is left out of `indexed_buckets`, and
+        its objects have to be checked individually.
+
+        Args:
+            keys_by_bucket(dict): bucket -> list of keys ("<id>/<file_name>")
+                that will be looked up
+        """
+        for bucket, keys in keys_by_bucket.items():
+            try:
+                if len(keys) > PREFIX_LISTING_THRESHOLD:
+                    logging.info(f"Indexing all objects of bucket {bucket}")
+                    count = self.index_bucket(bucket)
+                else:
+                    logging.info(f"Indexing {len(keys)} prefixes of bucket {bucket}")
+                    prefixes = sorted({key_prefix(key) for key in keys})
+                    count = self.index_prefixes(bucket, prefixes)
+            except ClientError as e:
+                logging.error(f"Can not list bucket {bucket}. Detail {e}")
+                continue
+            self.indexed_buckets.add(bucket)
+            logging.info(f"Indexed {count} objects of bucket {bucket}")
+
+    def lookup(self, bucket, key):
+        """
+        Returns:
+            tuple(int, str): size and ETag of the object, None if it does not exist
+        """
+        return self.db.execute(
+            "SELECT size, etag FROM objects WHERE bucket = ? AND key = ?",
+            (bucket, key),
+        ).fetchone()
+
+    def check_file_exists(self, bucket, key, expected_size):
+        """
+        Same contract as dcf_replication_job.check_file_exists, answered from the index
+        """
+        found = self.lookup(bucket, key)
+        if found is None:
+            return False, f"File {key} does not exist"
+        if found[0] == expected_size:
+            return True, f"File {key} exists with matching size"
+        return (
+            False,
+            f"File {key} exists but size mismatch: {found[0]} vs {expected_size}",
+        )
@@ -1,19 +1,91 @@
 import argparse
+import base64
+import csv
 import hashlib
-import math
+import io
+import json
+import os
 import re
 import sys
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-import requests
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from botocore.exceptions import ClientError
+
+from batch_jobs.dcf_replication.checksums import (
+    CHECKSUM_ALGORITHM,
+    format_checksum,
+    part_checksum,
+)
+from batch_jobs.dcf_replication.gdc_client import (
+    CONNECT_TIMEOUT,
+    READ_TIMEOUT,
+    ConcurrencyController,
+    GDCClient,
+    Hedger,
+)
+from batch_jobs.dcf_replication.part_planner import PartPlanner
+from batch_jobs.dcf_replication.replica_copy import (
+    COPY_CONCURRENCY,
+    check_replica,
+    copy_replica_object,
+    split_s3_url,
+)
+from batch_jobs.dcf_replication.spool import SPOOL_MEMORY_CAP, PartSpool, spool_budget
+from batch_jobs.dcf_replication.transfer_metrics import TransferMetrics
+from batch_jobs.dcf_replication.upload_state import (
+    UPLOAD_STATE_LOCATION,
+    completed_parts,
+    delete_checkpoint,
+    delete_part_digests,
+    get_md5_state,
+    list_uploaded_parts,
+    new_md5,
+    resume_upload,
+    save_checkpoint,
+    upload_checksum_algorithm,
+)
+from batch_jobs.utils.clients import get_bucket_client
 
 RETRIES_NUM = 3
+# Largest amount of data held in memory by a streamed transfer. Files up to
+# this size are uploaded with a single put_object, larger ones are streamed
+# as multipart parts of this size. S3 requires parts of at least 5 MB.
+STREAM_BUFFER_SIZE = 8 * 1024 * 1024
+STREAM_READ_SIZE = 1024 * 1024
+BUNDLE_CONCURRENCY = 8
+# share of the file size that hedged part requests may download again
+HEDGE_MAX_FRACTION = 0.1
+
+UUID4_REGEX = re.compile(
+    r"^[a-f0-9]{8}-?[a-f0-9]{4}-?4[a-f0-9]{3}-?[89ab][a-f0-9]{3}-?[a-f0-9]{12}\Z",
+    re.I,
+)
+
 
+class TransferValidationError(Exception):
+    """
+    Raised when the downloaded data does not match the expected size or md5
+    """
 
-def generate_chunk_data_list(size, chunk_size):
+
+def is_valid_file_id(file_id):
+    if not UUID4_REGEX.match(file_id):
+        print(
+            f"file_id does not match uuid4 pattern. Please send a valid uuid4. {file_id}"
+        )
+        return False
+    return True
+
+
+def generate_chunk_data_list(size, chunk_size, start=0):
     L = []
-    idx = 0
+    idx = start
     while idx < size:
         L.append((idx, min(idx + chunk_size - 1, size - 1)))
         idx += chunk_size
@@ -21,6 +93,69 @@ def generate_chunk_data_list(size, chunk_size):
     return L
 
 
+def upload_chunk(
+    s3,
+    chunk,
+    target_bucket,
+    object_path,
+    part_number,
+    upload_id,
+    retries_num,
+    on_retry=None,
+    checksum=None,
+):
+    """
+    Upload one part of a multipart upload, `on_retry` is called before each
+    retry. `checksum` is the checksum of the part, see
+    `checksums.part_checksum`; S3 rejects the part if its content does not
+    match, and the upload is retried.
+
+    Returns:
+        str: ETag of the uploaded part
+    """
+    upload_tries = 0
+    while upload_tries < retries_num:
+        try:
+            if hasattr(chunk, "seek"):
+                # a file-like part is read again from its start on retry
+                chunk.seek(0)
+            res = s3.upload_part(
+                Body=chunk,
+                Bucket=target_bucket,
+                Key=object_path,
+                PartNumber=part_number,
+                UploadId=upload_id,
+                **(checksum or {}),
+            )
+            return res["ETag"]
+        except Exception as e:
+            print(
+                f"Error uploading part {part_number} (attempt {upload_tries + 1}): {e}"
+            )
+            upload_tries += 1
+            if on_retry and upload_tries < retries_num:
+                on_retry()
+            time.sleep(5)
+
+    raise Exception(f"Failed to upload part {part_number} after {retries_num} retries")
+
+
+def _location_client(location):
+    """
+    Upload checkpoints and part digests are kept next to the output
+    manifests, in a bucket that can be in another region than the
+    destination bucket
+
+    Returns:
+        S3.Client: client of the bucket of an s3://bucket/prefix location,
+        None for a local directory
+    """
+    if not location or not location.startswith("s3://"):
+        return None
+    bucket = location.replace("s3://", "", 1).partition("/")[0]
+    return get_bucket_client(bucket, max_pool_connections=10)
+
+
 def api_to_bucket_copy(
     file_id,
     gdc_token,
@@ -30,124 +165,246 @@ def api_to_bucket_copy(
     expected_md5,
     chunk_size,
     retries_num,
+    state_location=UPLOAD_STATE_LOCATION,
+    abort_on_failure=False,
+    concurrency=1,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    metrics_location=None,
+    adaptive=True,
+    hedge_percentile=0,
+    hedge_max_fraction=HEDGE_MAX_FRACTION,
+    spool_dir=None,
+    memory_cap=SPOOL_MEMORY_CAP,
 ):
-    regex = re.compile(
-        r"^[a-f0-9]{8}-?[a-f0-9]{4}-?4[a-f0-9]{3}-?[89ab][a-f0-9]{3}-?[a-f0-9]{12}\Z",
-        re.I,
+    """
+    Copy a file from the GDC API to a bucket with a multipart upload
+
+    If an earlier run left an in-progress multipart upload for the same key,
+    the parts it already uploaded are kept and only the remaining parts are
+    transferred. When the upload fails it is left in place for the next run
+    to resume, unless `abort_on_failure` is set.
+
+    Up to `concurrency` parts are downloaded and uploaded at the same time.
+    Part sizes are chosen by a PartPlanner: `chunk_size` if it is set, or
+    from the throughput of the previous parts if it is None, in both cases
+    within the S3 part limit and the memory budget of the container, which
+    can also lower the concurrency. Unless `adaptive` is False, the number of
+    parts downloaded at the same time is then adapted to the load of the GDC
+    API between 1 and that concurrency, see `ConcurrencyController`. With a
+    `hedge_percentile`, a part download slower than that percentile of the
+    recent ones is sent a second time, for at most `hedge_max_fraction` of the
+    file size, see `Hedger`.
+
+    With a `spool_dir`, parts are streamed into memory-mapped files in that
+    directory instead of memory, see `spool.PartSpool`: the part budget is
+    then the free space of the directory, and the part data held in memory
+    stays under `memory_cap` bytes. Spooled parts are not hedged.
+
+    The download, hashing and upload of every part are timed, and a summary
+    of the transfer is printed at the end and written to `metrics_location`
+    if it is set, see `TransferMetrics`.
+    """
+    if not is_valid_file_id(file_id):
+        return
+    s3 = get_bucket_client(target_bucket, max_pool_connections=max(10, concurrency))
+    gdc = GDCClient(
+        gdc_token,
+        # hedges need their own connections, not to wait for the requests
+        # they hedge
+        pool_size=2 * concurrency if hedge_percentile else concurrency,
+        retries_num=retries_num,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+    )
+
+    state_s3 = _location_client(state_location)
+    upload_id, parts, md5_state, md5_parts = resume_upload(
+        s3, state_location, target_bucket, object_path, file_size, state_s3=state_s3
     )
-    match = regex.match(file_id)
-    if bool(match) == False:
+    if upload_id:
+        # parts must be sent with the checksum algorithm of the upload
+        checksum_algorithm = upload_checksum_algorithm(
+            s3, target_bucket, object_path, upload_id
+        )
         print(
-            f"file_id does not match uuid4 pattern. Please send a valid uuid4. {file_id}"
+            f"Resuming multipart upload {upload_id}: {len(parts)} parts already uploaded, "
+            f"MD5 state restored for {md5_parts} parts"
         )
-        return
-    DATA_ENDPOINT = f"https://api.gdc.cancer.gov/data/{file_id}"
-
-    s3 = boto3.client("s3")
+    else:
+        checksum_algorithm = CHECKSUM_ALGORITHM
+        multipart = s3.create_multipart_upload(
+            Bucket=target_bucket,
+            Key=object_path,
+            ACL="bucket-owner-full-control",
+            ChecksumAlgorithm=checksum_algorithm,
+        )
+        upload_id = multipart["UploadId"]
+        print(f"Started multipart upload: {upload_id}")
 
-    multipart = s3.create_multipart_upload(
-        Bucket=target_bucket, Key=object_path, ACL="bucket-owner-full-control"
+    # byte ranges of the parts that were uploaded by a previous run, followed
+    # by the ranges that are still to be uploaded, planned as the upload goes
+    resumed_ranges = []
+    uploaded = 0
+    for part in parts:
+        resumed_ranges.append((uploaded, uploaded + part["Size"] - 1))
+        uploaded += part["Size"]
+    planner = PartPlanner(
+        file_size,
+        concurrency,
+        chunk_size or None,
+        budget=spool_budget(spool_dir) if spool_dir else None,
+        offset=uploaded,
+        part_number=len(parts),
     )
-    upload_id = multipart["UploadId"]
-    print(f"Started multipart upload: {upload_id}")
+    if planner.concurrency < concurrency:
+        print(
+            f"Concurrency lowered to {planner.concurrency} to fit in "
+            f"{spool_dir or 'memory'}"
+        )
+        concurrency = planner.concurrency
+    spool = PartSpool(spool_dir, concurrency, memory_cap) if spool_dir else None
+    if adaptive:
+        gdc.controller = ConcurrencyController(concurrency)
+    if hedge_percentile:
+        gdc.hedger = Hedger(
+            hedge_percentile, int(file_size * hedge_max_fraction), 2 * concurrency
+        )
 
-    parts = []
-    md5_hash = hashlib.md5()
-    total_parts = math.ceil(file_size / chunk_size)
-    uploaded = 0
+    def data_ranges():
+        for part_number, (start, end) in enumerate(resumed_ranges, start=1):
+            yield part_number, start, end
+        yield from planner
 
-    try:
-        for n_part, data_range in enumerate(
-            generate_chunk_data_list(file_size, chunk_size)
-        ):
-            start, end = data_range
-            part_number = n_part + 1
-            # Download chunk with retries
-            chunk = None
-            download_tries = 0
-            chunk_downloaded = False
-
-            while download_tries < retries_num and not chunk_downloaded:
-                try:
-                    response = requests.get(
-                        DATA_ENDPOINT,
-                        headers={
-                            "X-Auth-Token": gdc_token,
-                            "Range": f"bytes={start}-{end}",
-                        },
-                    )
-                    response.raise_for_status()
-                    chunk = response.content
-
-                    if len(chunk) == end - start + 1:
-                        chunk_downloaded = True
-                    else:
-                        print(
-                            f"Chunk size mismatch: expected {end - start + 1}, got {len(chunk)}"
-                        )
-                        chunk = None
-                        download_tries += 1
-                        time.sleep(5)
-                    print(
-                        f"Downloading {DATA_ENDPOINT}: {part_number*(end - start + 1)}/{file_size}"
-                    )
+    md5_hash = new_md5(md5_state)
+    resumed_parts = len(parts)
+    metrics = TransferMetrics(file_id, file_size)
+    status = "FAILED"
 
-                except Exception as e:
-                    print(
-                        f"Error downloading part {part_number} (attempt {download_tries + 1}): {e}"
-                    )
-                    chunk = None
-                    download_tries += 1
-                    time.sleep(5)
+    def transfer_part(part_number, start, end):
+        seconds = {}
+        retries = {"download": 0, "upload": 0}
 
-            if not chunk_downloaded:
-                raise Exception(
-                    f"Failed to download part {part_number} after {retries_num} retries"
+        def count_retry(stage):
+            retries[stage] += 1
+
+        started = time.monotonic()
+        if spool is None:
+            chunk = gdc.get_range(
+                file_id, start, end, on_retry=lambda: count_retry("download")
+            )
+            data = chunk
+        else:
+            chunk = spool.part(end - start + 1)
+            data = chunk.buffer
+        try:
+            if spool is not None:
+                gdc.get_range_into(
+                    file_id, start, end, chunk, on_retry=lambda: count_retry("download")
+                )
+            seconds["download"] = time.monotonic() - started
+            etag = None
+            checksum = {}
+            if part_number > resumed_parts:
+                started = time.monotonic()
+                checksum = part_checksum(data, checksum_algorithm)
+                etag = upload_chunk(
+                    s3,
+                    data,
+                    target_bucket,
+                    object_path,
+                    part_number,
+                    upload_id,
+                    retries_num,
+                    on_retry=lambda: count_retry("upload"),
+                    checksum=checksum,
                 )
+                seconds["upload"] = time.monotonic() - started
+        except BaseException:
+            if spool is not None:
+                chunk.close()
+            raise
+        return chunk, etag, checksum, seconds, retries
 
-            # Upload part with retries
-            upload_tries = 0
-            part_uploaded = False
+    def finish_part(part_number, future):
+        nonlocal uploaded
+        chunk, etag, checksum, seconds, retries = future.result()
+        started = time.monotonic()
+        if spool is None:
+            md5_hash.update(chunk)
+        else:
+            # hashed in place, then the spool file is deleted
+            chunk.update(md5_hash)
+            chunk.close()
+        seconds["hash"] = time.monotonic() - started
+        metrics.record_part(len(chunk), seconds, retries)
+        if etag is None:
+            # uploaded by a previous run but not covered by the saved md5
+            # state, only the hash needs to be rebuilt
+            print(f"Part {part_number} already uploaded, hashed")
+            return
 
-            while upload_tries < retries_num and not part_uploaded:
-                try:
-                    res = s3.upload_part(
-                        Body=chunk,
-                        Bucket=target_bucket,
-                        Key=object_path,
-                        PartNumber=part_number,
-                        UploadId=upload_id,
-                    )
-                    parts.append({"PartNumber": part_number, "ETag": res["ETag"]})
-                    part_uploaded = True
-                except Exception as e:
-                    print(
-                        f"Error uploading part {part_number} (attempt {upload_tries + 1}): {e}"
-                    )
-                    upload_tries += 1
-                    time.sleep(5)
+        planner.record(len(chunk), seconds["download"] + seconds["upload"])
+        parts.append(
+            {"PartNumber": part_number, "ETag": etag, "Size": len(chunk), **checksum}
+        )
+        uploaded += len(chunk)
+        save_checkpoint(
+            state_s3,
+            state_location,
+            target_bucket,
+            object_path,
+            {
+                "upload_id": upload_id,
+                "parts": parts,
+                "md5_state": get_md5_state(md5_hash),
+                "md5_parts": part_number,
+            },
+        )
+        print(
+            f"Part {part_number} of {len(chunk) / 1024 / 1024:.1f} MB done "
+            f"({uploaded / 1024 / 1024:.1f}/{file_size / 1024 / 1024:.1f} MB uploaded)"
+        )
 
-            if not part_uploaded:
-                raise Exception(
-                    f"Failed to upload part {part_number} after {retries_num} retries"
+    try:
+        # parts are transferred concurrently but hashed and checkpointed in
+        # order, at most `concurrency` parts are held in memory
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = deque()
+            for part_number, start, end in data_ranges():
+                if part_number <= md5_parts:
+                    continue
+                if len(in_flight) >= concurrency:
+                    finish_part(*in_flight.popleft())
+                in_flight.append(
+                    (
+                        part_number,
+                        executor.submit(transfer_part, part_number, start, end),
+                    )
                 )
-
-            # Update overall md5 and progress, then free memory
-            md5_hash.update(chunk)
-            uploaded += len(chunk)
-            chunk = None
+            while in_flight:
+                finish_part(*in_flight.popleft())
+        if gdc.controller is not None:
+            print(
+                f"Adaptive concurrency: {int(gdc.controller.limit)} of {concurrency} "
+                f"downloads at the end, {gdc.controller.decreases} decreases"
+            )
+        if gdc.hedger is not None:
             print(
-                f"Part {part_number}/{total_parts} done ({uploaded / 1024 / 1024:.1f} MB uploaded)"
+                f"Hedged {gdc.hedger.hedges} parts "
+                f"({gdc.hedger.hedged_bytes / 1024 / 1024:.1f} MB), "
+                f"{gdc.hedger.wins} hedges arrived first"
             )
 
         # Complete multipart upload
-        s3.complete_multipart_upload(
+        response = s3.complete_multipart_upload(
             Bucket=target_bucket,
             Key=object_path,
             UploadId=upload_id,
-            MultipartUpload={"Parts": parts},
+            MultipartUpload={"Parts": completed_parts(parts)},
         )
-        print("Multipart upload complete.")
+        print(f"Multipart upload complete. Checksum {format_checksum(response)}")
+        delete_checkpoint(state_s3, state_location, target_bucket, object_path)
 
         # Validate size
         if file_size and uploaded != file_size:
@@ -169,10 +426,16 @@ def api_to_bucket_copy(
         else:
             print("MD5SUM not set, skipping validation.")
 
+        status = "SUCCEEDED"
         sys.exit(0)
 
     except Exception as e:
         print(f"ERROR: {e}")
+        if not abort_on_failure:
+            print(
+                f"Multipart upload {upload_id} kept with {len(parts)} parts, rerun to resume."
+            )
+            sys.exit(1)
         try:
             s3.abort_multipart_upload(
                 Bucket=target_bucket,
@@ -182,7 +445,546 @@ def api_to_bucket_copy(
             print("Multipart upload aborted.")
         except Exception as abort_err:
             print(f"Failed to abort multipart upload: {abort_err}")
+        delete_checkpoint(state_s3, state_location, target_bucket, object_path)
         sys.exit(1)
+    finally:
+        gdc.close()
+        metrics.emit(status, s3, metrics_location)
+
+
+def stream_file(
+    s3,
+    gdc,
+    file_id,
+    target_bucket,
+    object_path,
+    file_size,
+    expected_md5,
+    retries_num=RETRIES_NUM,
+    buffer_size=STREAM_BUFFER_SIZE,
+):
+    """
+    Stream a file from the GDC API to a bucket in a single pass
+
+    The object is only committed (put_object, or complete_multipart_upload for
+    files larger than `buffer_size`) once the size and md5 of the downloaded
+    data have been validated, so a corrupt object is never written.
+
+    Args:
+        s3(S3.Client): s3 client
+        gdc(GDCClient): GDC API client
+        file_id(str): GDC file uuid
+        target_bucket(str): destination bucket
+        object_path(str): destination key
+        file_size(int): expected size
+        expected_md5(str): expected md5, validation is skipped if empty
+        retries_num(int): number of attempts per part upload
+        buffer_size(int): maximum number of bytes held in memory
+
+    Returns:
+        tuple(int, str): size and md5 of the transferred file
+    """
+    md5_hash = hashlib.md5()
+    received = 0
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+
+    response = gdc.open_stream(file_id)
+    try:
+        for data in response.iter_content(chunk_size=STREAM_READ_SIZE):
+            md5_hash.update(data)
+            received += len(data)
+            buffer += data
+            if received > file_size:
+                raise TransferValidationError(
+                    f"Size mismatch: expected {file_size}, got more than {file_size}"
+                )
+            if len(buffer) >= buffer_size:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(
+                        Bucket=target_bucket,
+                        Key=object_path,
+                        ACL="bucket-owner-full-control",
+                        ChecksumAlgorithm=CHECKSUM_ALGORITHM,
+                    )["UploadId"]
+                part_number = len(parts) + 1
+                chunk = bytes(buffer[:buffer_size])
+                checksum = part_checksum(chunk)
+                etag = upload_chunk(
+                    s3,
+                    chunk,
+                    target_bucket,
+                    object_path,
+                    part_number,
+                    upload_id,
+                    retries_num,
+                    checksum=checksum,
+                )
+                parts.append({"PartNumber": part_number, "ETag": etag, **checksum})
+                del buffer[:buffer_size]
+
+        if received != file_size:
+            raise TransferValidationError(
+                f"Size mismatch: expected {file_size}, got {received}"
+            )
+        final_md5 = md5_hash.hexdigest()
+        if expected_md5 and final_md5 != expected_md5:
+            raise TransferValidationError(
+                f"MD5 mismatch: expected {expected_md5}, got {final_md5}"
+            )
+
+        if upload_id is None:
+            body = bytes(buffer)
+            s3.put_object(
+                Body=body,
+                Bucket=target_bucket,
+                Key=object_path,
+                ACL="bucket-owner-full-control",
+                ContentMD5=base64.b64encode(md5_hash.digest()).decode("ascii"),
+                ChecksumAlgorithm=CHECKSUM_ALGORITHM,
+                **part_checksum(body),
+            )
+        else:
+            if buffer:
+                part_number = len(parts) + 1
+                chunk = bytes(buffer)
+                checksum = part_checksum(chunk)
+                etag = upload_chunk(
+                    s3,
+                    chunk,
+                    target_bucket,
+                    object_path,
+                    part_number,
+                    upload_id,
+                    retries_num,
+                    checksum=checksum,
+                )
+                parts.append({"PartNumber": part_number, "ETag": etag, **checksum})
+            s3.complete_multipart_upload(
+                Bucket=target_bucket,
+                Key=object_path,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        return received, final_md5
+    except BaseException:
+        if upload_id is not None:
+            try:
+                s3.abort_multipart_upload(
+                    Bucket=target_bucket, Key=object_path, UploadId=upload_id
+                )
+            except Exception as abort_err:
+                print(f"Failed to abort multipart upload: {abort_err}")
+        raise
+    finally:
+        response.close()
+
+
+def stream_to_bucket(
+    file_id,
+    gdc_token,
+    target_bucket,
+    object_path,
+    file_size,
+    expected_md5,
+    retries_num,
+    buffer_size=STREAM_BUFFER_SIZE,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+):
+    """
+    Copy a small file from the GDC API to a bucket, see `stream_file`
+
+    Each request is retried by the GDC client and each part upload by
+    `stream_file`; the transfer as a whole is retried by gdc_copy_job.sh.
+    """
+    if not is_valid_file_id(file_id):
+        return
+
+    s3 = get_bucket_client(target_bucket, max_pool_connections=10)
+    with GDCClient(
+        gdc_token,
+        retries_num=retries_num,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+    ) as gdc:
+        try:
+            size, md5 = stream_file(
+                s3,
+                gdc,
+                file_id,
+                target_bucket,
+                object_path,
+                file_size,
+                expected_md5,
+                retries_num,
+                buffer_size,
+            )
+        except Exception as e:
+            print(f"ERROR: Transfer of {file_id} failed: {e}")
+            sys.exit(1)
+
+    print(f"Size validation passed: {size} bytes")
+    if expected_md5:
+        print(f"MD5 validation passed: {md5}")
+    else:
+        print(f"MD5SUM not set, skipping MD5 validation (observed: {md5})")
+    sys.exit(0)
+
+
+def _read_s3_url(s3, url):
+    bucket, _, key = url.replace("s3://", "", 1).partition("/")
+    return s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8")
+
+
+def _write_s3_url(s3, url, body):
+    bucket, _, key = url.replace("s3://", "", 1).partition("/")
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def copy_bundle_file(s3, gdc, row, retries_num, buffer_size):
+    """
+    Copy one file of a bundle, see `copy_bundle`
+
+    The file is transferred once: its requests are retried by the GDC client
+    and, once those retries run out, the file is recorded as failed.
+
+    Returns:
+        dict: result record of the file
+    """
+    key = row["id"] + "/" + row["file_name"]
+    result = {
+        "id": row["id"],
+        "destination_bucket": row["destination_bucket"],
+        "key": key,
+        "size": int(row["size"]),
+        "md5": row["md5"],
+    }
+    try:
+        head = s3.head_object(Bucket=row["destination_bucket"], Key=key)
+        if head["ContentLength"] == int(row["size"]):
+            result["status"] = "SKIPPED"
+            return result
+    except ClientError:
+        pass
+
+    try:
+        stream_file(
+            s3,
+            gdc,
+            row["id"],
+            row["destination_bucket"],
+            key,
+            int(row["size"]),
+            row["md5"],
+            retries_num,
+            buffer_size,
+        )
+        result["status"] = "SUCCESS"
+    except Exception as e:
+        print(f"Transfer of {row['id']} failed: {e}")
+        result["status"] = "FAILED"
+        result["error"] = str(e)
+    return result
+
+
+def copy_bundle(
+    bundle_manifest,
+    result_path,
+    gdc_token,
+    concurrency=BUNDLE_CONCURRENCY,
+    retries_num=RETRIES_NUM,
+    buffer_size=STREAM_BUFFER_SIZE,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+):
+    """
+    Copy all the small files listed in a bundle manifest
+
+    The files are streamed with `stream_file`, `concurrency` at a time,
+    sharing one GDC session and one s3 client per destination region. Files that already exist with
+    the expected size are skipped, so a rerun of the job only copies the files
+    a previous run did not finish. One JSON result record per file is written
+    to `result_path`.
+
+    Args:
+        bundle_manifest(str): s3 url of the tsv listing the files (id,
+            file_name, size, md5, destination_bucket)
+        result_path(str): s3 url the result records are written to
+        gdc_token(str): GDC API token
+        concurrency(int): number of files copied at the same time
+        retries_num(int): number of attempts per request
+        buffer_size(int): maximum number of bytes held in memory per file
+    """
+    pool_size = max(10, concurrency)
+    manifest_bucket = bundle_manifest.replace("s3://", "", 1).split("/")[0]
+    s3 = get_bucket_client(manifest_bucket, max_pool_connections=pool_size)
+    rows = list(
+        csv.DictReader(io.StringIO(_read_s3_url(s3, bundle_manifest)), delimiter="\t")
+    )
+    rows = [row for row in rows if is_valid_file_id(row["id"])]
+    print(f"Copying {len(rows)} files of bundle {bundle_manifest}")
+
+    with GDCClient(
+        gdc_token,
+        pool_size=concurrency,
+        retries_num=retries_num,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+    ) as gdc:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(
+                executor.map(
+                    lambda row: copy_bundle_file(
+                        get_bucket_client(
+                            row["destination_bucket"], max_pool_connections=pool_size
+                        ),
+                        gdc,
+                        row,
+                        retries_num,
+                        buffer_size,
+                    ),
+                    rows,
+                )
+            )
+
+    _write_s3_url(
+        s3, result_path, "".join(json.dumps(result) + "\n" for result in results)
+    )
+    failed = [result for result in results if result["status"] == "FAILED"]
+    print(
+        f"Bundle {bundle_manifest} done: "
+        f"{sum(result['status'] == 'SUCCESS' for result in results)} copied, "
+        f"{sum(result['status'] == 'SKIPPED' for result in results)} skipped, "
+        f"{len(failed)} failed"
+    )
+    sys.exit(1 if failed else 0)
+
+
+def _digest_url(digest_location, part_number):
+    return f"{digest_location.rstrip('/')}/{part_number:05d}.json"
+
+
+def load_part_digests(s3, digest_location, upload_id):
+    """
+    Load the digest records written by `upload_part_range` for an upload
+
+    Returns:
+        dict: part number -> {"upload_id", "part_number", "size", "md5", "etag"}
+    """
+    bucket, _, prefix = digest_location.replace("s3://", "", 1).partition("/")
+    digests = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix.rstrip("/") + "/"):
+        for obj in page.get("Contents", []):
+            record = json.loads(_read_s3_url(s3, f"s3://{bucket}/{obj['Key']}"))
+            if record.get("upload_id") == upload_id:
+                digests[record["part_number"]] = record
+    return digests
+
+
+def upload_part_range(
+    file_id,
+    gdc_token,
+    target_bucket,
+    object_path,
+    file_size,
+    upload_id,
+    chunk_size,
+    first_part,
+    last_part,
+    digest_location,
+    retries_num=RETRIES_NUM,
+    concurrency=1,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    adaptive=True,
+):
+    """
+    Upload the parts `first_part`..`last_part` of a multipart upload shared by
+    several jobs
+
+    Each part is checked against the ETag returned by S3 and a digest record
+    (size and md5 of the part) is written to `digest_location` for
+    `finalize_upload`. Parts that a previous attempt already uploaded and
+    recorded are not transferred again. Up to `concurrency` parts are
+    transferred at the same time, adapted to the load of the GDC API unless
+    `adaptive` is False, see `ConcurrencyController`.
+    """
+    if not is_valid_file_id(file_id):
+        return
+    s3 = get_bucket_client(target_bucket, max_pool_connections=max(10, concurrency))
+    data_ranges = generate_chunk_data_list(file_size, chunk_size)
+    part_numbers = range(first_part, min(last_part, len(data_ranges)) + 1)
+    checksum_algorithm = upload_checksum_algorithm(
+        s3, target_bucket, object_path, upload_id
+    )
+
+    uploaded = {
+        part["PartNumber"]: part["ETag"].strip('"')
+        for part in list_uploaded_parts(s3, target_bucket, object_path, upload_id)
+    }
+    digest_s3 = _location_client(digest_location)
+    recorded = load_part_digests(digest_s3, digest_location, upload_id)
+    pending = [
+        n
+        for n in part_numbers
+        if n not in recorded or uploaded.get(n) != recorded[n]["md5"]
+    ]
+    print(
+        f"Uploading parts {first_part}-{part_numbers[-1] if part_numbers else first_part} "
+        f"of {upload_id}: {len(part_numbers) - len(pending)} already uploaded"
+    )
+
+    def transfer_part(part_number):
+        start, end = data_ranges[part_number - 1]
+        data = gdc.get_range(file_id, start, end)
+        md5 = hashlib.md5(data).hexdigest()
+        etag = upload_chunk(
+            s3,
+            data,
+            target_bucket,
+            object_path,
+            part_number,
+            upload_id,
+            retries_num,
+            checksum=part_checksum(data, checksum_algorithm),
+        )
+        if etag.strip('"') != md5:
+            raise TransferValidationError(
+                f"Part {part_number} ETag {etag} does not match its md5 {md5}"
+            )
+        record = {
+            "upload_id": upload_id,
+            "part_number": part_number,
+            "size": len(data),
+            "md5": md5,
+            "etag": etag,
+        }
+        _write_s3_url(
+            digest_s3, _digest_url(digest_location, part_number), json.dumps(record)
+        )
+        print(f"Uploaded part {part_number} ({len(data)} bytes)")
+
+    with GDCClient(
+        gdc_token,
+        pool_size=concurrency,
+        retries_num=retries_num,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        controller=ConcurrencyController(concurrency) if adaptive else None,
+    ) as gdc:
+        try:
+            with ThreadPoolExecutor(concurrency) as executor:
+                list(executor.map(transfer_part, pending))
+        except Exception as e:
+            print(f"ERROR: Upload of parts of {file_id} failed: {e}")
+            sys.exit(1)
+    sys.exit(0)
+
+
+def finalize_upload(
+    target_bucket,
+    object_path,
+    file_size,
+    upload_id,
+    chunk_size,
+    digest_location,
+):
+    """
+    Complete a multipart upload written by `upload_part_range` jobs
+
+    Before completing, every part must be present, its ETag must match the
+    md5 of the data the job downloaded for it and the part sizes must add up
+    to `file_size`. Parts uploaded with a checksum are completed with it, so
+    that S3 also checks the checksum of the whole object. The object is not
+    read back to hash it: at the sizes split files have, that would take
+    longer than the upload.
+
+    When the parts do not pass these checks the multipart upload is aborted,
+    and the part digests are deleted whatever the outcome, so that a failed
+    file leaves no parts behind and is copied from scratch when resubmitted.
+    """
+    s3 = get_bucket_client(target_bucket, max_pool_connections=10)
+    data_ranges = generate_chunk_data_list(file_size, chunk_size)
+    parts = list_uploaded_parts(s3, target_bucket, object_path, upload_id)
+    digest_s3 = _location_client(digest_location)
+    digests = load_part_digests(digest_s3, digest_location, upload_id)
+
+    errors = []
+    if [part["PartNumber"] for part in parts] != list(range(1, len(data_ranges) + 1)):
+        errors.append(f"Expected parts 1-{len(data_ranges)}, found {len(parts)} parts")
+    for part in parts:
+        digest = digests.get(part["PartNumber"])
+        start, end = data_ranges[min(part["PartNumber"], len(data_ranges)) - 1]
+        if digest is None:
+            errors.append(f"Part {part['PartNumber']} has no digest record")
+        elif part["ETag"].strip('"') != digest["md5"]:
+            errors.append(f"Part {part['PartNumber']} ETag does not match its md5")
+        elif part["Size"] != digest["size"] or part["Size"] != end - start + 1:
+            errors.append(f"Part {part['PartNumber']} has size {part['Size']}")
+    if sum(part["Size"] for part in parts) != file_size:
+        errors.append(f"Parts add up to {sum(p['Size'] for p in parts)} bytes")
+    if errors:
+        for error in errors:
+            print(f"ERROR: {error}")
+        try:
+            s3.abort_multipart_upload(
+                Bucket=target_bucket, Key=object_path, UploadId=upload_id
+            )
+            print("Multipart upload aborted.")
+        except Exception as abort_err:
+            print(f"Failed to abort multipart upload: {abort_err}")
+        delete_part_digests(digest_s3, digest_location)
+        sys.exit(1)
+
+    response = s3.complete_multipart_upload(
+        Bucket=target_bucket,
+        Key=object_path,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": completed_parts(parts)},
+    )
+    print(
+        f"Completed multipart upload of {len(parts)} parts, {file_size} bytes. "
+        f"Checksum {format_checksum(response)}"
+    )
+
+    delete_part_digests(digest_s3, digest_location)
+    sys.exit(0)
+
+
+def copy_from_replica(
+    source,
+    target_bucket,
+    object_path,
+    file_size,
+    expected_md5,
+    checksum="",
+    concurrency=COPY_CONCURRENCY,
+):
+    """
+    Copy a file from a replica already in one of our buckets with an S3
+    server-side copy, for the replicas too large to be copied by the
+    submission workers
+
+    The replica is checked again, see `replica_copy.check_replica`, since it
+    may have changed since the job was submitted.
+    """
+    source_s3 = get_bucket_client(
+        split_s3_url(source)[0], max_pool_connections=max(10, concurrency)
+    )
+    s3 = get_bucket_client(target_bucket, max_pool_connections=max(10, concurrency))
+    try:
+        check_replica(source_s3, source, file_size, expected_md5, checksum)
+        copy_replica_object(
+            source_s3, s3, source, target_bucket, object_path, file_size, concurrency
+        )
+    except (ClientError, ValueError) as e:
+        print(f"ERROR: Copy of {object_path} from {source} failed: {e}")
+        sys.exit(1)
+    print(f"Copied {object_path} from {source}")
+    sys.exit(0)
 
 
 def parse_arguments():
@@ -223,8 +1025,8 @@ def parse_arguments():
     file_get_upload_cmd.add_argument(
         "--chunk_size",
         required=False,
-        default=128 * 1024 * 1024,
-        help="Size of chunk to be downloaded from the GDC API and the size of chunk that is uploaded to the S3 bucket in multi-part upload",
+        default=0,
+        help="Size of chunk to be downloaded from the GDC API and the size of chunk that is uploaded to the S3 bucket in multi-part upload. 0 sizes the parts from the file size, the memory and the measured throughput",
     )
     file_get_upload_cmd.add_argument(
         "--retry",
@@ -232,6 +1034,276 @@ def parse_arguments():
         default=3,
         help="Number of retries for both download and upload",
     )
+    file_get_upload_cmd.add_argument(
+        "--state_location",
+        required=False,
+        default=UPLOAD_STATE_LOCATION,
+        help="Local directory or s3://bucket/prefix where upload checkpoints are kept so that a rerun can resume the upload",
+    )
+    file_get_upload_cmd.add_argument(
+        "--abort_on_failure",
+        required=False,
+        action="store_true",
+        help="Abort the multipart upload on failure instead of keeping it to be resumed",
+    )
+    file_get_upload_cmd.add_argument(
+        "--concurrency",
+        required=False,
+        default=1,
+        help="Number of parts downloaded and uploaded at the same time",
+    )
+    file_get_upload_cmd.add_argument(
+        "--connect_timeout",
+        required=False,
+        default=CONNECT_TIMEOUT,
+        help="Seconds to wait for a connection to the GDC API",
+    )
+    file_get_upload_cmd.add_argument(
+        "--read_timeout",
+        required=False,
+        default=READ_TIMEOUT,
+        help="Seconds to wait for data from the GDC API before retrying",
+    )
+    file_get_upload_cmd.add_argument(
+        "--metrics_location",
+        required=False,
+        default=None,
+        help="s3://bucket/prefix where the transfer metrics summary of the file is written",
+    )
+    file_get_upload_cmd.add_argument(
+        "--fixed_concurrency",
+        required=False,
+        action="store_true",
+        help="Always download --concurrency parts at the same time instead of adapting to the load of the GDC API",
+    )
+    file_get_upload_cmd.add_argument(
+        "--hedge_percentile",
+        required=False,
+        default=0,
+        help="Send a second request for a part whose download is slower than this percentile of the recent parts, 0 disables hedging",
+    )
+    file_get_upload_cmd.add_argument(
+        "--hedge_max_fraction",
+        required=False,
+        default=HEDGE_MAX_FRACTION,
+        help="Maximum share of the file size downloaded again by hedged requests",
+    )
+    file_get_upload_cmd.add_argument(
+        "--spool_dir",
+        required=False,
+        default=None,
+        help="Directory on local storage where parts are spooled to memory-mapped files instead of being held in memory",
+    )
+    file_get_upload_cmd.add_argument(
+        "--memory_cap",
+        required=False,
+        default=SPOOL_MEMORY_CAP // 1024 // 1024,
+        help="Size in MB. Memory used by the data of the parts in flight when spooling",
+    )
+
+    stream_data_cmd = subparser.add_parser("stream_data")
+    stream_data_cmd.add_argument(
+        "--file_id",
+        required=True,
+        help="uuid for the file to be copied",
+    )
+    stream_data_cmd.add_argument(
+        "--gdc_token",
+        required=True,
+        help="Token from GDC to use in the GDC download API",
+    )
+    stream_data_cmd.add_argument(
+        "--target_bucket",
+        required=True,
+        help="S3 Bucket for the files to be uploaded to",
+    )
+    stream_data_cmd.add_argument(
+        "--object_path",
+        required=True,
+        help="Path at which the object will be uploaded to in the destination bucket",
+    )
+    stream_data_cmd.add_argument(
+        "--file_size",
+        required=True,
+        help="File size as defined in the GDC manifest. This will be used to validate upload",
+    )
+    stream_data_cmd.add_argument(
+        "--expected_md5",
+        required=True,
+        help="MD5 as given in the GDC manifest. This will be used to validate upload",
+    )
+    stream_data_cmd.add_argument(
+        "--buffer_size",
+        required=False,
+        default=STREAM_BUFFER_SIZE,
+        help="Maximum number of bytes held in memory. Larger files are streamed as multipart parts of this size",
+    )
+    stream_data_cmd.add_argument(
+        "--retry",
+        required=False,
+        default=3,
+        help="Number of attempts for the transfer",
+    )
+
+    copy_bundle_cmd = subparser.add_parser("copy_bundle")
+    copy_bundle_cmd.add_argument(
+        "--bundle_manifest",
+        required=True,
+        help="s3 url of the tsv listing the files of the bundle",
+    )
+    copy_bundle_cmd.add_argument(
+        "--result_path",
+        required=True,
+        help="s3 url the per-file results are written to",
+    )
+    copy_bundle_cmd.add_argument(
+        "--gdc_token",
+        required=True,
+        help="Token from GDC to use in the GDC download API",
+    )
+    copy_bundle_cmd.add_argument(
+        "--concurrency",
+        required=False,
+        default=BUNDLE_CONCURRENCY,
+        help="Number of files copied at the same time",
+    )
+    copy_bundle_cmd.add_argument(
+        "--retry",
+        required=False,
+        default=3,
+        help="Number of attempts per file",
+    )
+
+    upload_parts_cmd = subparser.add_parser("upload_parts")
+    upload_parts_cmd.add_argument(
+        "--file_id", required=True, help="uuid for the file to be copied"
+    )
+    upload_parts_cmd.add_argument(
+        "--gdc_token",
+        required=True,
+        help="Token from GDC to use in the GDC download API",
+    )
+    upload_parts_cmd.add_argument(
+        "--target_bucket",
+        required=True,
+        help="S3 Bucket for the files to be uploaded to",
+    )
+    upload_parts_cmd.add_argument(
+        "--object_path",
+        required=True,
+        help="Path at which the object will be uploaded to in the destination bucket",
+    )
+    upload_parts_cmd.add_argument(
+        "--file_size",
+        required=True,
+        help="File size as defined in the GDC manifest. This will be used to validate upload",
+    )
+    upload_parts_cmd.add_argument(
+        "--upload_id", required=True, help="Multipart upload shared by the part jobs"
+    )
+    upload_parts_cmd.add_argument(
+        "--chunk_size", required=True, help="Size of each part in bytes"
+    )
+    upload_parts_cmd.add_argument(
+        "--parts_per_job",
+        required=True,
+        help="Number of parts uploaded by each job of the array",
+    )
+    upload_parts_cmd.add_argument(
+        "--array_index",
+        required=False,
+        default=os.environ.get("AWS_BATCH_JOB_ARRAY_INDEX", 0),
+        help="Index of this job in the array, the job uploads parts "
+        "array_index * parts_per_job + 1 to (array_index + 1) * parts_per_job",
+    )
+    upload_parts_cmd.add_argument(
+        "--digest_location",
+        required=True,
+        help="s3://bucket/prefix where the part digests are written",
+    )
+    upload_parts_cmd.add_argument(
+        "--concurrency",
+        required=False,
+        default=1,
+        help="Number of parts downloaded and uploaded at the same time",
+    )
+    upload_parts_cmd.add_argument(
+        "--fixed_concurrency",
+        required=False,
+        action="store_true",
+        help="Always download --concurrency parts at the same time instead of adapting to the load of the GDC API",
+    )
+    upload_parts_cmd.add_argument(
+        "--retry",
+        required=False,
+        default=3,
+        help="Number of retries for both download and upload",
+    )
+
+    finalize_upload_cmd = subparser.add_parser("finalize_upload")
+    finalize_upload_cmd.add_argument(
+        "--target_bucket",
+        required=True,
+        help="S3 Bucket for the files to be uploaded to",
+    )
+    finalize_upload_cmd.add_argument(
+        "--object_path",
+        required=True,
+        help="Path at which the object will be uploaded to in the destination bucket",
+    )
+    finalize_upload_cmd.add_argument(
+        "--file_size",
+        required=True,
+        help="File size as defined in the GDC manifest. This will be used to validate upload",
+    )
+    finalize_upload_cmd.add_argument(
+        "--upload_id", required=True, help="Multipart upload to complete"
+    )
+    finalize_upload_cmd.add_argument(
+        "--chunk_size", required=True, help="Size of each part in bytes"
+    )
+    finalize_upload_cmd.add_argument(
+        "--digest_location",
+        required=True,
+        help="s3://bucket/prefix where the part digests were written",
+    )
+
+    copy_replica_cmd = subparser.add_parser("copy_replica")
+    copy_replica_cmd.add_argument(
+        "--source", required=True, help="s3 url of the replica to copy"
+    )
+    copy_replica_cmd.add_argument(
+        "--target_bucket",
+        required=True,
+        help="S3 Bucket for the files to be uploaded to",
+    )
+    copy_replica_cmd.add_argument(
+        "--object_path",
+        required=True,
+        help="Path at which the object will be uploaded to in the destination bucket",
+    )
+    copy_replica_cmd.add_argument(
+        "--file_size",
+        required=True,
+        help="File size as defined in the GDC manifest. This will be used to validate the replica",
+    )
+    copy_replica_cmd.add_argument(
+        "--expected_md5",
+        required=True,
+        help="MD5 as given in the GDC manifest. This will be used to validate the replica",
+    )
+    copy_replica_cmd.add_argument(
+        "--checksum",
+        required=False,
+        default="",
+        help="Checksum recorded for a multipart replica, which is copied only if it still has it",
+    )
+    copy_replica_cmd.add_argument(
+        "--concurrency",
+        required=False,
+        default=COPY_CONCURRENCY,
+        help="Number of parts copied at the same time",
+    )
     return parser.parse_args()
 
 
@@ -247,4 +1319,70 @@ if __name__ == "__main__":
             args.expected_md5,
             int(args.chunk_size),
             int(args.retry),
+            args.state_location,
+            args.abort_on_failure,
+            int(args.concurrency),
+            float(args.connect_timeout),
+            float(args.read_timeout),
+            args.metrics_location,
+            not args.fixed_concurrency,
+            float(args.hedge_percentile),
+            float(args.hedge_max_fraction),
+            args.spool_dir,
+            int(args.memory_cap) * 1024 * 1024,
+        )
+    elif args.action == "stream_data":
+        stream_to_bucket(
+            args.file_id,
+            args.gdc_token,
+            args.target_bucket,
+            args.object_path,
+            int(args.file_size),
+            args.expected_md5,
+            int(args.retry),
+            int(args.buffer_size),
+        )
+    elif args.action == "copy_bundle":
+        copy_bundle(
+            args.bundle_manifest,
+            args.result_path,
+            args.gdc_token,
+            int(args.concurrency),
+            int(args.retry),
+        )
+    elif args.action == "upload_parts":
+        first_part = int(args.array_index) * int(args.parts_per_job) + 1
+        upload_part_range(
+            args.file_id,
+            args.gdc_token,
+            args.target_bucket,
+            args.object_path,
+            int(args.file_size),
+            args.upload_id,
+            int(args.chunk_size),
+            first_part,
+            first_part + int(args.parts_per_job) - 1,
+            args.digest_location,
+            int(args.retry),
+            int(args.concurrency),
+            adaptive=not args.fixed_concurrency,
+        )
+    elif args.action == "finalize_upload":
+        finalize_upload(
+            args.target_bucket,
+            args.object_path,
+            int(args.file_size),
+            args.upload_id,
+            int(args.chunk_size),
+            args.digest_location,
+        )
+    elif args.action == "copy_replica":
+        copy_from_replica(
+            args.source,
+            args.target_bucket,
+            args.object_path,
+            int(args.file_size),
+            args.expected_md5,
+            args.checksum,
+            int(args.concurrency),
         )
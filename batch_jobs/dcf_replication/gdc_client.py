@@ -0,0 +1,600 @@
+"""
+HTTP client for the GDC data API.
+
+All requests for a transfer go through one `requests.Session` whose
+connection pool is sized to the number of concurrent downloads, so ranges
+reuse kept-alive TLS connections instead of opening a new one per part.
+Failed requests are retried with jittered exponential backoff, honouring the
+`Retry-After` header sent by the API when it throttles.
+
+The number of range requests in flight can be adapted to the load of the API
+by a `ConcurrencyController`, and the coordinator slows down the submission
+of jobs with a `SubmissionThrottle` while the API is throttling. Range
+requests stuck in the tail of the latency distribution can be hedged, see
+`Hedger`.
+"""
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GDC_API_URL = os.environ.get("GDC_API_URL", "https://api.gdc.cancer.gov")
+CONNECT_TIMEOUT = float(os.environ.get("GDC_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("GDC_READ_TIMEOUT", 120))
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+# a request slower than this many times the baseline seconds per MB is a
+# sign that the API, or the link, is saturated. The baseline is a low
+# percentile of the recent requests rather than the best one ever seen, so
+# that one unusually fast response does not make every later one slow
+LATENCY_TOLERANCE = 2.0
+LATENCY_WINDOW = 50
+LATENCY_MIN_SAMPLES = 5
+LATENCY_BASELINE_PERCENTILE = 20
+DECREASE_FACTOR = 0.5
+# seconds per MB are measured on at least 1 MB, so that small ranges, whose
+# time is mostly the round trip, do not set the baseline
+LATENCY_MIN_BYTES = 1024 * 1024
+# status probes faster than this are never considered slow
+PROBE_MIN_SECONDS = 0.5
+THROTTLE_MAX_PROBES = 10
+# number of recent requests whose latency sets the hedging delay, and the
+# number needed before any request is hedged
+HEDGE_WINDOW = 50
+HEDGE_MIN_SAMPLES = 5
+# bytes read at a time from a streamed range
+READ_SIZE = 1024 * 1024
+
+
+class GDCRequestError(Exception):
+    """
+    Raised when a GDC request can not be completed after all retries
+    """
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date
+
+    Returns:
+        float: number of seconds to wait, or None if the header is not usable
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt, retry_after=None, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """
+    Delay before retry number `attempt` (starting at 0)
+
+    Uses "full jitter" so that many workers failing at the same time do not
+    retry in lockstep. A Retry-After from the server is a lower bound.
+    """
+    delay = random.uniform(0, min(cap, base * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+class ConcurrencyController:
+    """
+    AIMD limit on the number of GDC requests in flight
+
+    The limit grows by one every `limit` successful requests (additive
+    increase) and is multiplied by DECREASE_FACTOR (multiplicative decrease)
+    when a request is throttled or fails, or takes more than
+    `latency_tolerance` times the baseline seconds per MB, the
+    LATENCY_BASELINE_PERCENTILE of the last LATENCY_WINDOW requests. Only
+    requests started after the last decrease can decrease the limit again, so
+    the requests that were in flight when the API started to throttle count
+    once. A Retry-After pauses all new requests until it has passed.
+
+    Args:
+        max_limit(int): highest limit, e.g. the number of transfer threads
+        min_limit(int): lowest limit
+        initial_limit(int): limit to start from, max_limit if None
+        latency_tolerance(float): see above
+    """
+
+    def __init__(
+        self,
+        max_limit,
+        min_limit=1,
+        initial_limit=None,
+        latency_tolerance=LATENCY_TOLERANCE,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial_limit or self.max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.rates = deque(maxlen=LATENCY_WINDOW)
+        self.decreases = 0
+        self.paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def baseline_rate(self):
+        """
+        Returns:
+            float: seconds per MB of a normal request, None before
+            LATENCY_MIN_SAMPLES requests have completed
+        """
+        if len(self.rates) < LATENCY_MIN_SAMPLES:
+            return None
+        rates = sorted(self.rates)
+        return rates[int(len(rates) * LATENCY_BASELINE_PERCENTILE / 100)]
+
+    def acquire(self):
+        """
+        Wait until a request can be sent
+
+        Returns:
+            float: start time of the request, to pass to `release`
+        """
+        with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self._condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, nbytes=None, failed=False, retry_after=None):
+        """
+        Record the outcome of a request
+
+        Args:
+            started(float): returned by `acquire`
+            nbytes(int): bytes received by a successful request, None if
+                the request says nothing about the load, e.g. a 404
+            failed(bool): the request failed or was throttled
+            retry_after(float): Retry-After of the response, in seconds
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            slow = False
+            if not failed and nbytes is not None:
+                rate = (now - started) / max(nbytes, LATENCY_MIN_BYTES)
+                baseline = self.baseline_rate()
+                self.rates.append(rate)
+                slow = baseline is not None and rate > self.latency_tolerance * baseline
+            if failed or slow:
+                if started >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif nbytes is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Hedger:
+    """
+    Hedged range requests
+
+    A request still running after the `percentile` latency of the recent
+    requests, in seconds per MB, is sent a second time and the response that
+    arrives first is kept. The other request is left to finish in the
+    background, its latency is still recorded. Hedges stop once they have
+    requested `max_bytes`.
+
+    Args:
+        percentile(float): latency percentile after which a request is hedged
+        max_bytes(int): maximum number of bytes requested by hedges
+        threads(int): number of requests, hedges included, run at the same
+            time; should be twice the number of callers
+        window(int): number of recent requests the percentile is taken from
+    """
+
+    def __init__(self, percentile, max_bytes, threads, window=HEDGE_WINDOW):
+        self.percentile = percentile
+        self.max_bytes = max_bytes
+        self.rates = deque(maxlen=window)
+        self.hedges = 0
+        self.hedged_bytes = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max(2, threads))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def delay(self, nbytes):
+        """
+        Returns:
+            float: seconds after which a request of `nbytes` is hedged, None
+            before HEDGE_MIN_SAMPLES requests have completed
+        """
+        with self._lock:
+            if len(self.rates) < HEDGE_MIN_SAMPLES:
+                return None
+            rates = sorted(self.rates)
+        rank = min(len(rates) - 1, int(len(rates) * self.percentile / 100))
+        return rates[rank] * max(nbytes, LATENCY_MIN_BYTES)
+
+    def _timed(self, func):
+        started = time.monotonic()
+        result = func()
+        rate = (time.monotonic() - started) / max(len(result), LATENCY_MIN_BYTES)
+        with self._lock:
+            self.rates.append(rate)
+        return result
+
+    def _reserve(self, nbytes):
+        with self._lock:
+            if self.hedged_bytes + nbytes > self.max_bytes:
+                return False
+            self.hedged_bytes += nbytes
+            self.hedges += 1
+            return True
+
+    def run(self, func, nbytes):
+        """
+        Call `func`, and call it a second time if it is slow
+
+        Args:
+            func(callable): request returning the bytes of a range
+            nbytes(int): size of the range
+
+        Returns:
+            bytes: the first successful response
+        """
+        primary = self._executor.submit(self._timed, func)
+        delay = self.delay(nbytes)
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._reserve(nbytes):
+            return primary.result()
+
+        hedge = self._executor.submit(self._timed, func)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+class GDCClient:
+    """
+    Pooled, retrying client for https://api.gdc.cancer.gov/data/{file_id}
+
+    Args:
+        gdc_token(str): token sent in the X-Auth-Token header
+        pool_size(int): number of kept-alive connections, should match the
+            number of concurrent downloads
+        retries_num(int): number of attempts per request
+        connect_timeout(float): seconds to wait for a connection
+        read_timeout(float): seconds to wait between bytes of a response
+        api_url(str): base url of the GDC API
+        controller(ConcurrencyController): limit of the range requests in
+            flight, None for no limit other than the callers' threads
+        hedger(Hedger): hedging of slow range requests, None to not hedge
+    """
+
+    def __init__(
+        self,
+        gdc_token,
+        pool_size=1,
+        retries_num=3,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        api_url=None,
+        controller=None,
+        hedger=None,
+    ):
+        self.api_url = (api_url or GDC_API_URL).rstrip("/")
+        self.controller = controller
+        self.hedger = hedger
+        self.retries_num = retries_num
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(1, pool_size), pool_block=True
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if gdc_token:
+            self.session.headers["X-Auth-Token"] = gdc_token
+
+    def data_url(self, file_id):
+        return f"{self.api_url}/data/{file_id}"
+
+    def close(self):
+        if self.hedger is not None:
+            self.hedger.close()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, url, headers=None, stream=False):
+        response = self.session.get(
+            url, headers=headers, stream=stream, timeout=self.timeout
+        )
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            response.close()
+            raise RetryableError(
+                f"HTTP {response.status_code}",
+                parse_retry_after(response.headers.get("Retry-After")),
+            )
+        response.raise_for_status()
+        return response
+
+    def with_retries(self, description, func, on_retry=None):
+        """
+        Call `func` until it succeeds or the attempts are exhausted
+
+        `RetryableError` and connection/timeout errors are retried, any other
+        HTTP error (a bad token, an unknown file) is raised immediately.
+        `on_retry` is called before each retry.
+        """
+        last_error = None
+        for attempt in range(self.retries_num):
+            retry_after = None
+            try:
+                return func()
+            except requests.HTTPError:
+                raise
+            except RetryableError as e:
+                last_error = e
+                retry_after = e.retry_after
+            except requests.RequestException as e:
+                last_error = e
+
+            if attempt + 1 < self.retries_num:
+                delay = backoff_delay(attempt, retry_after)
+                print(
+                    f"{description} failed (attempt {attempt + 1}): {last_error}. Retrying in {delay:.1f}s"
+                )
+                if on_retry:
+                    on_retry()
+                time.sleep(delay)
+
+        raise GDCRequestError(
+            f"{description} failed after {self.retries_num} attempts: {last_error}"
+        )
+
+    def controlled(self, func):
+        """
+        Call `func` within the limit of the controller, and report the
+        outcome to it
+        """
+        if self.controller is None:
+            return func()
+        started = self.controller.acquire()
+        try:
+            result = func()
+        except RetryableError as e:
+            self.controller.release(started, failed=True, retry_after=e.retry_after)
+            raise
+        except requests.HTTPError:
+            self.controller.release(started)
+            raise
+        except requests.RequestException:
+            self.controller.release(started, failed=True)
+            raise
+        except BaseException:
+            self.controller.release(started)
+            raise
+        self.controller.release(started, nbytes=len(result))
+        return result
+
+    def get_range(self, file_id, start, end, on_retry=None):
+        """
+        Download the byte range [start, end] of a file
+
+        A response with the wrong length is retried like a failed request.
+        `on_retry` is called before each retry. With a hedger, a slow request
+        is sent a second time, see `Hedger`.
+
+        Returns:
+            bytes: the requested range
+        """
+        url = self.data_url(file_id)
+
+        def download():
+            response = self._send(url, headers={"Range": f"bytes={start}-{end}"})
+            chunk = response.content
+            if len(chunk) != end - start + 1:
+                raise RetryableError(
+                    f"Chunk size mismatch: expected {end - start + 1}, got {len(chunk)}"
+                )
+            return chunk
+
+        def attempt():
+            return self.controlled(download)
+
+        def request():
+            return self.with_retries(
+                f"Range {start}-{end} of {file_id}", attempt, on_retry
+            )
+
+        if self.hedger is None:
+            return request()
+        return self.hedger.run(request, end - start + 1)
+
+    def get_range_into(self, file_id, start, end, part, on_retry=None):
+        """
+        Stream the byte range [start, end] of a file into a part buffer
+
+        A retry requests only the bytes the failed attempt did not write.
+        Ranges written into a buffer are not hedged.
+
+        Args:
+            part(SpooledPart): empty buffer of end - start + 1 bytes
+
+        Returns:
+            SpooledPart: the part
+        """
+        url = self.data_url(file_id)
+
+        def download():
+            response = self._send(
+                url,
+                headers={"Range": f"bytes={start + part.written}-{end}"},
+                stream=True,
+            )
+            try:
+                for data in response.iter_content(chunk_size=READ_SIZE):
+                    try:
+                        part.write(data)
+                    except ValueError as e:
+                        part.rewind()
+                        raise RetryableError(f"Chunk size mismatch: {e}")
+            finally:
+                response.close()
+            if part.written != part.size:
+                raise RetryableError(
+                    f"Chunk size mismatch: expected {part.size}, got {part.written}"
+                )
+            return part
+
+        return self.with_retries(
+            f"Range {start}-{end} of {file_id}",
+            lambda: self.controlled(download),
+            on_retry,
+        )
+
+    def open_stream(self, file_id):
+        """
+        Open a streaming download of a whole file
+
+        Returns:
+            requests.Response: response to read with iter_content
+        """
+        url = self.data_url(file_id)
+        return self.with_retries(
+            f"Download of {file_id}", lambda: self._send(url, stream=True)
+        )
+
+    def status(self):
+        """
+        Probe the status endpoint of the API, once
+
+        Returns:
+            requests.Response: the response
+        """
+        response = self._send(f"{self.api_url}/status")
+        response.close()
+        return response
+
+
+class RetryableError(Exception):
+    """
+    A failed attempt that is worth retrying
+    """
+
+    def __init__(self, error, retry_after=None):
+        super().__init__(error)
+        self.retry_after = retry_after
+
+
+class SubmissionThrottle:
+    """
+    Slow down the submission of gdc_copy jobs while the GDC API is under load
+
+    Before each chunk of jobs is submitted, the status endpoint of the API is
+    probed. While the probe is throttled, fails, or takes more than
+    `latency_tolerance` times the fastest probe, submission waits for the
+    Retry-After of the response or a growing backoff delay, for at most
+    THROTTLE_MAX_PROBES probes.
+
+    Args:
+        client(GDCClient): client of the API
+        latency_tolerance(float): see above
+        max_wait(float): longest wait between two probes, in seconds
+    """
+
+    def __init__(self, client, latency_tolerance=LATENCY_TOLERANCE, max_wait=None):
+        self.client = client
+        self.latency_tolerance = latency_tolerance
+        self.max_wait = max_wait or BACKOFF_MAX
+        self.best_seconds = None
+        self.slow_probes = 0
+        self.waited = 0.0
+
+    def probe(self):
+        """
+        Returns:
+            float: seconds to wait before submitting more jobs, 0 if the API
+            is not under load
+        """
+        retry_after = None
+        started = time.monotonic()
+        try:
+            self.client.status()
+            seconds = time.monotonic() - started
+            if self.best_seconds is None or seconds < self.best_seconds:
+                self.best_seconds = seconds
+            slow = seconds > self.latency_tolerance * max(
+                self.best_seconds, PROBE_MIN_SECONDS
+            )
+        except RetryableError as e:
+            slow = True
+            retry_after = e.retry_after
+        except requests.HTTPError:
+            # the status can not be probed, e.g. no such endpoint
+            slow = False
+        except requests.RequestException:
+            slow = True
+        if not slow:
+            self.slow_probes = 0
+            return 0.0
+        delay = backoff_delay(self.slow_probes, retry_after, cap=self.max_wait)
+        self.slow_probes += 1
+        return delay
+
+    def wait(self):
+        """
+        Wait until the API is not under load
+
+        Returns:
+            float: seconds waited
+        """
+        waited = 0.0
+        for _ in range(THROTTLE_MAX_PROBES):
+            delay = self.probe()
+            if not delay:
+                break
+            logging.info(f"GDC API under load, submission paused for {delay:.1f}s")
+            time.sleep(delay)
+            waited += delay
+        self.waited += waited
+        return waited
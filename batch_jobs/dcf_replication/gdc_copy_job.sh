@@ -5,143 +5,91 @@ aws configure set aws_access_key_id "$ACCESS_KEY_ID"
 aws configure set aws_secret_access_key "$SECRET_ACCESS_KEY"
 echo "aws credentials configured."
 
-if [[ "$DESTINATION_BUCKET" == s3://* ]]; then
-    S3_PREFIX="${DESTINATION_BUCKET%/}"
-else
-    S3_PREFIX="s3://$DESTINATION_BUCKET"
+if [ -n "${PROFILE_NAME:-}" ]; then
+    export AWS_PROFILE="$PROFILE_NAME"
 fi
 
-MB_MULTIPLIER=$(( 1024 ** 2 ))
-MULTI_PART_THRESHOLD=$(( $MB_MULTIPLIER * $MULTI_PART_THRESHOLD ))
-CHUNK_SIZE=$(( $MB_MULTIPLIER * $CHUNK_SIZE ))
-
-S3_OBJ="$S3_PREFIX/$KEY"
 MAX_RETRIES=3
 RETRY_DELAY=10
 attempt=1
 success=false
 
-if [ "$SIZE" -ge "$MULTI_PART_THRESHOLD" ]; then
-
-    echo "Using multipart to upload file $ID..."
-
-    command="python3 ./batch_jobs/dcf_replication/file_get_upload.py upload_data --file_id $ID --gdc_token $GDC_TOKEN --target_bucket $DESTINATION_BUCKET --object_path $KEY --file_size $SIZE --expected_md5 $MD5SUM --chunk_size $CHUNK_SIZE"
-
-    while [ "$attempt" -le "$MAX_RETRIES" ]; do
-        if $command; then
-            echo "Download validation passed, upload complete."
-            success=true
-            break
-        else
-            echo "Transfer failed on attempt $attempt"
-        fi
+if [ -n "${BUNDLE_MANIFEST:-}" ]; then
+    echo "Copying bundle $BUNDLE_MANIFEST..."
 
-        echo "Attempt $attempt failed, sleeping $RETRY_DELAY seconds then retrying..."
-        sleep "$RETRY_DELAY"
-        attempt=$((attempt + 1))
-    done
+    # files already copied by a previous attempt are skipped, so a retry only
+    # copies the files of the bundle that failed
+    command="python3 ./batch_jobs/dcf_replication/file_get_upload.py copy_bundle --bundle_manifest $BUNDLE_MANIFEST --result_path $BUNDLE_RESULTS --gdc_token $GDC_TOKEN --concurrency ${BUNDLE_CONCURRENCY:-8}"
+    last_attempt_flag=""
+elif [ -n "${REPLICA_SOURCE:-}" ]; then
+    echo "Copying file $ID from $REPLICA_SOURCE..."
 
-    if [ "$success" = false ]; then
-        echo "ERROR: File transfer failed after $MAX_RETRIES attempts"
-        exit 1
+    # server-side copy of a replica already in one of our buckets
+    command="python3 ./batch_jobs/dcf_replication/file_get_upload.py copy_replica --source $REPLICA_SOURCE --target_bucket $DESTINATION_BUCKET --object_path $KEY --file_size $SIZE --expected_md5 $MD5SUM --concurrency ${CONCURRENCY:-10}"
+    if [ -n "${REPLICA_CHECKSUM:-}" ]; then
+        command="$command --checksum $REPLICA_CHECKSUM"
     fi
+    last_attempt_flag=""
+elif [ -n "${SPLIT_UPLOAD_ID:-}" ]; then
+    # the file is split across an array of jobs sharing one multipart upload,
+    # each uploads a range of parts and a dependent job completes the upload
+    CHUNK_SIZE=$(( 1024 ** 2 * CHUNK_SIZE ))
+    if [ "${SPLIT_ACTION:-}" = "finalize_upload" ]; then
+        echo "Completing multipart upload of file $ID..."
+        command="python3 ./batch_jobs/dcf_replication/file_get_upload.py finalize_upload --target_bucket $DESTINATION_BUCKET --object_path $KEY --file_size $SIZE --upload_id $SPLIT_UPLOAD_ID --chunk_size $CHUNK_SIZE --digest_location $SPLIT_DIGESTS"
+    else
+        echo "Uploading parts of file $ID (array index ${AWS_BATCH_JOB_ARRAY_INDEX:-0})..."
+        command="python3 ./batch_jobs/dcf_replication/file_get_upload.py upload_parts --file_id $ID --gdc_token $GDC_TOKEN --target_bucket $DESTINATION_BUCKET --object_path $KEY --file_size $SIZE --upload_id $SPLIT_UPLOAD_ID --chunk_size $CHUNK_SIZE --parts_per_job $SPLIT_PARTS_PER_JOB --digest_location $SPLIT_DIGESTS --concurrency ${CONCURRENCY:-1}"
+    fi
+    last_attempt_flag=""
+elif [ "$SIZE" -ge "$(( 1024 ** 2 * MULTI_PART_THRESHOLD ))" ]; then
+    echo "Using multipart to upload file $ID..."
 
-    echo "SUCCESS: File verified and transferred"
-    exit 0
+    # parts uploaded by a failed attempt are kept and resumed by the next one,
+    # the multipart upload is only aborted when the last attempt fails
+    CHUNK_SIZE=$(( 1024 ** 2 * CHUNK_SIZE ))
+    command="python3 ./batch_jobs/dcf_replication/file_get_upload.py upload_data --file_id $ID --gdc_token $GDC_TOKEN --target_bucket $DESTINATION_BUCKET --object_path $KEY --file_size $SIZE --expected_md5 $MD5SUM --chunk_size $CHUNK_SIZE --state_location ${UPLOAD_STATE_LOCATION:-/tmp/gdc_upload_state} --concurrency ${CONCURRENCY:-1}"
+    if [ -n "${METRICS_LOCATION:-}" ]; then
+        command="$command --metrics_location $METRICS_LOCATION"
+    fi
+    if [ -n "${HEDGE_PERCENTILE:-}" ]; then
+        command="$command --hedge_percentile $HEDGE_PERCENTILE"
+    fi
+    if [ -n "${SPOOL_DIR:-}" ]; then
+        command="$command --spool_dir $SPOOL_DIR --memory_cap ${SPOOL_MEMORY_CAP:-256}"
+    fi
+    last_attempt_flag="--abort_on_failure"
 else
-    echo "Using s5cmd to upload file $ID..."
-
-    while [ "$attempt" -le "$MAX_RETRIES" ]; do
-        HASH_FILE="$(mktemp /tmp/hashout.XXXXXX)"
-        S5CMD_ERR_FILE="$(mktemp /tmp/s5cmderr.XXXXXX)"
+    echo "Streaming file $ID..."
 
-        aws_cp_cmd=(s5cmd pipe "$S3_OBJ")
-
-        if [ -n "${PROFILE_NAME:-}" ]; then
-            export AWS_PROFILE="$PROFILE_NAME"
-        fi
-
-        if curl --fail --location "https://api.gdc.cancer.gov/data/$ID" \
-            --header "X-Auth-Token: $GDC_TOKEN" \
-            | python3 -c "
-import sys, hashlib, traceback
-try:
-    h = hashlib.md5()
-    n = 0
-    buf_size = 8 * 1024 * 1024
-    while True:
-        chunk = sys.stdin.buffer.read(buf_size)
-        if not chunk:
-            break
-        h.update(chunk)
-        n += len(chunk)
-        sys.stdout.buffer.write(chunk)
-        sys.stdout.buffer.flush()
-    sys.stderr.write(h.hexdigest() + '\n')
-    sys.stderr.write(str(n) + '\n')
-except Exception as e:
-    sys.stderr.write('PYTHON ERROR: ' + str(e) + '\n')
-    sys.stderr.write(traceback.format_exc())
-    sys.exit(1)" 2>"$HASH_FILE" \
-            | "${aws_cp_cmd[@]}" 2>"$S5CMD_ERR_FILE"; then
-
-            downloaded_md5=$(sed -n '1p' "$HASH_FILE")
-            downloaded_size=$(sed -n '2p' "$HASH_FILE")
-            rm -f "$HASH_FILE" "$S5CMD_ERR_FILE"
-
-            size_ok=true
-            md5_ok=true
-
-            if [ -n "${SIZE:-}" ]; then
-                if [ "$downloaded_size" -ne "$SIZE" ]; then
-                    echo "Size mismatch: Expected $SIZE bytes, got $downloaded_size bytes"
-                    size_ok=false
-                else
-                    echo "Size validation passed: $downloaded_size bytes"
-                fi
-            else
-                echo "SIZE not set, skipping size validation (observed: $downloaded_size bytes)"
-            fi
-
-            if [ -n "${MD5SUM:-}" ]; then
-                if [ "$downloaded_md5" != "$MD5SUM" ]; then
-                    echo "md5sum mismatch: Expected $MD5SUM, got $downloaded_md5"
-                    md5_ok=false
-                else
-                    echo "MD5 validation passed: $downloaded_md5"
-                fi
-            else
-                echo "MD5SUM not set, skipping MD5 validation (observed: $downloaded_md5)"
-            fi
-
-            if [ "$size_ok" = true ] && [ "$md5_ok" = true ]; then
-                echo "Download validation passed, upload complete."
-                success=true
-                break
-            else
-                echo "Validation failed, removing possibly corrupt S3 object: $S3_OBJ"
-                s5cmd rm "$S3_OBJ" || true
-            fi
-
-        else
-            echo "curl/pipe/s5cmd pipeline failed"
-            echo "=== Python stderr (md5/size or traceback) ==="
-            cat "$HASH_FILE" || true
-            echo "=== s5cmd stderr ==="
-            cat "$S5CMD_ERR_FILE" || true
-            rm -f "$HASH_FILE" "$S5CMD_ERR_FILE" || true
-        fi
+    # the object is only written once its size and md5 have been validated
+    command="python3 ./batch_jobs/dcf_replication/file_get_upload.py stream_data --file_id $ID --gdc_token $GDC_TOKEN --target_bucket $DESTINATION_BUCKET --object_path $KEY --file_size $SIZE --expected_md5 $MD5SUM"
+    last_attempt_flag=""
+fi
 
-        echo "Attempt $attempt failed, sleeping $RETRY_DELAY seconds then retrying..."
-        sleep "$RETRY_DELAY"
-        attempt=$((attempt + 1))
-    done
+while [ "$attempt" -le "$MAX_RETRIES" ]; do
+    extra_flags=""
+    if [ "$attempt" -eq "$MAX_RETRIES" ]; then
+        extra_flags="$last_attempt_flag"
+    fi
 
-    if [ "$success" = false ]; then
-        echo "ERROR: File transfer failed after $MAX_RETRIES attempts"
-        exit 1
+    if $command $extra_flags; then
+        echo "Download validation passed, upload complete."
+        success=true
+        break
+    else
+        echo "Transfer failed on attempt $attempt"
     fi
 
-    echo "SUCCESS: File verified and transferred"
-    exit 0
+    echo "Attempt $attempt failed, sleeping $RETRY_DELAY seconds then retrying..."
+    sleep "$RETRY_DELAY"
+    attempt=$((attempt + 1))
+done
+
+if [ "$success" = false ]; then
+    echo "ERROR: File transfer failed after $MAX_RETRIES attempts"
+    exit 1
 fi
+
+echo "SUCCESS: File verified and transferred"
+exit 0
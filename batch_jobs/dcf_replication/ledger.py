@@ -0,0 +1,262 @@
+"""
+Submission ledger of a DCF replication run.
+
+The coordinator records the outcome of every manifest row, SKIPPED when the
+file is already at its destination, SUBMITTED with the id of its Batch job,
+COPIED from a replica, or FAILED. Records are written as JSONL segments, one
+per submitted chunk, under {location}/{run_key}/, where the location is a
+local directory or an s3://bucket/prefix and the run key is derived from the
+manifest and shard.
+
+Records are flushed every FLUSH_SIZE rows or FLUSH_SECONDS, whichever comes
+first, so that a crash loses the record of at most the jobs submitted since
+the last flush.
+
+A coordinator restarted after a crash loads the segments and neither checks
+the destination of, nor submits again, the rows that were skipped, submitted
+or copied; FAILED rows are tried again. The loaded records are kept in a
+sqlite table rather than in memory, as a resumed run can have millions of
+rows. Once a run has submitted all its rows it writes a COMPLETE marker, and
+the next run of the same manifest starts a new ledger.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+SEGMENT_SUFFIX = ".jsonl"
+COMPLETE_MARKER = "COMPLETE"
+# statuses of the rows a resumed run leaves out
+RESUMED_STATUSES = ("SKIPPED", "SUBMITTED", "COPIED")
+FLUSH_SIZE = 500
+FLUSH_SECONDS = 5
+# segments read at the same time when a ledger is loaded
+LOAD_THREADS = 16
+
+
+def ledger_key(manifest_file, shard_index=0, shard_count=1):
+    """
+    Returns:
+        str: key of the ledger of a run, the same for every run of a manifest
+        and shard
+    """
+    run = f"{manifest_file}#{shard_index}/{shard_count}"
+    return hashlib.sha1(run.encode("utf-8")).hexdigest()
+
+
+class SubmissionLedger:
+    """
+    Durable status of the rows of a run
+
+    Args:
+        s3(S3.Client): s3 client, used when location is an s3 url
+        location(str): local directory or s3://bucket/prefix of the ledgers
+        run_key(str): see `ledger_key`
+        path(str): sqlite database file of the loaded records. A temporary
+            file is used if None, ":memory:" keeps them in memory
+        flush_size(int): number of records written per segment
+        flush_seconds(float): maximum age of a pending record
+    """
+
+    def __init__(
+        self,
+        s3,
+        location,
+        run_key,
+        path=None,
+        flush_size=FLUSH_SIZE,
+        flush_seconds=FLUSH_SECONDS,
+    ):
+        self.s3 = s3
+        self.run_key = run_key
+        if location.startswith("s3://"):
+            self.bucket, _, prefix = location.replace("s3://", "", 1).partition("/")
+            self.prefix = f"{prefix.strip('/')}/{run_key}/".lstrip("/")
+        else:
+            self.bucket = None
+            self.prefix = os.path.join(location, run_key, "")
+        self._tmp_path = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="dcf_ledger_", suffix=".db")
+            os.close(fd)
+            self._tmp_path = path
+        # file id -> (status, job id) of the loaded records
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(id TEXT PRIMARY KEY, status TEXT, job_id TEXT)"
+        )
+        self.segments = 0
+        self.pending = []
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._flushed_at = time.monotonic()
+
+    def close(self):
+        self.db.close()
+        if self._tmp_path:
+            os.remove(self._tmp_path)
+            self._tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _names(self):
+        if self.bucket is None:
+            return sorted(os.listdir(self.prefix)) if os.path.isdir(self.prefix) else []
+        paginator = self.s3.get_paginator("list_objects_v2")
+        return sorted(
+            obj["Key"][len(self.prefix) :]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
+            for obj in page.get("Contents", [])
+        )
+
+    def _read(self, name):
+        if self.bucket is None:
+            with open(self.prefix + name, "rb") as f:
+                return f.read()
+        return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + name)[
+            "Body"
+        ].read()
+
+    def _write(self, name, body):
+        if self.bucket is None:
+            os.makedirs(self.prefix, exist_ok=True)
+            # write then rename so that a crash never leaves a truncated segment
+            with open(self.prefix + name + ".tmp", "wb") as f:
+                f.write(body)
+            os.replace(self.prefix + name + ".tmp", self.prefix + name)
+            return
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + name, Body=body)
+
+    def _delete(self, names):
+        if self.bucket is None:
+            for name in names:
+                os.remove(self.prefix + name)
+            return
+        for start in range(0, len(names), 1000):
+            self.s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": self.prefix + name}
+                        for name in names[start : start + 1000]
+                    ]
+                },
+            )
+
+    def _load_segment(self, body):
+        resumed = []
+        for line in body.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry["status"] in RESUMED_STATUSES:
+                resumed.append((entry["id"], entry["status"], entry.get("job_id")))
+            else:
+                # a record of a later segment overrides the earlier ones
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", resumed
+                )
+                resumed = []
+                self.db.execute("DELETE FROM entries WHERE id = ?", (entry["id"],))
+        self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", resumed)
+
+    def load(self):
+        """
+        Load the records of an interrupted run, or start a new ledger if the
+        previous run completed
+
+        Returns:
+            int: number of rows the run can leave out
+        """
+        try:
+            names = self._names()
+        except ClientError as e:
+            print(f"Can not list the submission ledger {self.run_key}. Detail {e}")
+            names = []
+        if COMPLETE_MARKER in names:
+            self._delete(names)
+            names = []
+        names = [name for name in names if name.endswith(SEGMENT_SUFFIX)]
+        self.segments = len(names)
+        with ThreadPoolExecutor(LOAD_THREADS) as executor:
+            # segments are applied in order, a batch of them read at a time
+            for start in range(0, len(names), LOAD_THREADS * 4):
+                batch = names[start : start + LOAD_THREADS * 4]
+                for body in executor.map(self._read, batch):
+                    self._load_segment(body)
+                self.db.commit()
+        return len(self)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, file_id):
+        return (
+            self.db.execute("SELECT 1 FROM entries WHERE id = ?", (file_id,)).fetchone()
+            is not None
+        )
+
+    def resume(self, fi):
+        """
+        Restore the status and job id recorded for a row
+
+        Returns:
+            bool: True if the row was skipped, submitted or copied by an
+            earlier run
+        """
+        found = self.db.execute(
+            "SELECT status, job_id FROM entries WHERE id = ?", (fi["id"],)
+        ).fetchone()
+        if found is None:
+            return False
+        status, job_id = found
+        fi["job_status"] = status
+        if job_id:
+            fi["job_id"] = job_id
+        return True
+
+    def record(self, fi):
+        """
+        Add the outcome of a row to the next segment, written once
+        `flush_size` records are pending or `flush_seconds` after the
+        previous segment
+        """
+        entry = {"id": fi["id"], "status": fi["job_status"]}
+        if fi.get("job_id"):
+            entry["job_id"] = fi["job_id"]
+        self.pending.append(entry)
+        if (
+            len(self.pending) >= self.flush_size
+            or time.monotonic() - self._flushed_at >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending records as a new segment
+        """
+        if not self.pending:
+            return
+        body = "".join(json.dumps(entry) + "\n" for entry in self.pending)
+        self._write(f"{self.segments:08d}{SEGMENT_SUFFIX}", body.encode("utf-8"))
+        self.segments += 1
+        self.pending = []
+        self._flushed_at = time.monotonic()
+
+    def complete(self):
+        """
+        Mark the run as complete, the next run of the manifest starts over
+        """
+        self.flush()
+        self._write(COMPLETE_MARKER, b"")
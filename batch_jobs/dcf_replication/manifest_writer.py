@@ -0,0 +1,196 @@
+"""
+Streaming writer of tsv manifests to S3.
+
+Rows are encoded, optionally gzip compressed, and uploaded as the parts of
+an S3 multipart upload once PART_SIZE bytes are buffered, so a manifest is
+never held in memory. Output can be split into shards of at most
+`max_shard_size` uncompressed bytes, each shard being a complete manifest
+with its own header that downstream indexing can pick up as soon as it is
+written. `open_s3_manifest` reads such a file back.
+"""
+import csv
+import gzip
+import io
+import logging
+import zlib
+from contextlib import contextmanager
+
+# S3 requires every part but the last to be at least 5 MB
+PART_SIZE = 8 * 1024 * 1024
+
+
+class S3ManifestWriter:
+    """
+    Write a tsv manifest to s3://bucket/key_prefix.tsv[.gz], or to
+    key_prefix_00000.tsv[.gz], key_prefix_00001.tsv[.gz], ... when sharded
+
+    Args:
+        s3(S3.Client): s3 client
+        bucket(str): destination bucket
+        key_prefix(str): key of the manifest, without extension
+        fieldnames(list(str)): columns of the manifest
+        compress(bool): gzip the manifest
+        max_shard_size(int): uncompressed bytes per shard, 0 for a single file
+        part_size(int): bytes buffered before a part is uploaded
+    """
+
+    def __init__(
+        self,
+        s3,
+        bucket,
+        key_prefix,
+        fieldnames,
+        compress=False,
+        max_shard_size=0,
+        part_size=PART_SIZE,
+    ):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.compress = compress
+        self.max_shard_size = max_shard_size
+        self.part_size = part_size
+        self.keys = []
+        self.count = 0
+        self._writer = csv.DictWriter(
+            self, fieldnames=fieldnames, delimiter="\t", extrasaction="ignore"
+        )
+        self._key = None
+        self._buffer = bytearray()
+        self._compressor = None
+        self._upload_id = None
+        self._parts = []
+        self._shard_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open_shard(self):
+        suffix = f"_{len(self.keys):05d}" if self.max_shard_size else ""
+        self._key = f"{self.key_prefix}{suffix}.tsv" + (".gz" if self.compress else "")
+        self._buffer = bytearray()
+        self._compressor = zlib.compressobj(wbits=31) if self.compress else None
+        self._upload_id = None
+        self._parts = []
+        self._shard_size = 0
+        self._writer.writeheader()
+
+    def _content_type(self):
+        return "application/gzip" if self.compress else "text/csv"
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self._key, ContentType=self._content_type()
+            )["UploadId"]
+        part_number = len(self._parts) + 1
+        response = self.s3.upload_part(
+            Body=bytes(self._buffer),
+            Bucket=self.bucket,
+            Key=self._key,
+            PartNumber=part_number,
+            UploadId=self._upload_id,
+        )
+        self._parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        self._buffer = bytearray()
+
+    def _close_shard(self):
+        if self._compressor:
+            self._buffer += self._compressor.flush()
+        if self._upload_id is None:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=self._key,
+                Body=bytes(self._buffer),
+                ContentType=self._content_type(),
+            )
+        else:
+            if self._buffer:
+                self._upload_part()
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        logging.info(
+            f"Output Manifest File '{self._key}' successfully uploaded to S3 bucket '{self.bucket}'."
+        )
+        self.keys.append(self._key)
+        self._key = None
+        self._upload_id = None
+
+    def write(self, text):
+        """
+        File interface used by the csv writer
+        """
+        data = text.encode("utf-8")
+        self._shard_size += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+
+    def writerow(self, row):
+        if self._key is not None and (
+            self.max_shard_size and self._shard_size >= self.max_shard_size
+        ):
+            self._close_shard()
+        if self._key is None:
+            self._open_shard()
+        self._writer.writerow(row)
+        self.count += 1
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        """
+        Upload the last shard. A manifest with no rows is written with only
+        its header.
+
+        Returns:
+            list(str): keys of the manifest files
+        """
+        if self._key is None and not self.keys:
+            self._open_shard()
+        if self._key is not None:
+            self._close_shard()
+        return self.keys
+
+    def abort(self):
+        """
+        Abort the upload of the current shard, shards already written are kept
+        """
+        if self._upload_id is not None:
+            try:
+                self.s3.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self._key, UploadId=self._upload_id
+                )
+            except Exception as e:
+                logging.error(f"Can not abort upload of {self._key}. Detail {e}")
+        self._key = None
+        self._upload_id = None
+
+
+@contextmanager
+def open_s3_manifest(s3, bucket, key):
+    """
+    Stream the rows of a tsv manifest in S3, gzipped if its key ends in .gz
+
+    Yields:
+        csv.DictReader: reader of the rows
+    """
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    if key.endswith(".gz"):
+        body = gzip.GzipFile(fileobj=body)
+    with io.TextIOWrapper(body, encoding="utf-8", newline="") as f:
+        yield csv.DictReader(f, delimiter="\t")
@@ -0,0 +1,206 @@
+"""
+Choice of the part sizes of multipart uploads.
+
+S3 accepts at most MAX_PARTS parts of MIN_PART_SIZE to MAX_PART_SIZE bytes,
+and a transfer holds about `concurrency + 1` parts in memory: the parts in
+flight and the part being hashed. Within those limits larger parts amortize
+the cost of each request, while smaller parts spread a file across the
+concurrent streams and lose less work to a retry.
+
+A PartPlanner hands out the byte ranges of the parts one at a time. Unless a
+part size is imposed, the first parts are DEFAULT_PART_SIZE and later parts
+are sized from the measured throughput of the previous ones so that a part
+takes about TARGET_PART_SECONDS to transfer, but never larger than the share
+of the file of each concurrent stream. Every range it
+hands out keeps the rest of the file within the part limit.
+"""
+import os
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+MAX_PARTS = 10000
+DEFAULT_PART_SIZE = 64 * MB
+TARGET_PART_SECONDS = 30
+# share of the memory of the container used by part buffers
+MEMORY_FRACTION = 0.5
+# weight of the latest part in the measured throughput
+THROUGHPUT_SMOOTHING = 0.5
+
+CGROUP_MEMORY_LIMITS = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+
+
+def align(size):
+    """
+    Returns:
+        int: size rounded up to a whole number of MB
+    """
+    return -(-int(size) // MB) * MB
+
+
+def memory_limit():
+    """
+    Memory available to the container, from its cgroup limit or the memory
+    of the host
+
+    Returns:
+        int: bytes, None if it can not be determined
+    """
+    limits = []
+    for path in CGROUP_MEMORY_LIMITS:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limits.append(int(value))
+    try:
+        limits.append(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"))
+    except (ValueError, OSError, AttributeError):
+        pass
+    return min(limits) if limits else None
+
+
+def memory_budget(fraction=MEMORY_FRACTION):
+    """
+    Returns:
+        int: bytes that part buffers may use, None if unknown
+    """
+    limit = memory_limit()
+    return int(limit * fraction) if limit else None
+
+
+def min_part_size(remaining, parts_left):
+    """
+    Returns:
+        int: the smallest part size with which `remaining` bytes fit in
+        `parts_left` parts
+    """
+    if remaining <= 0:
+        return MIN_PART_SIZE
+    if parts_left <= 0:
+        raise ValueError(f"No part left for the last {remaining} bytes")
+    return max(MIN_PART_SIZE, align(-(-remaining // parts_left)))
+
+
+def plan_part_size(file_size, part_size=None):
+    """
+    Part size of an upload whose parts must all have the same size, e.g.
+    when they are uploaded by several jobs
+
+    Args:
+        file_size(int): bytes
+        part_size(int): preferred part size in bytes, None for DEFAULT_PART_SIZE
+
+    Returns:
+        int: part size in bytes, raised so that the file fits in MAX_PARTS parts
+    """
+    return max(part_size or DEFAULT_PART_SIZE, min_part_size(file_size, MAX_PARTS))
+
+
+class PartPlanner:
+    """
+    Plan the parts of a multipart upload as it progresses
+
+    Args:
+        file_size(int): bytes
+        concurrency(int): parts transferred at the same time
+        part_size(int): part size in bytes, None to size parts from the
+            measured throughput
+        budget(int): bytes part buffers may use, None for `memory_budget()`
+        offset(int): bytes already uploaded
+        part_number(int): number of the last part already uploaded
+
+    Attributes:
+        concurrency(int): the concurrency, lowered if the parts needed to stay
+            within the part limit do not fit in the memory budget otherwise
+    """
+
+    def __init__(
+        self,
+        file_size,
+        concurrency=1,
+        part_size=None,
+        budget=None,
+        offset=0,
+        part_number=0,
+    ):
+        self.file_size = file_size
+        self.offset = offset
+        self.part_number = part_number
+        self.fixed = part_size is not None
+        self.throughput = None
+
+        if budget is None:
+            budget = memory_budget()
+        smallest = min_part_size(file_size - offset, MAX_PARTS - part_number)
+        if budget:
+            concurrency = max(1, min(concurrency, budget // smallest - 1))
+            self.max_part_size = max(
+                MIN_PART_SIZE, min(MAX_PART_SIZE, budget // (concurrency + 1))
+            )
+            self.max_part_size -= self.max_part_size % MB
+        else:
+            self.max_part_size = MAX_PART_SIZE
+        self.concurrency = concurrency
+
+        self.part_size = part_size if self.fixed else DEFAULT_PART_SIZE
+        # planned parts are never larger than needed to keep every stream busy
+        self.stream_share = align(-(-(file_size - offset) // concurrency))
+
+    def record(self, size, seconds):
+        """
+        Account for the transfer of a part of `size` bytes that took `seconds`
+        """
+        if seconds <= 0:
+            return
+        throughput = size / seconds
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput = (
+                THROUGHPUT_SMOOTHING * throughput
+                + (1 - THROUGHPUT_SMOOTHING) * self.throughput
+            )
+        if not self.fixed:
+            self.part_size = align(self.throughput * TARGET_PART_SECONDS)
+
+    def next_part_size(self):
+        """
+        Returns:
+            int: size of the next part in bytes, within the memory budget
+            unless the part limit requires more
+        """
+        size = min(self.part_size, self.max_part_size)
+        if not self.fixed:
+            size = min(size, self.stream_share)
+        size = max(MIN_PART_SIZE, size)
+        return max(
+            size,
+            min_part_size(self.file_size - self.offset, MAX_PARTS - self.part_number),
+        )
+
+    def next_range(self):
+        """
+        Returns:
+            tuple(int, int, int): part number, first and last byte of the next
+            part, None once the whole file is planned
+        """
+        if self.offset >= self.file_size:
+            return None
+        start = self.offset
+        end = min(start + self.next_part_size(), self.file_size) - 1
+        self.offset = end + 1
+        self.part_number += 1
+        return self.part_number, start, end
+
+    def __iter__(self):
+        while True:
+            part = self.next_range()
+            if part is None:
+                return
+            yield part
@@ -0,0 +1,94 @@
+"""
+Server-side copy of a file from a replica already in one of our buckets.
+
+A replica is only trusted if its content can be checked without reading it:
+
+- an object uploaded in one part has the md5 of its content as ETag, which
+  must be the md5 of the manifest
+- the ETag of a multipart object is not an md5, so its checksum, read with a
+  HEAD request, must be the checksum recorded for that url when it was
+  copied and validated, see `ContentIndex`. Replicas without a recorded
+  checksum are not reused.
+
+Objects up to MAX_PART_SIZE are copied by a single CopyObject, larger ones
+by parts. Like the uploads, copies are owned by the bucket owner and get a
+checksum stored by S3, which the verification of multipart objects relies on.
+"""
+from boto3.s3.transfer import TransferConfig
+
+from batch_jobs.dcf_replication.checksums import CHECKSUM_ALGORITHM, format_checksum
+from batch_jobs.dcf_replication.part_planner import MAX_PART_SIZE, plan_part_size
+
+COPY_CONCURRENCY = 10
+
+
+def split_s3_url(url):
+    """
+    Returns:
+        tuple(str, str): bucket and key of an s3:// url
+    """
+    bucket, _, key = url.replace("s3://", "", 1).partition("/")
+    return bucket, key
+
+
+def check_replica(s3, source, size, md5, checksum=""):
+    """
+    Check that a replica has the content of a file
+
+    Args:
+        s3(S3.Client): s3 client of the bucket of the replica
+        source(str): s3 url of the replica
+        size(int): size of the file
+        md5(str): md5 of the file
+        checksum(str): checksum recorded for the replica, see
+            `checksums.format_checksum`, empty if none was recorded
+
+    Raises:
+        ValueError: if the replica can not be shown to have the content
+        ClientError: if the replica can not be read
+    """
+    bucket, key = split_s3_url(source)
+    head = s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    etag = head["ETag"].strip('"')
+    if head["ContentLength"] != int(size):
+        raise ValueError(f"{source} has size {head['ContentLength']}, not {size}")
+    if "-" not in etag:
+        if etag != md5:
+            raise ValueError(f"{source} has md5 {etag}, not {md5}")
+    elif not checksum:
+        raise ValueError(f"{source} is a multipart object without recorded checksum")
+    elif format_checksum(head) != checksum:
+        raise ValueError(f"{source} does not have its recorded checksum {checksum}")
+
+
+def copy_replica_object(
+    source_s3, s3, source, bucket, key, size, concurrency=COPY_CONCURRENCY
+):
+    """
+    Copy a replica to s3://bucket/key with an S3 server-side copy
+
+    Args:
+        source_s3(S3.Client): s3 client of the bucket of the replica
+        s3(S3.Client): s3 client of the destination bucket
+        source(str): s3 url of the replica
+        bucket(str): destination bucket
+        key(str): destination key
+        size(int): size of the file
+        concurrency(int): number of parts copied at the same time
+    """
+    source_bucket, source_key = split_s3_url(source)
+    s3.copy(
+        {"Bucket": source_bucket, "Key": source_key},
+        bucket,
+        key,
+        ExtraArgs={
+            "ACL": "bucket-owner-full-control",
+            "ChecksumAlgorithm": CHECKSUM_ALGORITHM,
+        },
+        SourceClient=source_s3,
+        Config=TransferConfig(
+            multipart_threshold=MAX_PART_SIZE,
+            multipart_chunksize=plan_part_size(int(size)),
+            max_concurrency=concurrency,
+        ),
+    )
@@ -0,0 +1,97 @@
+"""
+Routing of GDC projects to their destination buckets.
+
+The destination bucket of a file depends only on its project and on whether
+it is open or controlled. The buckets of every project are computed once
+from GDC_project_map.json and the postfix exception lists into a table
+keyed by (project_id, is_open), so that routing a manifest row is a single
+dict lookup.
+"""
+import csv
+
+OPEN_ACL = "['open']"
+
+
+def project_buckets(bucket_prefix, postfix_1_exception, postfix_2_exception):
+    """
+    Compute the open and controlled buckets of a project
+
+    By default open buckets have a -2-open postfix and controlled buckets a
+    -controlled postfix. Buckets in `postfix_1_exception` use -open and
+    -controlled, buckets in `postfix_2_exception` use -2-open and
+    -2-controlled. TARGET projects share two buckets.
+
+    Args:
+        bucket_prefix(str): aws_bucket_prefix of the project
+        postfix_1_exception(set(str)): prefixes with -open/-controlled buckets
+        postfix_2_exception(set(str)): prefixes with -2-open/-2-controlled buckets
+
+    Returns:
+        tuple(str, str): the open and controlled buckets
+    """
+    if "target" in bucket_prefix:
+        return "gdc-target-phs000218-2-open", "target-controlled"
+    if bucket_prefix in postfix_1_exception:
+        return bucket_prefix + "-open", bucket_prefix + "-controlled"
+    if bucket_prefix in postfix_2_exception:
+        return bucket_prefix + "-2-open", bucket_prefix + "-2-controlled"
+    return bucket_prefix + "-2-open", bucket_prefix + "-controlled"
+
+
+def compile_routing_table(project_acl, postfix_1_exception, postfix_2_exception):
+    """
+    Build the routing table of all the projects
+
+    Args:
+        project_acl(dict): project id -> {"aws_bucket_prefix": ...}, the
+            content of GDC_project_map.json
+        postfix_1_exception(list(str)): see `project_buckets`
+        postfix_2_exception(list(str)): see `project_buckets`
+
+    Returns:
+        dict: (project_id, is_open) -> destination bucket
+    """
+    postfix_1_exception = set(postfix_1_exception)
+    postfix_2_exception = set(postfix_2_exception)
+    routing = {}
+    for project_id, project in project_acl.items():
+        open_bucket, controlled_bucket = project_buckets(
+            project["aws_bucket_prefix"], postfix_1_exception, postfix_2_exception
+        )
+        routing[(project_id, True)] = open_bucket
+        routing[(project_id, False)] = controlled_bucket
+    return routing
+
+
+def route(routing, project_id, acl):
+    """
+    Returns:
+        str: the destination bucket, None if the project is not in the table
+    """
+    return routing.get((project_id, acl == OPEN_ACL))
+
+
+def find_unknown_projects(manifest_file, routing):
+    """
+    Check the projects of every row of a manifest against the routing table
+
+    Only the project_id column is read, so the whole manifest is checked
+    before any row is processed.
+
+    Args:
+        manifest_file(str): path to the manifest tsv
+        routing(dict): routing table, see `compile_routing_table`
+
+    Returns:
+        dict: project id -> number of rows, for the projects with no bucket
+    """
+    known = {project_id for project_id, _ in routing}
+    unknown = {}
+    with open(manifest_file, mode="r", newline="", encoding="utf-8") as csv_file:
+        reader = csv.reader(csv_file, delimiter="\t")
+        column = next(reader).index("project_id")
+        for row in reader:
+            project_id = row[column] if column < len(row) else ""
+            if project_id not in known:
+                unknown[project_id] = unknown.get(project_id, 0) + 1
+    return unknown
@@ -0,0 +1,119 @@
+"""
+Ordering and prioritization of DCF replication jobs.
+
+The wall time of a replication is set by its longest files when they start
+late: a 500 GB file submitted last keeps the run going long after every
+other copy has finished. Submitting largest files first bounds that tail
+(longest-processing-time-first scheduling), while submitting smallest files
+first completes the most files early.
+
+Manifests are streamed, so files are ordered by size class rather than
+sorted: each file is spooled to a temporary file of its class, classes being
+powers of two, and the classes are read back in order. Files of a class keep
+their manifest order, and memory use does not grow with the manifest.
+
+On job queues with a fair share scheduling policy, jobs are also given a
+`schedulingPriorityOverride` that follows the same order and a
+`shareIdentifier` derived from their project, so that one large project does
+not starve the others.
+"""
+import pickle
+import re
+import tempfile
+
+MANIFEST_ORDER = "manifest"
+LARGEST_FIRST = "largest_first"
+SMALLEST_FIRST = "smallest_first"
+SUBMISSION_ORDERS = (MANIFEST_ORDER, LARGEST_FIRST, SMALLEST_FIRST)
+# sizes up to 2**47 bytes (128 TB) have their own class
+SIZE_CLASSES = 48
+# range of schedulingPriorityOverride accepted by Batch
+MAX_PRIORITY = 9999
+MAX_SHARE_IDENTIFIER_LENGTH = 255
+
+
+def size_class(size):
+    """
+    Returns:
+        int: the size class of a file, sizes of the class n are in [2**(n-1), 2**n)
+    """
+    return min(int(size).bit_length(), SIZE_CLASSES - 1)
+
+
+def order_files(files, order=MANIFEST_ORDER):
+    """
+    Order files by size class
+
+    Args:
+        files(iterable(dict)): file info with a size
+        order(str): one of SUBMISSION_ORDERS
+
+    Yields:
+        dict: the files, in manifest order or with the largest or the smallest
+        size classes first
+    """
+    if order not in SUBMISSION_ORDERS:
+        raise ValueError(f"Unknown submission order {order}")
+    if order == MANIFEST_ORDER:
+        yield from files
+        return
+
+    spools = {}
+    try:
+        for fi in files:
+            cls = size_class(fi["size"])
+            if cls not in spools:
+                spools[cls] = tempfile.TemporaryFile()
+            pickle.dump(fi, spools[cls], pickle.HIGHEST_PROTOCOL)
+
+        for cls in sorted(spools, reverse=order == LARGEST_FIRST):
+            spool = spools[cls]
+            spool.seek(0)
+            while True:
+                try:
+                    yield pickle.load(spool)
+                except EOFError:
+                    break
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+
+def scheduling_priority(size, order=LARGEST_FIRST):
+    """
+    Priority of the job of a file on a fair share job queue, higher runs first
+
+    Args:
+        size(int): size of the file in bytes
+        order(str): SMALLEST_FIRST gives small files the highest priorities,
+            any other order gives them to large files
+
+    Returns:
+        int: a schedulingPriorityOverride between 0 and MAX_PRIORITY
+    """
+    priority = size_class(size) * MAX_PRIORITY // (SIZE_CLASSES - 1)
+    if order == SMALLEST_FIRST:
+        return MAX_PRIORITY - priority
+    return priority
+
+
+def share_identifier(project_id):
+    """
+    Returns:
+        str: the fair share identifier of a project, its id with characters
+        other than letters, digits and underscores replaced
+    """
+    return re.sub(r"[^A-Za-z0-9_]", "_", project_id)[:MAX_SHARE_IDENTIFIER_LENGTH]
+
+
+def scheduling_parameters(file, order=LARGEST_FIRST):
+    """
+    Batch submit_job arguments placing the job of a file on a fair share queue
+
+    Returns:
+        dict: schedulingPriorityOverride and shareIdentifier
+    """
+    return {
+        "schedulingPriorityOverride": scheduling_priority(file["size"], order),
+        "shareIdentifier": share_identifier(file.get("project_id") or "default"),
+    }
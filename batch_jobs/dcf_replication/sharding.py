@@ -0,0 +1,84 @@
+"""
+Sharding of a DCF replication across independent coordinators.
+
+Rows are assigned to one of N shards by a CRC32 of their file id, so every
+coordinator, e.g. each job of a Batch array, finds its own rows in the full
+manifest without any coordination. A shard writes its output manifests under
+shards/{run_id}/{shard_index}/ in the output bucket, and a final reduce step
+merges the manifests of all the shards.
+"""
+import os
+import re
+import zlib
+
+SHARDS_PREFIX = "shards"
+# output manifest keys: {kind}_{time}[_{file number}].tsv[.gz]
+MANIFEST_KEY_REGEX = re.compile(
+    r"^(?P<kind>dcf_aws_batch_[a-z]+)_(?P<time>\d+)(?:_\d{5})?\.tsv(?:\.gz)?$"
+)
+VALIDATION_KEY_REGEX = re.compile(r"^dcf_aws_batch_validation_(?P<time>\d+)\.json$")
+
+
+def shard_of(file_id, shard_count):
+    """
+    Returns:
+        int: the shard of a file, between 0 and shard_count - 1
+    """
+    return zlib.crc32(file_id.encode("utf-8")) % shard_count
+
+
+def shard_prefix(run_id, shard_index):
+    """
+    Returns:
+        str: key prefix of the output manifests of a shard
+    """
+    return f"{SHARDS_PREFIX}/{run_id}/{shard_index:05d}/"
+
+
+def default_run_id():
+    """
+    Returns:
+        str: id of the Batch array job this coordinator is part of, None
+        outside of Batch
+    """
+    job_id = os.environ.get("AWS_BATCH_JOB_ID")
+    return job_id.split(":")[0] if job_id else None
+
+
+def group_shard_keys(keys, run_id):
+    """
+    Group the keys written by the shards of a run
+
+    A shard that was run more than once, e.g. retried by Batch, wrote several
+    sets of manifests; only the latest of each kind is kept.
+
+    Args:
+        keys(iterable(str)): keys under shards/{run_id}/
+        run_id(str): run the keys belong to
+
+    Returns:
+        tuple(dict, dict): manifest kind -> keys of the manifest files in
+        shard order, and shard index -> key of its validation report
+    """
+    latest = {}
+    root = f"{SHARDS_PREFIX}/{run_id}/"
+    for key in sorted(keys):
+        shard, _, name = key[len(root) :].partition("/")
+        if not key.startswith(root) or not shard.isdigit():
+            continue
+        match = MANIFEST_KEY_REGEX.match(name) or VALIDATION_KEY_REGEX.match(name)
+        if not match:
+            continue
+        kind = match.groupdict().get("kind")
+        files = latest.setdefault((int(shard), kind), {})
+        files.setdefault(match.group("time"), []).append(key)
+
+    manifests = {}
+    reports = {}
+    for (shard, kind), files in sorted(latest.items(), key=lambda item: item[0][0]):
+        keys = files[max(files)]
+        if kind is None:
+            reports[shard] = keys[-1]
+        else:
+            manifests.setdefault(kind, []).extend(keys)
+    return manifests, reports
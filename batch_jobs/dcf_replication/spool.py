@@ -0,0 +1,130 @@
+"""
+Disk-spooled part buffers.
+
+In spool mode the parts of a multipart transfer are not held in RAM: each
+range is streamed from the GDC API into a memory-mapped temporary file on
+local storage (NVMe or instance store), hashed in place and uploaded from
+the mapping. The part buffers then use disk space rather than memory, so
+the part size and concurrency are limited by the free space of the spool
+directory instead of the memory of the container.
+
+The mapped pages are written back and dropped from the mapping every
+`flush_bytes`, both while a part is downloaded and while it is hashed, so
+that the data of the parts in flight held in memory stays under the memory
+cap. Pages read again for the upload are clean page cache the kernel can
+reclaim.
+"""
+import mmap
+import os
+import shutil
+import tempfile
+
+MB = 1024 * 1024
+# share of the free space of the spool directory used by part buffers
+DISK_FRACTION = 0.8
+# memory used by the data of the parts in flight
+SPOOL_MEMORY_CAP = 256 * MB
+
+
+def spool_budget(directory, fraction=DISK_FRACTION):
+    """
+    Returns:
+        int: bytes that part buffers may use in `directory`
+    """
+    os.makedirs(directory, exist_ok=True)
+    return int(shutil.disk_usage(directory).free * fraction)
+
+
+class SpooledPart:
+    """
+    Buffer of one part, a memory-mapped temporary file written sequentially
+
+    Args:
+        directory(str): directory of the temporary file, deleted on close
+        size(int): size of the part
+        flush_bytes(int): bytes written between two flushes of the mapping
+    """
+
+    def __init__(self, directory, size, flush_bytes):
+        with tempfile.TemporaryFile(dir=directory, prefix="gdc_part_") as f:
+            f.truncate(size)
+            self.buffer = mmap.mmap(f.fileno(), size)
+        self.size = size
+        self.flush_bytes = flush_bytes
+        self.written = 0
+        self._flushed = 0
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        """
+        Append `data` to the part
+
+        Raises:
+            ValueError: if the part would be larger than its size
+        """
+        if self.written + len(data) > self.size:
+            raise ValueError(
+                f"Part of {self.size} bytes can not hold {self.written + len(data)}"
+            )
+        self.buffer[self.written : self.written + len(data)] = data
+        self.written += len(data)
+        if self.written - self._flushed >= self.flush_bytes:
+            self._release(self._flushed, self.written)
+            self._flushed = self.written
+
+    def rewind(self):
+        """
+        Start writing the part again from its beginning
+        """
+        self.written = 0
+        self._flushed = 0
+
+    def _release(self, start, end):
+        # madvise needs a page aligned start
+        start -= start % mmap.PAGESIZE
+        self.buffer.flush(start, end - start)
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self.buffer.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def update(self, hash_object):
+        """
+        Hash the part in place, `flush_bytes` at a time
+        """
+        view = memoryview(self.buffer)
+        try:
+            for start in range(0, self.size, self.flush_bytes):
+                end = min(start + self.flush_bytes, self.size)
+                hash_object.update(view[start:end])
+                self._release(start, end)
+        finally:
+            view.release()
+
+    def close(self):
+        self.buffer.close()
+
+
+class PartSpool:
+    """
+    Allocator of the part buffers of a transfer
+
+    Args:
+        directory(str): spool directory, e.g. on an instance store volume
+        concurrency(int): number of parts in flight
+        memory_cap(int): memory used by the data of the parts in flight
+    """
+
+    def __init__(self, directory, concurrency, memory_cap=SPOOL_MEMORY_CAP):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # the parts in flight and the part being hashed share the cap
+        flush_bytes = max(MB, memory_cap // (concurrency + 1))
+        self.flush_bytes = flush_bytes - flush_bytes % MB
+
+    def part(self, size):
+        """
+        Returns:
+            SpooledPart: an empty buffer of `size` bytes
+        """
+        return SpooledPart(self.directory, size, self.flush_bytes)
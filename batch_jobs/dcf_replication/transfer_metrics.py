@@ -0,0 +1,251 @@
+"""
+Per-part timings of GDC transfers.
+
+Each part of a transfer is timed in its three stages, download from the GDC
+API, md5 hashing and upload to S3, and its retries are counted. Timings and
+byte rates are aggregated into histograms with power of two buckets, so that
+a summary has the same small size whatever the number of parts.
+
+At the end of a transfer a single JSON summary is printed on a line starting
+with METRICS_PREFIX, and written to s3://.../{file_id}.json if a location is
+given. Summaries of many files are combined with `merge_summaries` into a
+run-level report.
+"""
+import json
+import threading
+import time
+
+METRICS_PREFIX = "TRANSFER_METRICS "
+STAGES = ("download", "hash", "upload")
+# upper bounds of the buckets: 1 ms to about 17 minutes, and 1/8 MB/s to
+# 8 GB/s
+SECONDS_BUCKETS = tuple(0.001 * 2**i for i in range(21))
+RATE_BUCKETS = tuple(0.125 * 2**i for i in range(17))
+MB = 1024 * 1024
+
+
+class Histogram:
+    """
+    Count of values per bucket, with their sum, minimum and maximum
+
+    Args:
+        bounds(tuple(float)): increasing upper bounds of the buckets, values
+            above the last one are counted in an overflow bucket
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        index = next(
+            (i for i, bound in enumerate(self.bounds) if value <= bound),
+            len(self.bounds),
+        )
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """
+        Returns:
+            float: upper bound of the bucket of the q-th percentile, the
+            maximum for the overflow bucket, None if the histogram is empty
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": self.counts,
+        }
+
+    @classmethod
+    def from_dict(cls, bounds, data):
+        histogram = cls(bounds)
+        histogram.counts = list(data["buckets"])
+        histogram.count = data["count"]
+        histogram.total = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+def _histograms():
+    histograms = {f"{stage}_seconds": Histogram(SECONDS_BUCKETS) for stage in STAGES}
+    histograms["download_mb_per_second"] = Histogram(RATE_BUCKETS)
+    histograms["upload_mb_per_second"] = Histogram(RATE_BUCKETS)
+    return histograms
+
+
+def _bounds(name):
+    return SECONDS_BUCKETS if name.endswith("_seconds") else RATE_BUCKETS
+
+
+class TransferMetrics:
+    """
+    Timings of the parts of the transfer of one file, parts can be recorded
+    from several threads
+
+    Args:
+        file_id(str): GDC file uuid
+        file_size(int): size of the file in bytes
+    """
+
+    def __init__(self, file_id, file_size):
+        self.file_id = file_id
+        self.file_size = file_size
+        self.started = time.monotonic()
+        self.parts = 0
+        self.bytes = 0
+        self.retries = {"download": 0, "upload": 0}
+        self.histograms = _histograms()
+        self._lock = threading.Lock()
+
+    def record_part(self, size, seconds, retries=None):
+        """
+        Args:
+            size(int): bytes of the part
+            seconds(dict): stage -> seconds spent on the part, see STAGES
+            retries(dict): "download"/"upload" -> number of retries
+        """
+        with self._lock:
+            self.parts += 1
+            self.bytes += size
+            for stage, value in seconds.items():
+                self.histograms[f"{stage}_seconds"].add(value)
+                rate = f"{stage}_mb_per_second"
+                if rate in self.histograms and value > 0:
+                    self.histograms[rate].add(size / MB / value)
+            for stage, count in (retries or {}).items():
+                self.retries[stage] += count
+
+    def summary(self, status):
+        """
+        Returns:
+            dict: JSON serializable summary of the transfer
+        """
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            return {
+                "file_id": self.file_id,
+                "file_size": self.file_size,
+                "status": status,
+                "parts": self.parts,
+                "bytes": self.bytes,
+                "elapsed_seconds": elapsed,
+                "mb_per_second": self.bytes / MB / elapsed if elapsed > 0 else None,
+                "retries": dict(self.retries),
+                "histograms": {
+                    name: histogram.to_dict()
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def emit(self, status, s3=None, location=None):
+        """
+        Print the summary on stdout and write it to `location`/{file_id}.json
+
+        Args:
+            status(str): outcome of the transfer, e.g. SUCCEEDED or FAILED
+            s3(S3.Client): s3 client, needed if location is set
+            location(str): s3://bucket/prefix of the summaries, None to only print
+
+        Returns:
+            dict: the summary
+        """
+        summary = self.summary(status)
+        body = json.dumps(summary)
+        print(METRICS_PREFIX + body)
+        if location:
+            bucket, _, prefix = location.replace("s3://", "", 1).partition("/")
+            key = f"{prefix.rstrip('/')}/{self.file_id}.json".lstrip("/")
+            try:
+                s3.put_object(
+                    Bucket=bucket, Key=key, Body=body, ContentType="application/json"
+                )
+            except Exception as e:
+                print(f"Can not write transfer metrics to {location}: {e}")
+        return summary
+
+
+def merge_summaries(summaries):
+    """
+    Combine the summaries of many transfers into a run-level report
+
+    Args:
+        summaries(iterable(dict)): summaries written by `TransferMetrics.emit`
+
+    Returns:
+        dict: number of files per status, totals, aggregated histograms and
+        the share of the part time spent in each stage
+    """
+    report = {
+        "files": 0,
+        "statuses": {},
+        "parts": 0,
+        "bytes": 0,
+        "transfer_seconds": 0.0,
+        "retries": {"download": 0, "upload": 0},
+    }
+    histograms = _histograms()
+    file_rates = Histogram(RATE_BUCKETS)
+    for summary in summaries:
+        report["files"] += 1
+        status = summary["status"]
+        report["statuses"][status] = report["statuses"].get(status, 0) + 1
+        report["parts"] += summary["parts"]
+        report["bytes"] += summary["bytes"]
+        report["transfer_seconds"] += summary["elapsed_seconds"]
+        for stage, count in summary["retries"].items():
+            report["retries"][stage] = report["retries"].get(stage, 0) + count
+        for name, data in summary["histograms"].items():
+            histograms[name].merge(Histogram.from_dict(_bounds(name), data))
+        if summary.get("mb_per_second"):
+            file_rates.add(summary["mb_per_second"])
+
+    stage_seconds = {stage: histograms[f"{stage}_seconds"].total for stage in STAGES}
+    total_seconds = sum(stage_seconds.values())
+    report["stage_share"] = {
+        stage: seconds / total_seconds if total_seconds else None
+        for stage, seconds in stage_seconds.items()
+    }
+    report["bottleneck"] = (
+        max(stage_seconds, key=stage_seconds.get) if total_seconds else None
+    )
+    report["file_mb_per_second"] = file_rates.to_dict()
+    report["histograms"] = {
+        name: histogram.to_dict() for name, histogram in histograms.items()
+    }
+    return report
@@ -0,0 +1,352 @@
+"""
+Upload state for resumable multipart uploads.
+
+A checkpoint is written after every uploaded part so that a rerun of
+`file_get_upload.py` (a retry in `gdc_copy_job.sh` or a restarted container)
+can pick up the in-progress multipart upload instead of starting from byte
+zero. The checkpoint holds the parts uploaded so far and, when OpenSSL is
+available, the raw MD5 context so the whole-file hash does not need to be
+recomputed from the beginning.
+"""
+
+import base64
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from batch_jobs.dcf_replication.checksums import CHECKSUM_KEYS
+
+UPLOAD_STATE_LOCATION = os.environ.get("UPLOAD_STATE_LOCATION", "/tmp/gdc_upload_state")
+
+
+class _MD5_CTX(ctypes.Structure):
+    # Layout of MD5_CTX from openssl/md5.h
+    _fields_ = [
+        ("A", ctypes.c_uint),
+        ("B", ctypes.c_uint),
+        ("C", ctypes.c_uint),
+        ("D", ctypes.c_uint),
+        ("Nl", ctypes.c_uint),
+        ("Nh", ctypes.c_uint),
+        ("data", ctypes.c_uint * 16),
+        ("num", ctypes.c_uint),
+    ]
+
+
+def _load_libcrypto():
+    try:
+        lib = ctypes.CDLL(ctypes.util.find_library("crypto"))
+        for name in ("MD5_Init", "MD5_Update", "MD5_Final"):
+            getattr(lib, name)
+    except (OSError, AttributeError, TypeError):
+        return None
+    lib.MD5_Init.argtypes = [ctypes.POINTER(_MD5_CTX)]
+    lib.MD5_Update.argtypes = [
+        ctypes.POINTER(_MD5_CTX),
+        ctypes.c_void_p,
+        ctypes.c_size_t,
+    ]
+    lib.MD5_Final.argtypes = [ctypes.c_void_p, ctypes.POINTER(_MD5_CTX)]
+    return lib
+
+
+_LIBCRYPTO = _load_libcrypto()
+
+
+class ResumableMD5:
+    """
+    MD5 whose intermediate state can be exported and restored.
+
+    hashlib does not expose its internal state, so this wraps the OpenSSL
+    MD5_* functions directly and serializes the MD5_CTX struct.
+    """
+
+    def __init__(self, state=None):
+        self._ctx = _MD5_CTX()
+        if state:
+            ctypes.memmove(
+                ctypes.byref(self._ctx),
+                base64.b64decode(state),
+                ctypes.sizeof(_MD5_CTX),
+            )
+        else:
+            _LIBCRYPTO.MD5_Init(ctypes.byref(self._ctx))
+
+    def update(self, data):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        _LIBCRYPTO.MD5_Update(ctypes.byref(self._ctx), data, len(data))
+
+    def hexdigest(self):
+        ctx = _MD5_CTX.from_buffer_copy(self._ctx)
+        digest = (ctypes.c_ubyte * 16)()
+        _LIBCRYPTO.MD5_Final(digest, ctypes.byref(ctx))
+        return bytes(digest).hex()
+
+    def get_state(self):
+        return base64.b64encode(bytes(self._ctx)).decode("ascii")
+
+
+def new_md5(state=None):
+    """
+    Create an MD5 hasher, restoring `state` if possible
+
+    Args:
+        state(str): state returned by ResumableMD5.get_state
+
+    Returns:
+        object: ResumableMD5 when OpenSSL is available, hashlib.md5 otherwise
+    """
+    if _LIBCRYPTO is None:
+        return hashlib.md5()
+    return ResumableMD5(state)
+
+
+def get_md5_state(md5_hash):
+    """
+    Return the exportable state of `md5_hash` or None if it cannot be exported
+    """
+    if isinstance(md5_hash, ResumableMD5):
+        return md5_hash.get_state()
+    return None
+
+
+def _checkpoint_name(bucket, key):
+    return hashlib.sha1(f"{bucket}/{key}".encode("utf-8")).hexdigest() + ".json"
+
+
+def _split_s3_url(url):
+    bucket, _, prefix = url.replace("s3://", "", 1).partition("/")
+    return bucket, prefix.strip("/")
+
+
+def load_checkpoint(s3, location, bucket, key):
+    """
+    Load the upload checkpoint for s3://bucket/key
+
+    Args:
+        s3(S3.Client): s3 client, used when location is an s3 url
+        location(str): local directory or s3://bucket/prefix holding checkpoints
+        bucket(str): destination bucket
+        key(str): destination key
+
+    Returns:
+        dict: the checkpoint, or None if there is none
+    """
+    if not location:
+        return None
+    name = _checkpoint_name(bucket, key)
+    try:
+        if location.startswith("s3://"):
+            state_bucket, prefix = _split_s3_url(location)
+            res = s3.get_object(Bucket=state_bucket, Key=f"{prefix}/{name}".lstrip("/"))
+            return json.loads(res["Body"].read())
+        with open(os.path.join(location, name), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            print(f"Can not read upload checkpoint for {key}. Detail {e}")
+        return None
+    except BotoCoreError as e:
+        print(f"Can not read upload checkpoint for {key}. Detail {e}")
+        return None
+    except ValueError as e:
+        print(f"Ignoring corrupt upload checkpoint for {key}. Detail {e}")
+        return None
+
+
+def save_checkpoint(s3, location, bucket, key, checkpoint):
+    """
+    Persist the upload checkpoint for s3://bucket/key
+
+    A checkpoint only lets a rerun resume, so a checkpoint that can not be
+    written is reported and the upload goes on.
+
+    Returns:
+        bool: True if the checkpoint was written
+    """
+    if not location:
+        return False
+    name = _checkpoint_name(bucket, key)
+    body = json.dumps(checkpoint)
+    try:
+        if location.startswith("s3://"):
+            state_bucket, prefix = _split_s3_url(location)
+            s3.put_object(
+                Bucket=state_bucket, Key=f"{prefix}/{name}".lstrip("/"), Body=body
+            )
+            return True
+        os.makedirs(location, exist_ok=True)
+        path = os.path.join(location, name)
+        # write then rename so that a crash never leaves a truncated checkpoint
+        with open(path + ".tmp", "w") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+    except (ClientError, BotoCoreError, OSError) as e:
+        print(f"Can not write upload checkpoint for {key}. Detail {e}")
+        return False
+    return True
+
+
+def delete_checkpoint(s3, location, bucket, key):
+    """
+    Remove the upload checkpoint for s3://bucket/key if there is one
+    """
+    if not location:
+        return
+    name = _checkpoint_name(bucket, key)
+    try:
+        if location.startswith("s3://"):
+            state_bucket, prefix = _split_s3_url(location)
+            s3.delete_object(Bucket=state_bucket, Key=f"{prefix}/{name}".lstrip("/"))
+        else:
+            os.remove(os.path.join(location, name))
+    except (FileNotFoundError, ClientError, BotoCoreError):
+        pass
+
+
+def find_in_progress_upload(s3, bucket, key):
+    """
+    Find the most recent in-progress multipart upload for s3://bucket/key
+
+    Returns:
+        str: upload id, or None if there is no in-progress upload
+    """
+    uploads = []
+    paginator = s3.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=bucket, Prefix=key):
+        uploads.extend(u for u in page.get("Uploads", []) if u["Key"] == key)
+    if not uploads:
+        return None
+    return max(uploads, key=lambda u: u["Initiated"])["UploadId"]
+
+
+def delete_part_digests(s3, digest_location):
+    """
+    Delete the part digest records of a split upload, written under
+    s3://bucket/prefix/ by `file_get_upload.upload_part_range`
+    """
+    bucket, prefix = _split_s3_url(digest_location)
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix + "/"):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": objects})
+
+
+def upload_checksum_algorithm(s3, bucket, key, upload_id):
+    """
+    Returns:
+        str: checksum algorithm the multipart upload was created with, None
+        if it has none or can not be found
+    """
+    paginator = s3.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=bucket, Prefix=key):
+        for upload in page.get("Uploads", []):
+            if upload["UploadId"] == upload_id:
+                return upload.get("ChecksumAlgorithm")
+    return None
+
+
+def list_uploaded_parts(s3, bucket, key, upload_id):
+    """
+    List the parts already uploaded to a multipart upload
+
+    Returns:
+        list(dict): parts sorted by part number, in the form
+        {"PartNumber": 1, "ETag": "...", "Size": 100}, with the checksum of
+        the part if the upload has a checksum algorithm
+    """
+    parts = []
+    paginator = s3.get_paginator("list_parts")
+    for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            entry = {
+                "PartNumber": part["PartNumber"],
+                "ETag": part["ETag"],
+                "Size": part["Size"],
+            }
+            for name in CHECKSUM_KEYS:
+                if part.get(name):
+                    entry[name] = part[name]
+            parts.append(entry)
+    return sorted(parts, key=lambda p: p["PartNumber"])
+
+
+def completed_parts(parts):
+    """
+    Returns:
+        list(dict): the parts in the form complete_multipart_upload expects
+    """
+    return [
+        {name: value for name, value in part.items() if name != "Size"}
+        for part in parts
+    ]
+
+
+def contiguous_parts(parts, file_size):
+    """
+    Keep the parts 1..k that form a contiguous prefix of the file
+
+    Parts after a gap are uploaded again, since the byte offsets of parts
+    following a missing part can not be known.
+    """
+    prefix = []
+    offset = 0
+    for expected_number, part in enumerate(parts, start=1):
+        if part["PartNumber"] != expected_number or offset + part["Size"] > file_size:
+            break
+        prefix.append(part)
+        offset += part["Size"]
+    return prefix
+
+
+def resume_upload(s3, location, bucket, key, file_size, state_s3=None):
+    """
+    Look for an upload of s3://bucket/key that can be resumed
+
+    Args:
+        s3(S3.Client): s3 client of the destination bucket
+        location(str): checkpoint location
+        bucket(str): destination bucket
+        key(str): destination key
+        file_size(int): expected size of the object
+        state_s3(S3.Client): s3 client of the checkpoint bucket, defaults to s3
+
+    Returns:
+        tuple(str, list(dict), str, int): upload id, uploaded parts, saved md5
+        state and the number of parts covered by that md5 state. Returns
+        (None, [], None, 0) when there is nothing to resume.
+    """
+    try:
+        upload_id = find_in_progress_upload(s3, bucket, key)
+    except ClientError as e:
+        print(f"Can not list multipart uploads for {key}. Detail {e}")
+        return None, [], None, 0
+    if not upload_id:
+        return None, [], None, 0
+
+    parts = contiguous_parts(list_uploaded_parts(s3, bucket, key, upload_id), file_size)
+    md5_state = None
+    md5_parts = 0
+    checkpoint = load_checkpoint(state_s3 or s3, location, bucket, key)
+    if (
+        checkpoint
+        and checkpoint.get("upload_id") == upload_id
+        and checkpoint.get("md5_state")
+    ):
+        md5_parts = checkpoint.get("md5_parts", 0)
+        saved_etags = [p["ETag"] for p in checkpoint.get("parts", [])[:md5_parts]]
+        if md5_parts <= len(parts) and saved_etags == [
+            p["ETag"] for p in parts[:md5_parts]
+        ]:
+            md5_state = checkpoint["md5_state"]
+        else:
+            md5_parts = 0
+    return upload_id, parts, md5_state, md5_parts
@@ -0,0 +1,326 @@
+"""
+Bulk verification of the objects of a finished replication.
+
+The objects listed in an output manifest, of a DCF replication (urls column)
+or a bucket manifest (url column), are checked without a request per object
+where possible:
+
+- size and ETag come from listings of the destination buckets, see
+  `DestinationIndex`; objects of buckets that can not be listed are checked
+  with a HEAD request
+- an object uploaded in a single part has the md5 of its content as ETag,
+  which is compared with the md5 of the manifest
+- a multipart object whose manifest row has the checksum S3 stored for it at
+  copy time, see `track_jobs`, is checked against the checksum S3 returns now
+- the remaining multipart objects are downloaded and hashed, concurrently
+  and up to a byte budget; objects over the budget are left UNVERIFIED
+
+Objects are verified VERIFY_BATCH_SIZE at a time, so that neither the
+objects of a release nor their pending checks are held in memory at once,
+and an object that can not be read is recorded as UNREADABLE rather than
+stopping the verification.
+
+The result is a count and a byte total per status, and the discrepancies.
+"""
+import hashlib
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from batch_jobs.dcf_replication.checksums import object_checksum
+from batch_jobs.dcf_replication.content_index import S3_URL_REGEX
+
+HEAD_THREADS = 16
+HASH_THREADS = 8
+HASH_READ_SIZE = 8 * 1024 * 1024
+VERIFY_BATCH_SIZE = 10000
+MAX_REPORTED_DISCREPANCIES = 100
+
+# statuses of verified objects, by how they were verified
+VERIFIED_ETAG = "VERIFIED_ETAG"
+VERIFIED_CHECKSUM = "VERIFIED_CHECKSUM"
+VERIFIED_HASH = "VERIFIED_HASH"
+VERIFIED_STATUSES = (VERIFIED_ETAG, VERIFIED_CHECKSUM, VERIFIED_HASH)
+# discrepancies
+MISSING = "MISSING"
+SIZE_MISMATCH = "SIZE_MISMATCH"
+MD5_MISMATCH = "MD5_MISMATCH"
+CHECKSUM_MISMATCH = "CHECKSUM_MISMATCH"
+UNREADABLE = "UNREADABLE"
+# multipart objects without checksum left out of the hashing budget, or
+# without md5 in the manifest
+UNVERIFIED = "UNVERIFIED"
+
+DISCREPANCY_FIELDS = [
+    "url",
+    "guid",
+    "status",
+    "expected_size",
+    "size",
+    "expected_md5",
+    "detail",
+]
+
+
+def manifest_objects(reader):
+    """
+    Objects to verify from the rows of an output manifest
+
+    Args:
+        reader(csv.DictReader): rows with size, md5 and urls or url columns
+
+    Yields:
+        dict: url, bucket, key, guid, size, md5 and checksum of each S3 url
+    """
+    for row in reader:
+        size = row.get("size") or ""
+        for url in S3_URL_REGEX.findall(row.get("urls") or row.get("url") or ""):
+            bucket, _, key = url.replace("s3://", "", 1).partition("/")
+            yield {
+                "url": url,
+                "bucket": bucket,
+                "key": key,
+                "guid": row.get("guid", ""),
+                "size": int(size) if size.isdigit() else None,
+                "md5": (row.get("md5") or "").lower(),
+                "checksum": row.get("checksum") or "",
+            }
+
+
+class VerificationReport:
+    """
+    Number of objects and bytes by status, and the first
+    MAX_REPORTED_DISCREPANCIES discrepancies
+    """
+
+    def __init__(self):
+        self.objects = 0
+        self.statuses = Counter()
+        self.bytes = Counter()
+        self.hashed_bytes = 0
+        self.discrepancies = []
+        self.seconds = 0.0
+
+    @property
+    def failed(self):
+        return sum(
+            count
+            for status, count in self.statuses.items()
+            if status not in VERIFIED_STATUSES
+        )
+
+    def add(self, obj, status, size=None, detail=""):
+        """
+        Record the status of an object
+
+        Returns:
+            dict: the discrepancy row of the object, None if it was verified
+        """
+        self.objects += 1
+        self.statuses[status] += 1
+        self.bytes[status] += obj["size"] or 0
+        if status in VERIFIED_STATUSES:
+            return None
+        row = {
+            "url": obj["url"],
+            "guid": obj["guid"],
+            "status": status,
+            "expected_size": obj["size"],
+            "size": size,
+            "expected_md5": obj["md5"],
+            "detail": detail,
+        }
+        if len(self.discrepancies) < MAX_REPORTED_DISCREPANCIES:
+            self.discrepancies.append(row)
+        return row
+
+    def to_dict(self):
+        return {
+            "objects": self.objects,
+            "verified": self.objects - self.failed,
+            "failed": self.failed,
+            "statuses": dict(self.statuses),
+            "bytes": dict(self.bytes),
+            "hashed_bytes": self.hashed_bytes,
+            "seconds": round(self.seconds, 3),
+            "discrepancies": self.discrepancies,
+        }
+
+
+def check_listing(obj, found):
+    """
+    Check an object against its size and ETag
+
+    Args:
+        obj(dict): see `manifest_objects`
+        found(tuple(int, str)): size and ETag of the object, None if it does
+            not exist
+
+    Returns:
+        tuple(str, str): status and detail, status None if the object is a
+        multipart upload whose content has to be checked otherwise
+    """
+    if found is None:
+        return MISSING, "Object does not exist"
+    size, etag = found
+    if obj["size"] is not None and size != obj["size"]:
+        return SIZE_MISMATCH, f"{size} bytes instead of {obj['size']}"
+    etag = (etag or "").strip('"')
+    if "-" in etag or not obj["md5"]:
+        return None, ""
+    if etag == obj["md5"]:
+        return VERIFIED_ETAG, ""
+    return MD5_MISMATCH, f"ETag {etag}"
+
+
+def head_listing(s3, bucket, key):
+    """
+    Returns:
+        tuple(int, str): size and ETag of the object, None if it does not
+        exist, or the error if it can not be read
+    """
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        return str(e)
+    except BotoCoreError as e:
+        return str(e)
+    return response["ContentLength"], response.get("ETag")
+
+
+def check_checksum(s3, obj):
+    """
+    Compare the checksum S3 stores for an object with the one of its manifest row
+
+    Returns:
+        tuple(str, str): status and detail
+    """
+    checksum = object_checksum(s3, obj["bucket"], obj["key"])
+    if not checksum:
+        return UNREADABLE, "Can not read the checksum of the object"
+    if checksum != obj["checksum"]:
+        return CHECKSUM_MISMATCH, checksum
+    return VERIFIED_CHECKSUM, ""
+
+
+def hash_object(s3, obj):
+    """
+    Download an object and compare the md5 of its content with the manifest
+
+    Returns:
+        tuple(str, str): status and detail
+    """
+    md5 = hashlib.md5()
+    try:
+        body = s3.get_object(Bucket=obj["bucket"], Key=obj["key"])["Body"]
+        for data in body.iter_chunks(chunk_size=HASH_READ_SIZE):
+            md5.update(data)
+    except (ClientError, BotoCoreError) as e:
+        # e.g. a read timeout or a connection reset while streaming
+        return UNREADABLE, str(e)
+    if md5.hexdigest() != obj["md5"]:
+        return MD5_MISMATCH, f"Content md5 {md5.hexdigest()}"
+    return VERIFIED_HASH, ""
+
+
+def verify_objects(
+    objects,
+    index,
+    clients,
+    on_discrepancy=None,
+    hash_threads=HASH_THREADS,
+    max_hash_bytes=None,
+    batch_size=VERIFY_BATCH_SIZE,
+):
+    """
+    Verify the objects of a manifest
+
+    Args:
+        objects(iterable(dict)): see `manifest_objects`, consumed
+            `batch_size` at a time
+        index(DestinationIndex): index built for the objects, objects of
+            buckets that are not in `index.indexed_buckets` are checked with
+            a HEAD request
+        clients(callable): bucket -> s3 client of the bucket
+        on_discrepancy(callable): called with the discrepancy row of every
+            object that could not be verified
+        hash_threads(int): number of objects hashed at the same time
+        max_hash_bytes(int): maximum number of bytes downloaded for hashing,
+            None for no limit
+        batch_size(int): number of objects checked at a time
+
+    Returns:
+        VerificationReport: the report
+    """
+    start = time.perf_counter()
+    report = VerificationReport()
+
+    def add(obj, status, size=None, detail=""):
+        row = report.add(obj, status, size, detail)
+        if row is not None and on_discrepancy:
+            on_discrepancy(row)
+
+    def verify_batch(batch, head_executor, hash_executor):
+        unlisted = [obj for obj in batch if obj["bucket"] not in index.indexed_buckets]
+        heads = head_executor.map(
+            lambda obj: head_listing(clients(obj["bucket"]), obj["bucket"], obj["key"]),
+            unlisted,
+        )
+        found = {
+            (obj["bucket"], obj["key"]): listing
+            for obj, listing in zip(unlisted, heads)
+        }
+
+        with_checksum = []
+        hashed = []
+        for obj in batch:
+            listing = found.get((obj["bucket"], obj["key"]))
+            if obj["bucket"] in index.indexed_buckets:
+                listing = index.lookup(obj["bucket"], obj["key"])
+            if isinstance(listing, str):
+                add(obj, UNREADABLE, None, listing)
+                continue
+            status, detail = check_listing(obj, listing)
+            if status is not None:
+                add(obj, status, listing[0] if listing else None, detail)
+            elif obj["checksum"]:
+                with_checksum.append(obj)
+            elif not obj["md5"]:
+                add(obj, UNVERIFIED, listing[0], "No md5 in the manifest")
+            elif (
+                max_hash_bytes is not None
+                and report.hashed_bytes + listing[0] > max_hash_bytes
+            ):
+                add(obj, UNVERIFIED, listing[0], "Over the hashing budget")
+            else:
+                report.hashed_bytes += listing[0]
+                hashed.append(obj)
+
+        checks = [
+            (obj, head_executor.submit(check_checksum, clients(obj["bucket"]), obj))
+            for obj in with_checksum
+        ] + [
+            (obj, hash_executor.submit(hash_object, clients(obj["bucket"]), obj))
+            for obj in hashed
+        ]
+        for obj, future in checks:
+            status, detail = future.result()
+            add(obj, status, obj["size"], detail)
+
+    objects = iter(objects)
+    with ThreadPoolExecutor(HEAD_THREADS) as head_executor, ThreadPoolExecutor(
+        hash_threads
+    ) as hash_executor:
+        while True:
+            batch = list(islice(objects, batch_size))
+            if not batch:
+                break
+            verify_batch(batch, head_executor, hash_executor)
+
+    report.seconds = time.perf_counter() - start
+    return report
@@ -0,0 +1,152 @@
+"""
+Per-process cache of boto3 clients.
+
+Building a boto3 client costs tens of milliseconds and several MB, and a new
+client does not reuse the connections of the previous one. Coordinators ask
+this module for their clients instead of calling boto3.client for every item.
+Clients are keyed by process id, so workers forked by a multiprocessing
+Pool build their own instead of sharing the parent's connection pools.
+
+S3 clients of a bucket are pinned to the region of the bucket, which is
+looked up once per run, so that requests to buckets of other regions are not
+redirected.
+"""
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+MAX_POOL_CONNECTIONS = int(os.environ.get("MAX_POOL_CONNECTIONS", 50))
+# LocationConstraint of the buckets of legacy regions
+LEGACY_LOCATIONS = {None: "us-east-1", "": "us-east-1", "EU": "eu-west-1"}
+
+_CLIENTS = {}
+_BUCKET_REGIONS = {}
+_LOCK = threading.Lock()
+
+
+def get_client(
+    service_name,
+    region_name=None,
+    profile_name=None,
+    aws_access_key_id=None,
+    aws_secret_access_key=None,
+    aws_session_token=None,
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+):
+    """
+    Return a cached client, creating it on first use
+
+    Args:
+        service_name(str): aws service, e.g. "s3" or "batch"
+        region_name(str): aws region
+        profile_name(str): profile of the session the client is created from
+        aws_access_key_id(str): explicit credentials
+        aws_secret_access_key(str): explicit credentials
+        aws_session_token(str): explicit credentials
+        max_pool_connections(int): size of the client's connection pool
+
+    Returns:
+        botocore.client.BaseClient: the client
+    """
+    key = (
+        os.getpid(),
+        service_name,
+        region_name,
+        profile_name,
+        aws_access_key_id,
+        aws_secret_access_key,
+        aws_session_token,
+        max_pool_connections,
+    )
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            kwargs = {
+                "region_name": region_name,
+                "aws_access_key_id": aws_access_key_id,
+                "aws_secret_access_key": aws_secret_access_key,
+                "aws_session_token": aws_session_token,
+                "config": Config(max_pool_connections=max_pool_connections),
+            }
+            if profile_name:
+                session = boto3.Session(profile_name=profile_name)
+                client = session.client(service_name, **kwargs)
+            else:
+                client = boto3.client(service_name, **kwargs)
+            _CLIENTS[key] = client
+    return client
+
+
+def bucket_region(bucket, **kwargs):
+    """
+    Region of a bucket, from the x-amz-bucket-region header of a head_bucket
+    or else from get_bucket_location. Regions are cached for the run, and
+    inherited by forked workers.
+
+    Args:
+        bucket(str): bucket name
+        kwargs: get_client arguments of the client used for the lookup
+
+    Returns:
+        str: the region, None if it can not be determined
+    """
+    region = _BUCKET_REGIONS.get(bucket)
+    if region:
+        return region
+    s3 = get_client("s3", **kwargs)
+    try:
+        response = s3.head_bucket(Bucket=bucket)
+    except ClientError as e:
+        # redirects and access denied errors have the header too
+        response = e.response
+    headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    region = headers.get("x-amz-bucket-region")
+    if not region:
+        try:
+            location = s3.get_bucket_location(Bucket=bucket)["LocationConstraint"]
+        except ClientError:
+            return None
+        region = LEGACY_LOCATIONS.get(location, location)
+    _BUCKET_REGIONS[bucket] = region
+    return region
+
+
+def get_bucket_client(bucket, **kwargs):
+    """
+    Return a cached s3 client in the region of `bucket`
+
+    Args:
+        bucket(str): bucket name
+        kwargs: get_client arguments other than service_name and region_name.
+            The client of the default region is returned if the region of the
+            bucket is unknown.
+
+    Returns:
+        botocore.client.BaseClient: the client
+    """
+    lookup = {k: v for k, v in kwargs.items() if k != "max_pool_connections"}
+    return get_client("s3", region_name=bucket_region(bucket, **lookup), **kwargs)
+
+
+def init_clients(client_specs):
+    """
+    Pool initializer creating the clients a worker will use
+
+    Args:
+        client_specs(list(dict)): keyword arguments for get_client
+    """
+    for spec in client_specs:
+        get_client(**spec)
+
+
+def clear_client_cache():
+    with _LOCK:
+        _CLIENTS.clear()
+        _BUCKET_REGIONS.clear()
@@ -0,0 +1,97 @@
+"""
+Polling of submitted AWS Batch jobs until they finish.
+
+Jobs are described 100 at a time, the most describe_jobs accepts, and only
+the jobs that have not finished yet are described again. The interval
+between polls adapts to the progress of the run: it starts at
+`poll_interval_min`, doubles after every poll in which no job finished, up
+to `poll_interval_max`, and drops back to the minimum as soon as jobs finish.
+"""
+import logging
+import time
+
+from botocore.exceptions import ClientError
+
+DESCRIBE_JOBS_BATCH_SIZE = 100
+POLL_INTERVAL_MIN = 30
+POLL_INTERVAL_MAX = 600
+FINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+
+def describe_jobs(batch, job_ids):
+    """
+    Describe jobs in batches of DESCRIBE_JOBS_BATCH_SIZE
+
+    A batch that can not be described (throttling, transient errors) is left
+    out of the result and picked up by the next poll.
+
+    Returns:
+        dict: job id -> job description, None for the jobs Batch does not know
+    """
+    jobs = {}
+    for i in range(0, len(job_ids), DESCRIBE_JOBS_BATCH_SIZE):
+        chunk = job_ids[i : i + DESCRIBE_JOBS_BATCH_SIZE]
+        try:
+            response = batch.describe_jobs(jobs=chunk)
+        except ClientError as e:
+            logging.warning(f"Can not describe {len(chunk)} jobs. Detail {e}")
+            continue
+        described = {job["jobId"]: job for job in response["jobs"]}
+        for job_id in chunk:
+            jobs[job_id] = described.get(job_id)
+    return jobs
+
+
+def poll_jobs(
+    batch,
+    job_ids,
+    poll_interval_min=POLL_INTERVAL_MIN,
+    poll_interval_max=POLL_INTERVAL_MAX,
+):
+    """
+    Wait for Batch jobs to finish
+
+    Args:
+        batch(Batch.Client): batch client
+        job_ids(list(str)): ids of the jobs to wait for
+        poll_interval_min(int): seconds between polls while jobs are finishing
+        poll_interval_max(int): longest wait between two polls
+
+    Yields:
+        list(dict): descriptions of the jobs that finished since the previous
+        poll, with status SUCCEEDED or FAILED. Jobs that Batch no longer
+        knows are reported as FAILED.
+    """
+    pending = list(dict.fromkeys(job_ids))
+    interval = poll_interval_min
+    while pending:
+        jobs = describe_jobs(batch, pending)
+        finished = []
+        still_pending = []
+        for job_id in pending:
+            if job_id not in jobs:
+                still_pending.append(job_id)
+            elif jobs[job_id] is None:
+                finished.append(
+                    {
+                        "jobId": job_id,
+                        "status": "FAILED",
+                        "statusReason": "Job not found",
+                    }
+                )
+            elif jobs[job_id]["status"] in FINAL_STATUSES:
+                finished.append(jobs[job_id])
+            else:
+                still_pending.append(job_id)
+        pending = still_pending
+
+        if finished:
+            interval = poll_interval_min
+            yield finished
+        else:
+            interval = min(interval * 2, poll_interval_max)
+        if pending:
+            logging.info(
+                f"{len(pending)} jobs still running, next poll in {interval} seconds"
+            )
+            time.sleep(interval)
@@ -1,8 +1,9 @@
 import csv
 import logging
-import boto3
 from botocore.exceptions import ClientError
 
+from batch_jobs.utils.clients import get_bucket_client
+
 
 def write_tsv(filename, files, fieldnames=None):
     """
@@ -68,15 +69,14 @@ def upload_file(
     if object_name is None:
         object_name = file_name
 
-    # Upload the file
+    # Upload the file, with a client in the region of the bucket
+    credentials = {}
     if aws_access_key_id and aws_secret_access_key:
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-        )
-    else:
-        s3_client = boto3.client("s3")
+        credentials = {
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+        }
+    s3_client = get_bucket_client(bucket, **credentials)
 
     try:
         msg = f"upload_file {file_name} in {bucket}, object: {object_name}"
@@ -0,0 +1,73 @@
+"""
+Simulation of the wall time of a DCF replication for each submission order.
+
+Batch starts queued jobs in submission order as compute slots free up, each
+job copying its file at --throughput MB/s after --overhead seconds of
+startup. File sizes are drawn from a log-normal distribution with a few very
+large files, like GDC manifests of mixed BAM and small index files.
+
+    python benchmarks/job_ordering.py --files 20000 --slots 200
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_jobs.dcf_replication.scheduling import SUBMISSION_ORDERS, order_files
+
+
+def make_sizes(files, large_files, seed):
+    rng = random.Random(seed)
+    sizes = [int(rng.lognormvariate(17, 3)) for _ in range(files)]
+    for i in rng.sample(range(files), large_files):
+        sizes[i] = rng.randint(200, 800) * 1024**3
+    return sizes
+
+
+def simulate(sizes, slots, throughput, overhead):
+    """
+    Returns:
+        tuple(float, float): wall time and time by which half of the files
+        were copied, in seconds
+    """
+    free_at = [0.0] * slots
+    done = []
+    for size in sizes:
+        start = heapq.heappop(free_at)
+        end = start + overhead + size / (throughput * 1024 * 1024)
+        heapq.heappush(free_at, end)
+        done.append(end)
+    done.sort()
+    return done[-1], done[len(done) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--large_files", type=int, default=20)
+    parser.add_argument("--slots", type=int, default=200)
+    parser.add_argument("--throughput", type=float, default=100)
+    parser.add_argument("--overhead", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sizes = make_sizes(args.files, args.large_files, args.seed)
+    print(f"{len(sizes)} files, {sum(sizes) / 1024**4:.1f} TB, {args.slots} slots")
+    for order in SUBMISSION_ORDERS:
+        ordered = [
+            fi["size"] for fi in order_files(({"size": s} for s in sizes), order)
+        ]
+        wall_time, half_time = simulate(
+            ordered, args.slots, args.throughput, args.overhead
+        )
+        print(
+            f"{order:<16} wall time {wall_time / 3600:6.2f}h, "
+            f"half of the files copied after {half_time / 3600:6.2f}h"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Benchmark of the manifest preparation path of dcf_replication_job: project
+validation, parsing and routing of every row of a GDC manifest.
+
+A synthetic manifest is generated with --rows rows spread over --projects
+projects, with --exceptions bucket prefixes in each postfix exception list.
+Routing through the compiled table is compared with the per-row routing
+that map_project_to_bucket used to do against the settings lists.
+
+    python benchmarks/manifest_preparation.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_jobs.dcf_replication import dcf_replication_job
+from batch_jobs.dcf_replication.routing import find_unknown_projects
+
+HEADER = [
+    "id",
+    "file_name",
+    "md5",
+    "size",
+    "state",
+    "project_id",
+    "baseid",
+    "version",
+    "release",
+    "acl",
+    "type",
+    "deletereason",
+    "url",
+]
+
+
+def per_row_bucket(fi, project_acl, postfix_1_exception, postfix_2_exception):
+    """
+    Routing of a single row against the settings lists, as it was done
+    before the routing table
+    """
+    if fi["project_id"] in project_acl:
+        bucket = project_acl[fi["project_id"]]["aws_bucket_prefix"]
+    else:
+        raise ValueError(f"Project ID {fi['project_id']} not found in the mapping")
+
+    if fi["acl"] == "['open']":
+        if "target" in bucket:
+            bucket = "gdc-target-phs000218-2-open"
+        else:
+            if bucket not in postfix_1_exception and bucket not in postfix_2_exception:
+                bucket += "-2-open"
+            elif bucket in postfix_1_exception:
+                bucket += "-open"
+            elif bucket in postfix_2_exception:
+                bucket += "-2-open"
+    else:
+        if "target" in bucket:
+            bucket = "target-controlled"
+        else:
+            if bucket not in postfix_1_exception and bucket not in postfix_2_exception:
+                bucket += "-controlled"
+            elif bucket in postfix_1_exception:
+                bucket += "-controlled"
+            elif bucket in postfix_2_exception:
+                bucket += "-2-controlled"
+    return bucket
+
+
+def make_settings(projects, exceptions):
+    project_acl = {
+        f"PROJECT-{i}": {"aws_bucket_prefix": f"gdc-project-{i}-phs{i:06d}"}
+        for i in range(projects)
+    }
+    prefixes = [project["aws_bucket_prefix"] for project in project_acl.values()]
+    postfix_1_exception = prefixes[-exceptions:] + [
+        f"other-{i}" for i in range(max(0, exceptions - projects))
+    ]
+    postfix_2_exception = [f"other-2-{i}" for i in range(exceptions)]
+    return project_acl, postfix_1_exception, postfix_2_exception
+
+
+def write_manifest(path, rows, project_ids):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\t".join(HEADER) + "\n")
+        for i in range(rows):
+            file_id = str(uuid.uuid4())
+            acl = "['open']" if i % 3 else "['phs000178']"
+            f.write(
+                f"{file_id}\t{file_id}.bam\t{'0' * 32}\t{i}\treleased\t"
+                f"{random.choice(project_ids)}\t{file_id}\t1\t2\t{acl}\tactive\t\t"
+                f"s3://gdc-bucket/{file_id}\n"
+            )
+
+
+def timed(description, rows, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{description:<40} {elapsed:8.2f}s {rows / elapsed:12,.0f} rows/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--projects", type=int, default=80)
+    parser.add_argument("--exceptions", type=int, default=40)
+    args = parser.parse_args()
+
+    project_acl, postfix_1_exception, postfix_2_exception = make_settings(
+        args.projects, args.exceptions
+    )
+    dcf_replication_job.PROJECT_ACL = project_acl
+    dcf_replication_job.POSTFIX_1_EXCEPTION = postfix_1_exception
+    dcf_replication_job.POSTFIX_2_EXCEPTION = postfix_2_exception
+
+    fd, path = tempfile.mkstemp(suffix=".tsv")
+    os.close(fd)
+    try:
+        write_manifest(path, args.rows, list(project_acl))
+        routing = dcf_replication_job.get_routing_table()
+        rows = [
+            {"project_id": project_id, "acl": acl}
+            for project_id, acl in zip(
+                [random.choice(list(project_acl)) for _ in range(args.rows)],
+                ["['open']", "['phs000178']"] * (args.rows // 2 + 1),
+            )
+        ]
+
+        timed(
+            "routing, per row",
+            args.rows,
+            lambda: [
+                per_row_bucket(
+                    fi, project_acl, postfix_1_exception, postfix_2_exception
+                )
+                for fi in rows
+            ],
+        )
+        timed(
+            "routing, compiled table",
+            args.rows,
+            lambda: [
+                dcf_replication_job.map_project_to_bucket(fi, routing) for fi in rows
+            ],
+        )
+        del rows
+        timed(
+            "project validation pass",
+            args.rows,
+            lambda: find_unknown_projects(path, routing),
+        )
+        report = dcf_replication_job.ManifestReport()
+        count = timed(
+            "parse and route manifest",
+            args.rows,
+            lambda: sum(
+                1 for _ in dcf_replication_job.iter_manifest_rows(path, report, routing)
+            ),
+        )
+        print(f"{count} rows routed, {report.invalid} rejected")
+        print(
+            f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+        )
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Start-up time of the per-object worker jobs.
+
+Each case runs in a fresh python process, like a job container: the time to
+import the job module, and the time of the first boto3 call setup, building
+the clients or resources a job needs before its first request. No request
+is sent, so the benchmark runs offline.
+
+    python benchmarks/startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTS = {
+    "gdc_copy": "import batch_jobs.dcf_replication.file_get_upload",
+    "object_metadata": "import batch_jobs.bucket_manifest.object_metadata_job",
+    "dcf_coordinator": "import batch_jobs.dcf_replication.dcf_replication_job",
+}
+
+FIRST_CALLS = {
+    "sqs_resource": (
+        "import boto3",
+        "boto3.resource('sqs', region_name='us-east-1')",
+    ),
+    "sqs_client": (
+        "import boto3",
+        "boto3.client('sqs', region_name='us-east-1')",
+    ),
+    "s3_and_sqs_clients": (
+        "import boto3",
+        "boto3.client('s3', region_name='us-east-1'); "
+        "boto3.client('sqs', region_name='us-east-1')",
+    ),
+}
+
+TIMER = """
+import time
+start = time.perf_counter()
+{setup}
+setup = time.perf_counter() - start
+start = time.perf_counter()
+{statement}
+print(json.dumps([setup, time.perf_counter() - start]))
+"""
+
+
+def measure(setup, statement):
+    """
+    Returns:
+        tuple(float, float): seconds spent in `setup` and in `statement` in
+        a fresh python process
+    """
+    code = "import json\n" + TIMER.format(setup=setup, statement=statement)
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env={**os.environ, "AWS_ACCESS_KEY_ID": "x", "AWS_SECRET_ACCESS_KEY": "x"},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"median of {args.repeat} fresh processes")
+    for name, statement in IMPORTS.items():
+        times = [measure("pass", statement)[1] for _ in range(args.repeat)]
+        print(f"import {name:<20} {statistics.median(times) * 1000:8.1f} ms")
+    for name, (setup, statement) in FIRST_CALLS.items():
+        times = [measure(setup, statement) for _ in range(args.repeat)]
+        print(
+            f"first call {name:<16} {statistics.median(t[1] for t in times) * 1000:8.1f} ms"
+            f" (after {statistics.median(t[0] for t in times) * 1000:.1f} ms of import)"
+        )
+
+
+if __name__ == "__main__":
+    main()
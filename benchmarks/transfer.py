@@ -0,0 +1,269 @@
+"""
+End-to-end throughput of the GDC API to S3 copy, offline.
+
+The GDC data API is played by the stand-in of the tests, served from this
+process with a latency, a bandwidth per response, a rate of random errors
+and a limit on the requests in flight past which it throttles. Every case
+of the grid of part sizes and concurrency levels copies a file of
+--file_size MB with api_to_bucket_copy, in a fresh python process where S3
+is mocked by moto, and reports:
+
+- the throughput and elapsed time of the transfer summary
+- the download and upload retries of the summary, and the 429 and 500
+  responses of the stand-in
+- the peak RSS of the copy process while parts are transferred, and its
+  growth over the RSS before the transfer. Sampling stops when the upload is
+  completed, as moto then assembles the whole object in memory.
+
+Changes to the transfer engine (part sizes, concurrency control, hedging,
+spooling) can be compared on the same profile before they are rolled out.
+
+    python benchmarks/transfer.py --file_size 256 --chunk_sizes 8 32 \\
+        --concurrency 1 4 8 --latency 0.05 --bandwidth 20 --error_rate 0.02
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.dcf_replication.gdc_standin import GDCStandIn
+
+MB = 1024 * 1024
+FILE_ID = "07de33ac-7a49-4008-b035-707129c02a1d"
+BUCKET = "benchmark-gdc-bucket"
+SAMPLE_SECONDS = 0.01
+
+
+def rss():
+    """
+    Returns:
+        int: resident set size of this process in bytes
+    """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class RSSSampler:
+    """
+    Peak RSS of this process, sampled in a thread until `stop` is called
+    """
+
+    def __init__(self):
+        self.baseline = rss()
+        self.peak = self.baseline
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stopped.wait(SAMPLE_SECONDS):
+            self.peak = max(self.peak, rss())
+
+    def stop(self, **kwargs):
+        if not self._stopped.is_set():
+            self.peak = max(self.peak, rss())
+            self._stopped.set()
+
+
+def run_case(case):
+    """
+    Copy the file of `case` to a moto bucket, in the current process
+
+    Returns:
+        dict: exit code, transfer summary and memory of the copy
+    """
+    from moto import mock_aws
+
+    import boto3
+
+    from batch_jobs.dcf_replication import file_get_upload
+    from batch_jobs.dcf_replication.transfer_metrics import METRICS_PREFIX
+    from batch_jobs.utils.clients import get_bucket_client
+
+    with mock_aws(), tempfile.TemporaryDirectory() as state_location:
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        # the cached client api_to_bucket_copy uploads with
+        s3 = get_bucket_client(
+            BUCKET, max_pool_connections=max(10, case["concurrency"])
+        )
+        sampler = RSSSampler()
+        s3.meta.events.register("before-call.s3.CompleteMultipartUpload", sampler.stop)
+        output = io.StringIO()
+        code = None
+        with contextlib.redirect_stdout(output):
+            try:
+                file_get_upload.api_to_bucket_copy(
+                    FILE_ID,
+                    "token",
+                    BUCKET,
+                    f"{FILE_ID}/benchmark.bam",
+                    case["file_size"],
+                    case["md5"],
+                    case["chunk_size"],
+                    case["retries_num"],
+                    state_location,
+                    concurrency=case["concurrency"],
+                    adaptive=case["adaptive"],
+                    hedge_percentile=case["hedge_percentile"],
+                    spool_dir=case["spool_dir"],
+                )
+            except SystemExit as e:
+                code = e.code
+        sampler.stop()
+
+    summary = None
+    for line in output.getvalue().splitlines():
+        if line.startswith(METRICS_PREFIX):
+            summary = json.loads(line[len(METRICS_PREFIX) :])
+    return {
+        "exit_code": code,
+        "summary": summary,
+        "peak_rss_mb": sampler.peak / MB,
+        "rss_growth_mb": (sampler.peak - sampler.baseline) / MB,
+    }
+
+
+def measure(case, standin):
+    """
+    Run a case in a fresh python process against `standin`
+
+    Returns:
+        dict: see `run_case`
+    """
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+        cwd=ROOT,
+        env={
+            **os.environ,
+            "GDC_API_URL": standin.url,
+            "AWS_ACCESS_KEY_ID": "x",
+            "AWS_SECRET_ACCESS_KEY": "x",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        },
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file_size", type=int, default=128, help="MB")
+    parser.add_argument(
+        "--chunk_sizes", type=int, nargs="+", default=[8, 32], help="MB"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds before each response"
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, default=None, help="MB/s of each response"
+    )
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--max_in_flight", type=int, default=None)
+    parser.add_argument("--retries_num", type=int, default=5)
+    parser.add_argument("--fixed_concurrency", action="store_true")
+    parser.add_argument("--hedge_percentile", type=float, default=0)
+    parser.add_argument("--spool_dir", default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    data = random.Random(0).randbytes(args.file_size * MB)
+    md5 = hashlib.md5(data).hexdigest()
+    profile = {
+        "latency": args.latency,
+        "bandwidth": int(args.bandwidth * MB) if args.bandwidth else None,
+        "error_rate": args.error_rate,
+        "max_in_flight": args.max_in_flight,
+    }
+    print(
+        f"{args.file_size} MB file, stand-in {profile}, "
+        f"median of {args.repeat} run(s)"
+    )
+    print(
+        f"{'chunk MB':>8} {'conc':>4} {'MB/s':>8} {'seconds':>8} {'retries':>8} "
+        f"{'429':>5} {'500':>5} {'peak MB':>8} {'growth MB':>9} {'exit':>4}"
+    )
+    results = []
+    for chunk_size in args.chunk_sizes:
+        for concurrency in args.concurrency:
+            case = {
+                "file_size": len(data),
+                "md5": md5,
+                "chunk_size": chunk_size * MB,
+                "concurrency": concurrency,
+                "retries_num": args.retries_num,
+                "adaptive": not args.fixed_concurrency,
+                "hedge_percentile": args.hedge_percentile,
+                "spool_dir": args.spool_dir,
+            }
+            runs = []
+            for seed in range(args.repeat):
+                with GDCStandIn({FILE_ID: data}, seed=seed, **profile) as standin:
+                    started = time.monotonic()
+                    run = measure(case, standin)
+                    run["wall_seconds"] = time.monotonic() - started
+                    run["statuses"] = dict(standin.statuses)
+                    run["bytes_sent"] = standin.bytes_sent
+                runs.append(run)
+            summaries = [run["summary"] or {} for run in runs]
+            result = {
+                "chunk_size": chunk_size,
+                "concurrency": concurrency,
+                "mb_per_second": statistics.median(
+                    s.get("mb_per_second") or 0 for s in summaries
+                ),
+                "elapsed_seconds": statistics.median(
+                    s.get("elapsed_seconds") or 0 for s in summaries
+                ),
+                "retries": statistics.median(
+                    sum((s.get("retries") or {}).values()) for s in summaries
+                ),
+                "throttled": statistics.median(
+                    run["statuses"].get(429, 0) for run in runs
+                ),
+                "errors": statistics.median(
+                    run["statuses"].get(500, 0) for run in runs
+                ),
+                "peak_rss_mb": statistics.median(run["peak_rss_mb"] for run in runs),
+                "rss_growth_mb": statistics.median(
+                    run["rss_growth_mb"] for run in runs
+                ),
+                "exit_codes": [run["exit_code"] for run in runs],
+                "runs": runs,
+            }
+            results.append(result)
+            print(
+                f"{chunk_size:>8} {concurrency:>4} {result['mb_per_second']:8.1f} "
+                f"{result['elapsed_seconds']:8.2f} {result['retries']:8.0f} "
+                f"{result['throttled']:5.0f} {result['errors']:5.0f} "
+                f"{result['peak_rss_mb']:8.0f} {result['rss_growth_mb']:9.0f} "
+                f"{max(code or 0 for code in result['exit_codes']):>4}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"profile": profile, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
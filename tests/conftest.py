@@ -8,6 +8,8 @@ from moto import mock_aws
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from batch_jobs.utils.clients import clear_client_cache
+
 fake_message1 = {
     "md5": "d9673f3128fcfbd70d040f7dc18afbd8",
     "size": 7,
@@ -21,6 +23,14 @@ fake_message2 = {
 }
 
 
+@pytest.fixture(scope="function", autouse=True)
+def client_cache():
+    """Do not share cached boto3 clients between tests."""
+    clear_client_cache()
+    yield
+    clear_client_cache()
+
+
 @pytest.fixture(scope="function")
 def mock_env():
     """Mocked AWS Credentials for moto."""
@@ -0,0 +1,219 @@
+"""
+Local stand-in for the GDC data API (https://api.gdc.cancer.gov/data/{file_id})
+
+Besides the deterministic failures the tests rely on, the stand-in can model
+a loaded API for benchmarks/transfer.py: a latency before every response, a
+bandwidth per response, a share of requests failing at random and a limit
+on the requests in flight past which requests are throttled.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# slice of a response body sent at a time when the bandwidth is limited
+WRITE_SIZE = 64 * 1024
+
+
+class GDCStandIn:
+    """
+    Serve files over HTTP the way the GDC data API does
+
+    Args:
+        files(dict): file id -> content
+        fail_starts(dict): range start -> number of times a request for a range
+            starting there fails with a 500, None to always fail
+        throttle(int): number of requests answered with a 429 before serving
+        retry_after(str): Retry-After header sent with the 429 responses
+        stall_starts(dict): range start -> seconds the first request for a
+            range starting there waits before it is answered
+        latency(float): seconds every data request waits before it is answered
+        bandwidth(int): bytes per second a response body is sent at, None for
+            no limit
+        error_rate(float): share of the data requests answered with a 500
+        max_in_flight(int): data requests served at the same time, the others
+            are answered with a 429, None for no limit
+        seed(int): seed of the random errors
+    """
+
+    def __init__(
+        self,
+        files,
+        fail_starts=None,
+        throttle=0,
+        retry_after="0",
+        stall_starts=None,
+        latency=0.0,
+        bandwidth=None,
+        error_rate=0.0,
+        max_in_flight=None,
+        seed=0,
+    ):
+        self.files = files
+        self.fail_starts = dict(fail_starts or {})
+        self.stall_starts = dict(stall_starts or {})
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.max_in_flight = max_in_flight
+        self.requests = []
+        self.connections = 0
+        # response status -> number of data responses
+        self.statuses = Counter()
+        self.bytes_sent = 0
+        self.in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def requested_starts(self):
+        return [start for _, start in self.requests]
+
+    def _should_fail(self, start):
+        with self._lock:
+            if start not in self.fail_starts:
+                return False
+            remaining = self.fail_starts[start]
+            if remaining is None:
+                return True
+            if remaining <= 0:
+                return False
+            self.fail_starts[start] = remaining - 1
+            return True
+
+    def _stall(self, start):
+        with self._lock:
+            seconds = self.stall_starts.pop(start, 0)
+        if seconds:
+            time.sleep(seconds)
+
+    def _should_throttle(self):
+        with self._lock:
+            if self.throttle <= 0:
+                return False
+            self.throttle -= 1
+            return True
+
+    def _should_fail_at_random(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _enter(self):
+        """
+        Returns:
+            bool: False if the request is over the in-flight limit
+        """
+        with self._lock:
+            if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def _make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with standin._lock:
+                standin.connections += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b"", headers=None, count=False):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if count:
+                with standin._lock:
+                    standin.statuses[status] += 1
+                    if status in (200, 206):
+                        standin.bytes_sent += len(body)
+            if not count or not standin.bandwidth:
+                self.wfile.write(body)
+                return
+            # paced so that the body is sent at the bandwidth
+            started = time.monotonic()
+            view = memoryview(body)
+            for offset in range(0, len(body), WRITE_SIZE):
+                sent = min(offset + WRITE_SIZE, len(body))
+                delay = sent / standin.bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                self.wfile.write(view[offset:sent])
+
+        def do_GET(self):
+            if self.path == "/status":
+                with standin._lock:
+                    standin.requests.append(("status", None))
+                if standin._should_throttle():
+                    return self._send(
+                        429, b"throttled", {"Retry-After": standin.retry_after}
+                    )
+                return self._send(200, b'{"status": "OK"}')
+            match = re.match(r"^/data/([^/?]+)$", self.path)
+            if not match or match.group(1) not in standin.files:
+                return self._send(404, b"not found")
+            data = standin.files[match.group(1)]
+
+            start, end = 0, len(data) - 1
+            range_header = self.headers.get("Range")
+            if range_header:
+                start, end = [
+                    int(v) for v in range_header.replace("bytes=", "").split("-")
+                ]
+                end = min(end, len(data) - 1)
+            with standin._lock:
+                standin.requests.append((match.group(1), start))
+
+            if standin._should_throttle() or not standin._enter():
+                return self._send(
+                    429, b"throttled", {"Retry-After": standin.retry_after}, count=True
+                )
+            try:
+                if standin.latency:
+                    time.sleep(standin.latency)
+                if standin._should_fail(start) or standin._should_fail_at_random():
+                    return self._send(500, b"error", count=True)
+                standin._stall(start)
+                if range_header:
+                    return self._send(
+                        206,
+                        data[start : end + 1],
+                        {"Content-Range": f"bytes {start}-{end}/{len(data)}"},
+                        count=True,
+                    )
+                return self._send(200, data, count=True)
+            finally:
+                standin._leave()
+
+    return Handler
@@ -0,0 +1,55 @@
+import boto3
+from moto import mock_aws
+
+from batch_jobs.dcf_replication.content_index import ContentIndex
+from batch_jobs.dcf_replication.manifest_writer import S3ManifestWriter
+
+FIELDS = ["guid", "md5", "size", "urls", "checksum"]
+
+
+def test_content_index(mock_env):
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="output")
+        rows = {
+            "dcf_aws_batch_completed_20240101": [
+                {
+                    "guid": "a",
+                    "md5": "0" * 32,
+                    "size": "10",
+                    "urls": "['https://api.gdc.cancer.gov/data/a', 's3://open/a/f']",
+                },
+                {
+                    "guid": "a2",
+                    "md5": "0" * 32,
+                    "size": "10",
+                    "urls": "['s3://ctl/a/f']",
+                    "checksum": "SHA256:abc-2",
+                },
+                {"guid": "b", "md5": "", "size": "10", "urls": "['s3://open/b/f']"},
+            ],
+            "dcf_aws_batch_skipped_20240101": [
+                {"guid": "c", "md5": "1" * 32, "size": "5", "urls": "['s3://ctl/c/f']"},
+            ],
+            "dcf_aws_batch_failed_20240101": [
+                {"guid": "d", "md5": "2" * 32, "size": "5", "urls": "['s3://ctl/d/f']"},
+            ],
+        }
+        for key_prefix, manifest_rows in rows.items():
+            compress = "skipped" in key_prefix
+            with S3ManifestWriter(
+                s3, "output", key_prefix, FIELDS, compress=compress
+            ) as writer:
+                writer.writerows(manifest_rows)
+
+        with ContentIndex(":memory:") as index:
+            assert index.build(s3, "output") == 4
+            # replicas with a recorded checksum come first
+            assert index.lookup("0" * 32, 10) == ("s3://ctl/a/f", "SHA256:abc-2")
+            assert index.lookup("0" * 32, "10", exclude="s3://ctl/a/f") == (
+                "s3://open/a/f",
+                "",
+            )
+            assert index.lookup("0" * 32, 11) is None
+            assert index.lookup("1" * 32, 5) == ("s3://ctl/c/f", "")
+            assert index.lookup("2" * 32, 5) is None
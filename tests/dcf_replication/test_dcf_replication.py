@@ -1,13 +1,44 @@
 import pytest
 import os
 import csv
+import json
+import pickle
+import hashlib
 from unittest.mock import patch
+
+import boto3
+from moto import mock_aws
+
 from batch_jobs.dcf_replication.dcf_replication_job import (
+    JOB_ID_KEY,
+    JOB_STATUS_KEY,
     parse_manifest_file,
     map_project_to_bucket,
     convert_file_info_to_output_manifest,
+    precheck_files,
+    make_bundles,
+    submit_job,
+    submit_split_job,
+    submit_batch_job,
+    track_jobs,
+    submit_jobs,
+    iter_manifest_rows,
+    ManifestReport,
+    ManifestRow,
+    ManifestRows,
+    write_throughput_report,
+    merge_shard_manifests,
 )
-
+from batch_jobs.dcf_replication.content_index import ContentIndex
+from batch_jobs.dcf_replication.ledger import SubmissionLedger, ledger_key
+from batch_jobs.dcf_replication.checksums import (
+    CHECKSUM_ALGORITHM,
+    object_checksum,
+    part_checksum,
+)
+from batch_jobs.dcf_replication.scheduling import scheduling_priority
+from batch_jobs.dcf_replication.transfer_metrics import TransferMetrics
+import batch_jobs.dcf_replication.dcf_replication_job as dcf_replication_job
 
 # Import the test settings
 import tests.dcf_replication.test_settings as test_settings
@@ -272,3 +303,960 @@ def test_convert_file_info_to_output_manifest():
                 "s3://test-gdc-abc-phs000222-2-controlled/4cb739ba-edc9-47a3-a395-154d039d5545/4cb739ba-edc9-47a3-a395-154d039d5545",
             ],
         }
+
+
+@pytest.fixture(scope="function")
+def test_project_settings():
+    with patch(
+        "batch_jobs.dcf_replication.dcf_replication_job.PROJECT_ACL",
+        test_settings.PROJECT_ACL,
+    ), patch(
+        "batch_jobs.dcf_replication.dcf_replication_job.POSTFIX_1_EXCEPTION",
+        test_settings.POSTFIX_1_EXCEPTION,
+    ), patch(
+        "batch_jobs.dcf_replication.dcf_replication_job.POSTFIX_2_EXCEPTION",
+        test_settings.POSTFIX_2_EXCEPTION,
+    ):
+        yield
+
+
+@pytest.fixture(scope="function")
+def destination_buckets(mock_env, monkeypatch):
+    """
+    Every destination bucket of GDC_test_manifest.tsv except CHARLIE's controlled one
+    """
+    session = boto3.Session
+    monkeypatch.setattr(
+        boto3, "Session", lambda profile_name=None, **kwargs: session(**kwargs)
+    )
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        for bucket in [
+            "test-gdc-xyz-phs000111-open",
+            "test-gdc-xyz-phs000111-controlled",
+            "test-gdc-abc-phs000222-2-open",
+            "test-gdc-abc-phs000222-2-controlled",
+            "test-gdc-def-phs000333-2-open",
+        ]:
+            s3.create_bucket(Bucket=bucket)
+        # already copied
+        s3.put_object(
+            Bucket="test-gdc-xyz-phs000111-open",
+            Key="07de33ac-7a49-4008-b035-707129c02a1d/07de33ac-7a49-4008-b035-707129c02a1d",
+            Body=b"x" * 131,
+        )
+        # partially copied, the size does not match
+        s3.put_object(
+            Bucket="test-gdc-xyz-phs000111-open",
+            Key="d85d67aa-7273-403f-be77-9ef8ae998e4a/d85d67aa-7273-403f-be77-9ef8ae998e4a",
+            Body=b"x" * 10,
+        )
+        yield s3
+
+
+@pytest.mark.parametrize("prefix_listing_threshold", [1000, 0])
+def test_precheck_files(
+    test_project_settings, destination_buckets, monkeypatch, prefix_listing_threshold
+):
+    """
+    Test pre-checking with prefix listings and with whole bucket listings
+    """
+    monkeypatch.setattr(
+        "batch_jobs.dcf_replication.dcf_replication_job.PREFIX_LISTING_THRESHOLD",
+        prefix_listing_threshold,
+    )
+    monkeypatch.setattr(
+        "batch_jobs.dcf_replication.destination_index.PREFIX_LISTING_THRESHOLD",
+        prefix_listing_threshold,
+    )
+    file_info = parse_manifest_file(TEST_MANIFEST_PATH)
+    pending = precheck_files(file_info)
+
+    statuses = {fi["id"]: fi.get(JOB_STATUS_KEY) for fi in file_info}
+    assert statuses["07de33ac-7a49-4008-b035-707129c02a1d"] == "SKIPPED"
+    assert statuses["d85d67aa-7273-403f-be77-9ef8ae998e4a"] is None
+    for fi in file_info:
+        if fi["destination_bucket"] == "test-gdc-def-phs000333-controlled":
+            assert fi[JOB_STATUS_KEY] == "FAILED"
+    assert len(pending) == 12
+    assert all(JOB_STATUS_KEY not in fi for fi in pending)
+
+
+def test_make_bundles():
+    files = [
+        {"id": str(i), "destination_bucket": bucket, "size": size}
+        for i, (bucket, size) in enumerate(
+            [("a", 10), ("b", 10), ("a", 10), ("a", 10), ("a", 50), ("b", 200)]
+        )
+    ]
+
+    bundles = [[fi["id"] for fi in bundle] for bundle in make_bundles(files, 3, 60)]
+
+    # bundles only group files of the same destination bucket, and a file
+    # larger than the size limit gets a bundle of its own
+    assert sorted(bundles) == [["0", "2", "3"], ["1"], ["4"], ["5"]]
+
+
+def test_submit_job_part_concurrency(monkeypatch):
+    submitted = []
+
+    def submit_batch_job(job_queue, job_definition, job_name, environment, **kwargs):
+        submitted.append(environment)
+        return "job-1"
+
+    monkeypatch.setattr(dcf_replication_job, "submit_batch_job", submit_batch_job)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "MULTI_PART_THRESHOLD", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "PART_CONCURRENCY", 4)
+    file = {
+        "id": "1",
+        "file_name": "f.bam",
+        "size": "1024",
+        "md5": "md5",
+        "destination_bucket": "destination",
+    }
+    submit_job("queue", "definition", file)
+    (environment,) = submitted
+    assert environment["CONCURRENCY"] == 4
+    assert file[JOB_ID_KEY] == "job-1"
+
+
+def test_submit_split_job(mock_env, monkeypatch):
+    submitted = []
+
+    def submit_batch_job(job_queue, job_definition, job_name, environment, **kwargs):
+        submitted.append((job_name, environment, kwargs))
+        return f"job-{len(submitted)}"
+
+    monkeypatch.setattr(dcf_replication_job, "submit_batch_job", submit_batch_job)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "SPLIT_JOB_SIZE", 1024)
+    monkeypatch.setattr(
+        boto3, "Session", lambda profile_name=None, **kwargs: boto3.session.Session()
+    )
+    file = {
+        "id": "1",
+        "file_name": "f.bam",
+        "size": str(10 * 1024 * 1024 * 1024 + 1),
+        "md5": "md5",
+        "destination_bucket": "destination",
+    }
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="destination")
+        submit_split_job("queue", "definition", "output", file)
+        uploads = s3.list_multipart_uploads(Bucket="destination")["Uploads"]
+
+    # 41 parts of 256 MB, uploaded 4 parts per job
+    parts_call, finalize_call = submitted
+    parts_name, parts_env, parts_kwargs = parts_call
+    finalize_name, _, finalize_kwargs = finalize_call
+    assert parts_name == "gdc_copy_parts"
+    assert parts_kwargs == {"arrayProperties": {"size": 11}}
+    assert parts_env["SPLIT_PARTS_PER_JOB"] == 4
+    assert parts_env["CHUNK_SIZE"] == 256
+    assert parts_env["CONCURRENCY"] == dcf_replication_job.PART_CONCURRENCY
+    assert parts_env["SPLIT_UPLOAD_ID"] == uploads[0]["UploadId"]
+    assert finalize_name == "gdc_copy_finalize"
+    assert finalize_kwargs == {"dependsOn": [{"jobId": "job-1"}]}
+    assert file[JOB_STATUS_KEY] == "SUBMITTED"
+    assert file["job_id"] == "job-2"
+
+
+def test_submit_split_job_reuses_upload(mock_env, monkeypatch):
+    submitted = []
+
+    def submit_batch_job(job_queue, job_definition, job_name, environment, **kwargs):
+        submitted.append(environment)
+        return f"job-{len(submitted)}"
+
+    monkeypatch.setattr(dcf_replication_job, "submit_batch_job", submit_batch_job)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "SPLIT_JOB_SIZE", 1024)
+    monkeypatch.setattr(
+        boto3, "Session", lambda profile_name=None, **kwargs: boto3.session.Session()
+    )
+    file = {
+        "id": "1",
+        "file_name": "f.bam",
+        "size": str(10 * 1024 * 1024 * 1024 + 1),
+        "md5": "md5",
+        "destination_bucket": "destination",
+    }
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="destination")
+        s3.create_bucket(Bucket="output")
+        # left by a run whose part jobs failed
+        upload_id = s3.create_multipart_upload(
+            Bucket="destination", Key="1/f.bam", ChecksumAlgorithm="SHA256"
+        )["UploadId"]
+        submit_split_job("queue", "definition", "output", file)
+        assert submitted[0]["SPLIT_UPLOAD_ID"] == upload_id
+        assert file["upload_id"] == upload_id
+
+        # an upload with another checksum algorithm is aborted with its digests
+        s3.abort_multipart_upload(
+            Bucket="destination", Key="1/f.bam", UploadId=upload_id
+        )
+        upload_id = s3.create_multipart_upload(
+            Bucket="destination", Key="1/f.bam", ChecksumAlgorithm="CRC32"
+        )["UploadId"]
+        s3.put_object(Bucket="output", Key="split_parts/1/00001.json", Body=b"{}")
+        submit_split_job("queue", "definition", "output", file)
+        (upload,) = s3.list_multipart_uploads(Bucket="destination")["Uploads"]
+        assert upload["UploadId"] != upload_id
+        assert submitted[-1]["SPLIT_UPLOAD_ID"] == upload["UploadId"]
+        assert "Contents" not in s3.list_objects_v2(Bucket="output")
+
+
+def test_submit_split_job_part_limit(mock_env, monkeypatch):
+    submitted = []
+
+    def submit_batch_job(job_queue, job_definition, job_name, environment, **kwargs):
+        submitted.append((job_name, environment, kwargs))
+        return f"job-{len(submitted)}"
+
+    monkeypatch.setattr(dcf_replication_job, "submit_batch_job", submit_batch_job)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 8, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "SPLIT_JOB_SIZE", 32 * 1024)
+    monkeypatch.setattr(
+        boto3, "Session", lambda profile_name=None, **kwargs: boto3.session.Session()
+    )
+    file = {
+        "id": "1",
+        "file_name": "f.bam",
+        "size": str(1024**4),
+        "md5": "md5",
+        "destination_bucket": "destination",
+    }
+
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="destination")
+        submit_split_job("queue", "definition", "output", file)
+
+    # 8 MB parts would need 131072 parts, 9987 parts of 105 MB are uploaded
+    # 312 parts per job
+    (_, parts_env, parts_kwargs), _ = submitted
+    assert parts_env["CHUNK_SIZE"] == 105
+    assert parts_env["SPLIT_PARTS_PER_JOB"] == 312
+    assert parts_kwargs == {"arrayProperties": {"size": 33}}
+
+
+@pytest.fixture(scope="function")
+def batch_queue(mock_env, monkeypatch):
+    session = boto3.Session
+    monkeypatch.setattr(
+        boto3, "Session", lambda profile_name=None, **kwargs: session(**kwargs)
+    )
+    monkeypatch.setattr("batch_jobs.utils.job_tracker.time.sleep", lambda s: None)
+    with mock_aws(config={"batch": {"use_docker": False}}):
+        iam = boto3.client("iam", region_name="us-east-1")
+        role = iam.create_role(RoleName="batch", AssumeRolePolicyDocument="{}")
+        batch = boto3.client("batch", region_name="us-east-1")
+        compute_environment = batch.create_compute_environment(
+            computeEnvironmentName="test-compute-environment",
+            type="UNMANAGED",
+            serviceRole=role["Role"]["Arn"],
+        )
+        batch.create_job_queue(
+            jobQueueName="test-queue",
+            state="ENABLED",
+            priority=1,
+            computeEnvironmentOrder=[
+                {
+                    "order": 1,
+                    "computeEnvironment": compute_environment["computeEnvironmentArn"],
+                }
+            ],
+        )
+        batch.register_job_definition(
+            jobDefinitionName="test-definition",
+            type="container",
+            containerProperties={"image": "gdc-copy", "vcpus": 1, "memory": 128},
+        )
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="output")
+        yield s3
+
+
+def read_manifest(s3, prefix):
+    (obj,) = s3.list_objects_v2(Bucket="output", Prefix=prefix)["Contents"]
+    body = s3.get_object(Bucket="output", Key=obj["Key"])["Body"].read().decode()
+    return list(csv.DictReader(body.splitlines(), delimiter="\t"))
+
+
+def test_track_jobs(batch_queue, monkeypatch):
+    files = []
+    for i in range(5):
+        if i >= 3:
+            # jobs fail right away
+            monkeypatch.setenv("MOTO_SIMPLE_BATCH_FAIL_AFTER", "0")
+        files.append(
+            {
+                "id": str(i),
+                "file_name": f"file_{i}",
+                "size": "10",
+                "acl": "['open']",
+                "md5": "md5",
+                "baseid": "",
+                "url": "",
+                "project_id": "TEST",
+                "destination_bucket": "destination",
+                "job_id": submit_batch_job("test-queue", "test-definition", "t", {}),
+            }
+        )
+
+    batch_queue.create_bucket(Bucket="destination")
+    batch_queue.put_object(
+        Bucket="destination",
+        Key="0/file_0",
+        Body=b"0123456789",
+        ChecksumAlgorithm=CHECKSUM_ALGORITHM,
+    )
+    # the last file was split across jobs sharing a multipart upload
+    files[4]["upload_id"] = batch_queue.create_multipart_upload(
+        Bucket="destination", Key="4/file_4"
+    )["UploadId"]
+    batch_queue.put_object(Bucket="output", Key="split_parts/4/00001.json", Body=b"")
+    assert track_jobs(files, "output", 0, 0) == (3, 2)
+
+    # the upload of the failed split file is aborted and its digests deleted
+    assert "Uploads" not in batch_queue.list_multipart_uploads(Bucket="destination")
+    assert "Contents" not in batch_queue.list_objects_v2(
+        Bucket="output", Prefix="split_parts/"
+    )
+
+    completed = read_manifest(batch_queue, "dcf_aws_batch_completed")
+    assert [row["guid"] for row in completed] == ["0", "1", "2"]
+    # the checksum S3 stored for the copied object, if it has one
+    assert completed[0]["checksum"] == "{}:{}".format(
+        CHECKSUM_ALGORITHM, *part_checksum(b"0123456789").values()
+    )
+    assert completed[1]["checksum"] == ""
+    incomplete = read_manifest(batch_queue, "dcf_aws_batch_incomplete")
+    assert [row["job_id"] for row in incomplete] == [
+        files[3]["job_id"],
+        files[4]["job_id"],
+    ]
+    # the failed files can be submitted again as a GDC manifest
+    resubmit = read_manifest(batch_queue, "dcf_aws_batch_resubmit")
+    assert [row["id"] for row in resubmit] == ["3", "4"]
+    assert list(resubmit[0]) == [
+        "id",
+        "file_name",
+        "size",
+        "acl",
+        "md5",
+        "baseid",
+        "url",
+        "project_id",
+    ]
+
+
+def test_track_jobs_bundle(batch_queue, monkeypatch):
+    # the bundle job fails since one of its files could not be copied
+    monkeypatch.setenv("MOTO_SIMPLE_BATCH_FAIL_AFTER", "0")
+    job_id = submit_batch_job("test-queue", "test-definition", "t", {})
+    results_url = "s3://output/bundle_results/run/destination_000000.jsonl"
+    files = [
+        {
+            "id": str(i),
+            "file_name": f"file_{i}",
+            "size": "10",
+            "acl": "['open']",
+            "md5": "md5",
+            "project_id": "TEST",
+            "destination_bucket": "destination",
+            "job_id": job_id,
+            "bundle_results": results_url,
+        }
+        for i in range(4)
+    ]
+    results = [
+        {"id": "0", "status": "SUCCESS"},
+        {"id": "1", "status": "SKIPPED"},
+        {"id": "2", "status": "FAILED", "error": "MD5 mismatch"},
+    ]
+    batch_queue.put_object(
+        Bucket="output",
+        Key="bundle_results/run/destination_000000.jsonl",
+        Body="".join(json.dumps(result) + "\n" for result in results),
+    )
+    batch_queue.create_bucket(Bucket="destination")
+
+    assert track_jobs(files, "output", 0, 0) == (2, 2)
+    completed = read_manifest(batch_queue, "dcf_aws_batch_completed")
+    assert [row["guid"] for row in completed] == ["0", "1"]
+    incomplete = read_manifest(batch_queue, "dcf_aws_batch_incomplete")
+    assert [row["guid"] for row in incomplete] == ["2", "3"]
+    # the error recorded by the bundle job, a file without record fails with
+    # the job
+    assert incomplete[0]["status_reason"] == "MD5 mismatch"
+    resubmit = read_manifest(batch_queue, "dcf_aws_batch_resubmit")
+    assert [row["id"] for row in resubmit] == ["2", "3"]
+
+
+def test_iter_manifest_rows_report(test_project_settings, tmp_path):
+    with open(TEST_MANIFEST_PATH, encoding="utf-8") as f:
+        header, *rows = f.read().splitlines()
+    columns = header.split("\t")
+
+    def replace(row, column, value):
+        values = row.split("\t")
+        values[columns.index(column)] = value
+        return "\t".join(values)
+
+    bad_size = replace(rows[3], "size", "4x2")
+    bad_md5 = replace(rows[4], "md5", "not-an-md5")
+    unknown_project = replace(rows[5], "project_id", "DAVE")
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text(
+        "\n".join([header] + rows[:3] + [bad_size, bad_md5, unknown_project]) + "\n"
+    )
+
+    report = ManifestReport()
+    parsed = list(iter_manifest_rows(str(manifest), report))
+
+    assert len(parsed) == 3
+    assert all(isinstance(fi, ManifestRow) for fi in parsed)
+    assert report.to_dict()["rows"] == 6
+    assert report.to_dict()["reasons"] == {
+        "Invalid size": 1,
+        "Invalid md5": 1,
+        "Unknown project": 1,
+    }
+    assert [error["line"] for error in report.errors] == [5, 6, 7]
+
+
+def test_iter_manifest_rows_shards(test_project_settings):
+    report = ManifestReport()
+    rows = [fi.id for fi in iter_manifest_rows(TEST_MANIFEST_PATH, report)]
+
+    shard_rows = []
+    shard_reports = []
+    for index in range(3):
+        shard_report = ManifestReport()
+        shard_rows.append(
+            [
+                fi.id
+                for fi in iter_manifest_rows(
+                    TEST_MANIFEST_PATH, shard_report, shard=(index, 3)
+                )
+            ]
+        )
+        shard_reports.append(shard_report)
+
+    assert sorted(sum(shard_rows, [])) == sorted(rows)
+    assert sum(r.rows for r in shard_reports) == report.rows
+    assert all(shard_rows)
+
+
+def test_merge_shard_manifests(destination_buckets, monkeypatch):
+    destination_buckets.create_bucket(Bucket="output")
+    for index, ids in enumerate([["a", "b"], ["c"]]):
+        monkeypatch.setattr(
+            dcf_replication_job, "OUTPUT_PREFIX", f"shards/run/{index:05d}/"
+        )
+        monkeypatch.setattr(dcf_replication_job, "OUTPUT_COMPRESS", index == 0)
+        with dcf_replication_job.open_output_manifest(
+            "output", "dcf_aws_batch_submitted"
+        ) as writer:
+            writer.writerows(
+                convert_file_info_to_output_manifest(
+                    {
+                        "id": file_id,
+                        "size": 1,
+                        "acl": "['open']",
+                        "destination_bucket": "b",
+                    }
+                )
+                for file_id in ids
+            )
+        report = ManifestReport()
+        report.rows = len(ids) + 1
+        report.reject(2, "x", "Invalid md5: x")
+        dcf_replication_job.write_validation_report(report, "output")
+
+    with pytest.raises(ValueError):
+        merge_shard_manifests("output", "run", 3)
+
+    merged = merge_shard_manifests("output", "run", 2)
+    (key,) = merged["dcf_aws_batch_submitted"]
+    assert not key.startswith("shards/")
+    body = destination_buckets.get_object(Bucket="output", Key=key)["Body"]
+    rows = list(csv.DictReader(body.read().decode().splitlines(), delimiter="\t"))
+    assert [row["guid"] for row in rows] == ["a", "b", "c"]
+
+    (obj,) = destination_buckets.list_objects_v2(
+        Bucket="output", Prefix="dcf_aws_batch_validation_"
+    )["Contents"]
+    body = destination_buckets.get_object(Bucket="output", Key=obj["Key"])["Body"]
+    report = json.loads(body.read())
+    assert report["rows"] == 5
+    assert report["reasons"] == {"Invalid md5": 2}
+
+
+def test_manifest_row():
+    fi = ManifestRow(id="1", file_name="f", size="10", acl="['open']")
+    fi[JOB_STATUS_KEY] = "SUBMITTED"
+
+    copy = pickle.loads(pickle.dumps(fi))
+    assert copy["id"] == "1"
+    assert copy[JOB_STATUS_KEY] == "SUBMITTED"
+    assert "job_id" not in copy
+    assert copy.get("job_id", "none") == "none"
+    with pytest.raises(KeyError):
+        copy["job_id"]
+    rows = [fi] * 100
+    assert len(pickle.dumps(rows)) < len(pickle.dumps([f.to_dict() for f in rows]))
+
+
+def test_submit_jobs_in_chunks(test_project_settings, destination_buckets, monkeypatch):
+    monkeypatch.setattr(dcf_replication_job, "SUBMIT_CHUNK_SIZE", 4)
+    monkeypatch.setattr(dcf_replication_job, "NUMBER_OF_THREADS", 2)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "MULTI_PART_THRESHOLD", 256, raising=False)
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_batch_job",
+        lambda job_queue, job_definition, job_name, environment: "job-"
+        + environment["ID"],
+    )
+    destination_buckets.create_bucket(Bucket="output")
+
+    class Throttle:
+        waits = 0
+        waited = 0.0
+
+        def wait(self):
+            self.waits += 1
+
+    throttle = Throttle()
+    manifest_rows = ManifestRows(TEST_MANIFEST_PATH)
+    assert submit_jobs(
+        manifest_rows, "queue", "definition", "output", throttle=throttle
+    ) == (12, 1, 2)
+    assert manifest_rows.report.rows == 15
+    # the throttle is checked before each chunk of 4 jobs
+    assert throttle.waits == 3
+
+    def read_manifest(prefix):
+        (obj,) = destination_buckets.list_objects_v2(Bucket="output", Prefix=prefix)[
+            "Contents"
+        ]
+        body = destination_buckets.get_object(Bucket="output", Key=obj["Key"])["Body"]
+        return list(csv.DictReader(body.read().decode().splitlines(), delimiter="\t"))
+
+    assert len(read_manifest("dcf_aws_batch_submitted")) == 12
+    assert len(read_manifest("dcf_aws_batch_failed")) == 2
+    jobs = read_manifest("dcf_aws_batch_jobs")
+    assert all(row["job_id"] == "job-" + row["id"] for row in jobs)
+
+
+def test_submit_jobs_bundles(test_project_settings, destination_buckets, monkeypatch):
+    monkeypatch.setattr(dcf_replication_job, "NUMBER_OF_THREADS", 2)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "MULTI_PART_THRESHOLD", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "BUNDLE_MAX_FILES", 4)
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_batch_job",
+        lambda job_queue, job_definition, job_name, environment, **kwargs: "job-"
+        + environment["BUNDLE_RESULTS"],
+    )
+    destination_buckets.create_bucket(Bucket="output")
+
+    # the rows of the manifest are slotted ManifestRow objects
+    assert submit_jobs(
+        ManifestRows(TEST_MANIFEST_PATH), "queue", "definition", "output"
+    ) == (12, 1, 2)
+
+    (obj,) = destination_buckets.list_objects_v2(
+        Bucket="output", Prefix="dcf_aws_batch_jobs"
+    )["Contents"]
+    body = destination_buckets.get_object(Bucket="output", Key=obj["Key"])["Body"]
+    jobs = list(csv.DictReader(body.read().decode().splitlines(), delimiter="\t"))
+    assert len(jobs) == 12
+    # each file can be followed to the results of its bundle
+    assert all(row["job_id"] == "job-" + row["bundle_results"] for row in jobs)
+    # bundles of at most 4 files of the same destination bucket
+    assert len({row["bundle_results"] for row in jobs}) == 5
+
+
+def test_submit_jobs_split(
+    test_project_settings, destination_buckets, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(dcf_replication_job, "NUMBER_OF_THREADS", 2)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "MULTI_PART_THRESHOLD", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "SPLIT_THRESHOLD", 1024)
+    monkeypatch.setattr(dcf_replication_job, "SPLIT_JOB_SIZE", 1024)
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_batch_job",
+        lambda job_queue, job_definition, job_name, environment, **kwargs: job_name
+        + "-"
+        + environment["ID"],
+    )
+    destination_buckets.create_bucket(Bucket="output")
+    with open(TEST_MANIFEST_PATH, encoding="utf-8") as f:
+        header, *rows = f.read().splitlines()
+    values = rows[0].split("\t")
+    values[header.split("\t").index("size")] = str(3 * 1024**3)
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text("\n".join([header, "\t".join(values), rows[1]]) + "\n")
+
+    # the rows of the manifest are slotted ManifestRow objects
+    assert submit_jobs(
+        ManifestRows(str(manifest)), "queue", "definition", "output"
+    ) == (
+        2,
+        0,
+        0,
+    )
+
+    (obj,) = destination_buckets.list_objects_v2(
+        Bucket="output", Prefix="dcf_aws_batch_jobs"
+    )["Contents"]
+    body = destination_buckets.get_object(Bucket="output", Key=obj["Key"])["Body"]
+    jobs = {
+        row["id"]: row
+        for row in csv.DictReader(body.read().decode().splitlines(), delimiter="\t")
+    }
+    split, single = jobs[values[0]], jobs[rows[1].split("\t")[0]]
+    assert split["job_id"] == "gdc_copy_finalize-" + split["id"]
+    # the upload, created by a submission worker, can be aborted if the file
+    # fails
+    assert split["upload_id"]
+    assert single["job_id"] == "gdc_copy-" + single["id"]
+    assert single["upload_id"] == ""
+
+
+def test_submit_jobs_resume_from_ledger(
+    test_project_settings, destination_buckets, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(dcf_replication_job, "SUBMIT_CHUNK_SIZE", 4)
+    monkeypatch.setattr(dcf_replication_job, "NUMBER_OF_THREADS", 2)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "MULTI_PART_THRESHOLD", 256, raising=False)
+    destination_buckets.create_bucket(Bucket="output")
+    crash_id = "33b9ee23-c535-43a3-9e54-d570a9cdb4b7"
+
+    def crashing_submit(job_queue, job_definition, job_name, environment):
+        if environment["ID"] == crash_id:
+            raise RuntimeError("coordinator crashed")
+        return "job-" + environment["ID"]
+
+    monkeypatch.setattr(dcf_replication_job, "submit_batch_job", crashing_submit)
+    run_key = ledger_key("s3://manifests/manifest.tsv")
+    ledger = SubmissionLedger(None, str(tmp_path), run_key)
+    assert ledger.load() == 0
+    with pytest.raises(RuntimeError):
+        submit_jobs(
+            ManifestRows(TEST_MANIFEST_PATH),
+            "queue",
+            "definition",
+            "output",
+            ledger=ledger,
+        )
+
+    ledger = SubmissionLedger(None, str(tmp_path), run_key)
+    # the skipped file and every file submitted before the crash, not only
+    # the chunks that were done
+    assert ledger.load() == 12
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_batch_job",
+        lambda job_queue, job_definition, job_name, environment: "rerun-"
+        + environment["ID"],
+    )
+    checked = []
+    index_destinations = dcf_replication_job.index_destinations
+
+    def checked_destinations(file_info):
+        file_info = list(file_info)
+        checked.extend(fi["id"] for fi in file_info)
+        return index_destinations(file_info)
+
+    monkeypatch.setattr(dcf_replication_job, "index_destinations", checked_destinations)
+    assert submit_jobs(
+        ManifestRows(TEST_MANIFEST_PATH), "queue", "definition", "output", ledger=ledger
+    ) == (12, 1, 2)
+
+    assert len(checked) == 3
+    assert not any(file_id in ledger for file_id in checked)
+    objects = destination_buckets.list_objects_v2(
+        Bucket="output", Prefix="dcf_aws_batch_jobs"
+    )["Contents"]
+    key = max(obj["Key"] for obj in objects)
+    body = destination_buckets.get_object(Bucket="output", Key=key)["Body"]
+    jobs = list(csv.DictReader(body.read().decode().splitlines(), delimiter="\t"))
+    resumed = [row["id"] for row in jobs if row["job_id"].startswith("job-")]
+    assert len(resumed) == 11
+    assert len({row["id"] for row in jobs}) == 12
+    assert crash_id not in resumed
+
+    # a complete run is not resumed
+    assert SubmissionLedger(None, str(tmp_path), run_key).load() == 0
+
+
+def test_ledger_flushes_and_reloads(tmp_path):
+    with SubmissionLedger(None, str(tmp_path), "run", flush_size=2) as ledger:
+        ledger.record({"id": "a", "job_status": "SUBMITTED", "job_id": "job-a"})
+        ledger.record({"id": "b", "job_status": "SKIPPED"})
+        # written once flush_size records are pending
+        assert ledger.segments == 1 and ledger.pending == []
+        ledger.record({"id": "a", "job_status": "FAILED"})
+        ledger.record({"id": "c", "job_status": "COPIED"})
+
+    with SubmissionLedger(None, str(tmp_path), "run") as ledger:
+        assert ledger.load() == 2
+        assert "a" not in ledger
+        fi = {"id": "c"}
+        assert ledger.resume(fi) and fi["job_status"] == "COPIED"
+
+
+def test_copy_replica(destination_buckets, monkeypatch):
+    body = b"replicated content"
+    md5 = hashlib.md5(body).hexdigest()
+    destination_buckets.put_object(
+        Bucket="test-gdc-abc-phs000222-2-open", Key="old/file", Body=body
+    )
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_job",
+        lambda job_queue, job_definition, file: {**file, JOB_STATUS_KEY: "SUBMITTED"},
+    )
+    file = {
+        "id": "new",
+        "file_name": "file",
+        "size": str(len(body)),
+        "md5": md5,
+        "destination_bucket": "test-gdc-abc-phs000222-2-controlled",
+    }
+
+    copied = dcf_replication_job.copy_replica(
+        "queue", "definition", (file, "s3://test-gdc-abc-phs000222-2-open/old/file", "")
+    )
+    assert copied[JOB_STATUS_KEY] == "COPIED"
+    head = destination_buckets.head_object(
+        Bucket="test-gdc-abc-phs000222-2-controlled",
+        Key="new/file",
+        ChecksumMode="ENABLED",
+    )
+    assert head["ETag"].strip('"') == md5
+    # S3 stores a checksum for the copy, as for the uploaded objects
+    assert (
+        head[f"Checksum{CHECKSUM_ALGORITHM}"]
+        == part_checksum(body)[f"Checksum{CHECKSUM_ALGORITHM}"]
+    )
+
+    # a replica that does not match, or does not exist, is not copied
+    for source in (
+        "s3://test-gdc-xyz-phs000111-open/d85d67aa-7273-403f-be77-9ef8ae998e4a/d85d67aa-7273-403f-be77-9ef8ae998e4a",
+        "s3://test-gdc-abc-phs000222-2-open/missing",
+    ):
+        result = dcf_replication_job.copy_replica(
+            "queue", "definition", (dict(file, id="other"), source, "")
+        )
+        assert result[JOB_STATUS_KEY] == "SUBMITTED"
+
+
+def test_copy_replica_multipart(destination_buckets, monkeypatch):
+    source_bucket = "test-gdc-abc-phs000222-2-open"
+    parts = [os.urandom(5 * 1024 * 1024), b"last part"]
+    upload_id = destination_buckets.create_multipart_upload(
+        Bucket=source_bucket, Key="old/file", ChecksumAlgorithm=CHECKSUM_ALGORITHM
+    )["UploadId"]
+    completed = []
+    for number, data in enumerate(parts, start=1):
+        response = destination_buckets.upload_part(
+            Bucket=source_bucket,
+            Key="old/file",
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=data,
+            **part_checksum(data),
+        )
+        completed.append(
+            {"PartNumber": number, "ETag": response["ETag"], **part_checksum(data)}
+        )
+    destination_buckets.complete_multipart_upload(
+        Bucket=source_bucket,
+        Key="old/file",
+        UploadId=upload_id,
+        MultipartUpload={"Parts": completed},
+    )
+    checksum = object_checksum(destination_buckets, source_bucket, "old/file")
+    body = b"".join(parts)
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_job",
+        lambda job_queue, job_definition, file: {**file, JOB_STATUS_KEY: "SUBMITTED"},
+    )
+    replica_jobs = []
+
+    def submit_batch_job(job_queue, job_definition, job_name, environment, **kwargs):
+        replica_jobs.append((job_name, environment))
+        return "replica-job"
+
+    monkeypatch.setattr(dcf_replication_job, "submit_batch_job", submit_batch_job)
+    source = f"s3://{source_bucket}/old/file"
+
+    def copy(file_id, checksum):
+        file = {
+            "id": file_id,
+            "file_name": "file",
+            "size": str(len(body)),
+            # same size and md5, but the ETag of a multipart object is not an md5
+            "md5": hashlib.md5(body).hexdigest(),
+            "destination_bucket": "test-gdc-abc-phs000222-2-controlled",
+        }
+        return dcf_replication_job.copy_replica(
+            "queue", "definition", (file, source, checksum)
+        )[JOB_STATUS_KEY]
+
+    # a multipart replica is only reused with the checksum recorded for it
+    assert copy("unchecked", "") == "SUBMITTED"
+    assert copy("changed", "SHA256:other-2") == "SUBMITTED"
+    assert copy("checked", checksum) == "COPIED"
+    body_copy = destination_buckets.get_object(
+        Bucket="test-gdc-abc-phs000222-2-controlled", Key="checked/file"
+    )["Body"].read()
+    assert body_copy == body
+
+    # large replicas are copied by a Batch job
+    monkeypatch.setattr(dcf_replication_job, "REPLICA_JOB_THRESHOLD", len(body))
+    assert copy("large", checksum) == "SUBMITTED"
+    ((job_name, environment),) = replica_jobs
+    assert job_name == "gdc_copy_replica"
+    assert (environment["REPLICA_SOURCE"], environment["REPLICA_CHECKSUM"]) == (
+        source,
+        checksum,
+    )
+
+
+def copied_replica(job_queue, job_definition, item):
+    fi, source, checksum = item
+    fi[JOB_STATUS_KEY] = "COPIED"
+    return fi
+
+
+def test_submit_jobs_from_replicas(
+    test_project_settings, destination_buckets, monkeypatch
+):
+    monkeypatch.setattr(dcf_replication_job, "NUMBER_OF_THREADS", 2)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "MULTI_PART_THRESHOLD", 256, raising=False)
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_batch_job",
+        lambda job_queue, job_definition, job_name, environment: "job-"
+        + environment["ID"],
+    )
+    destination_buckets.create_bucket(Bucket="output")
+    fi = next(
+        fi
+        for fi in iter_manifest_rows(TEST_MANIFEST_PATH)
+        if fi.id == "ce932b89-e492-406d-b75b-89ba2609ff1e"
+    )
+
+    with ContentIndex(":memory:") as index:
+        index.add(
+            [(fi.md5, int(fi.size), "s3://test-gdc-abc-phs000222-2-open/old/file", "")]
+        )
+        monkeypatch.setattr(dcf_replication_job, "copy_replica", copied_replica)
+        counts = submit_jobs(
+            ManifestRows(TEST_MANIFEST_PATH),
+            "queue",
+            "definition",
+            "output",
+            content_index=index,
+        )
+    assert counts == (11, 1, 2)
+    (obj,) = destination_buckets.list_objects_v2(
+        Bucket="output", Prefix="dcf_aws_batch_copied"
+    )["Contents"]
+    body = destination_buckets.get_object(Bucket="output", Key=obj["Key"])["Body"]
+    rows = list(csv.DictReader(body.read().decode().splitlines(), delimiter="\t"))
+    assert [row["guid"] for row in rows] == [fi.id]
+
+
+def test_job_placement(monkeypatch):
+    monkeypatch.setattr(dcf_replication_job, "LARGE_FILE_JOB_QUEUE", "large")
+    monkeypatch.setattr(dcf_replication_job, "LARGE_FILE_THRESHOLD", 100)
+    monkeypatch.setattr(dcf_replication_job, "FAIR_SHARE", False)
+    small = {"size": str(10 * 1024 * 1024), "project_id": "ALICE"}
+    large = {"size": str(100 * 1024 * 1024), "project_id": "BOB"}
+    assert dcf_replication_job.job_placement("queue", small) == ("queue", {})
+    assert dcf_replication_job.job_placement("queue", large) == ("large", {})
+
+    monkeypatch.setattr(dcf_replication_job, "FAIR_SHARE", True)
+    monkeypatch.setattr(dcf_replication_job, "SUBMISSION_ORDER", "smallest_first")
+    queue, placement = dcf_replication_job.job_placement("queue", small)
+    assert queue == "queue"
+    assert placement["shareIdentifier"] == "ALICE"
+    _, large_placement = dcf_replication_job.job_placement("queue", large)
+    assert (
+        placement["schedulingPriorityOverride"]
+        > large_placement["schedulingPriorityOverride"]
+    )
+
+
+def test_submit_jobs_largest_first(
+    test_project_settings, destination_buckets, monkeypatch
+):
+    monkeypatch.setattr(dcf_replication_job, "SUBMIT_CHUNK_SIZE", 4)
+    monkeypatch.setattr(dcf_replication_job, "NUMBER_OF_THREADS", 2)
+    monkeypatch.setattr(dcf_replication_job, "CHUNK_SIZE", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "MULTI_PART_THRESHOLD", 256, raising=False)
+    monkeypatch.setattr(dcf_replication_job, "SUBMISSION_ORDER", "largest_first")
+    monkeypatch.setattr(dcf_replication_job, "FAIR_SHARE", True)
+    monkeypatch.setattr(
+        dcf_replication_job,
+        "submit_batch_job",
+        lambda job_queue, job_definition, job_name, environment, **kwargs: "{}-{}-{}".format(
+            environment["ID"],
+            kwargs["schedulingPriorityOverride"],
+            kwargs["shareIdentifier"],
+        ),
+    )
+    destination_buckets.create_bucket(Bucket="output")
+
+    manifest_rows = ManifestRows(TEST_MANIFEST_PATH)
+    assert submit_jobs(manifest_rows, "queue", "definition", "output") == (12, 1, 2)
+
+    (obj,) = destination_buckets.list_objects_v2(
+        Bucket="output", Prefix="dcf_aws_batch_jobs"
+    )["Contents"]
+    body = destination_buckets.get_object(Bucket="output", Key=obj["Key"])["Body"]
+    jobs = list(csv.DictReader(body.read().decode().splitlines(), delimiter="\t"))
+    sizes = [int(row["size"]) for row in jobs]
+    classes = [size.bit_length() for size in sizes]
+    assert classes == sorted(classes, reverse=True)
+    assert sizes[0] >= 128 and sizes[-1] < 128
+    for row in jobs:
+        assert row["job_id"] == "{}-{}-{}".format(
+            row["id"], scheduling_priority(row["size"]), row["project_id"]
+        )
+
+
+def test_write_throughput_report(destination_buckets):
+    destination_buckets.create_bucket(Bucket="output")
+    for file_id, status in (("a", "SUCCEEDED"), ("b", "FAILED")):
+        metrics = TransferMetrics(file_id, 1024)
+        metrics.record_part(1024, {"download": 2, "hash": 0.1, "upload": 1})
+        metrics.emit(status, destination_buckets, "s3://output/transfer_metrics/1")
+
+    report = write_throughput_report("s3://output/transfer_metrics/1", "output")
+    assert report["files"] == 2
+    assert report["statuses"] == {"SUCCEEDED": 1, "FAILED": 1}
+    assert report["bottleneck"] == "download"
+    (obj,) = destination_buckets.list_objects_v2(
+        Bucket="output", Prefix="dcf_aws_batch_throughput_"
+    )["Contents"]
+    body = destination_buckets.get_object(Bucket="output", Key=obj["Key"])["Body"]
+    assert json.loads(body.read())["files"] == 2
@@ -0,0 +1,589 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import pytest
+import requests
+import boto3
+from moto import mock_aws
+
+from batch_jobs.dcf_replication import (
+    checksums,
+    file_get_upload,
+    gdc_client,
+    transfer_metrics,
+    upload_state,
+)
+from tests.dcf_replication.gdc_standin import GDCStandIn
+
+FILE_ID = "07de33ac-7a49-4008-b035-707129c02a1d"
+BUCKET = "test-gdc-bucket"
+KEY = f"{FILE_ID}/test.bam"
+CHUNK_SIZE = 5 * 1024 * 1024
+DATA = os.urandom(3 * CHUNK_SIZE + 1024)
+
+
+@pytest.fixture(scope="function")
+def s3_bucket(mock_env, monkeypatch):
+    monkeypatch.setattr(file_get_upload.time, "sleep", lambda s: None)
+    monkeypatch.setattr(gdc_client.time, "sleep", lambda s: None)
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3
+
+
+def part_start(part_number):
+    return (part_number - 1) * CHUNK_SIZE
+
+
+@pytest.fixture(scope="function")
+def gdc(monkeypatch):
+    """
+    Start a GDC API stand-in serving DATA, failing the parts in `failing_parts`
+    """
+    standins = []
+
+    def start(failing_parts=()):
+        standin = GDCStandIn(
+            {FILE_ID: DATA}, fail_starts={part_start(n): None for n in failing_parts}
+        )
+        standins.append(standin.__enter__())
+        monkeypatch.setattr(gdc_client, "GDC_API_URL", standin.url)
+        return standin
+
+    yield start
+    for standin in standins:
+        standin.__exit__(None, None, None)
+
+
+def requested_parts(standin):
+    return sorted(start // CHUNK_SIZE + 1 for start in standin.requested_starts())
+
+
+def copy(
+    state_location,
+    abort_on_failure=False,
+    concurrency=1,
+    chunk_size=CHUNK_SIZE,
+    metrics_location=None,
+    **kwargs,
+):
+    with pytest.raises(SystemExit) as e:
+        file_get_upload.api_to_bucket_copy(
+            FILE_ID,
+            "token",
+            BUCKET,
+            KEY,
+            len(DATA),
+            hashlib.md5(DATA).hexdigest(),
+            chunk_size,
+            2,
+            state_location,
+            abort_on_failure,
+            concurrency,
+            metrics_location=metrics_location,
+            **kwargs,
+        )
+    return e.value.code
+
+
+def test_api_to_bucket_copy_success(s3_bucket, gdc, tmp_path):
+    gdc()
+
+    assert copy(str(tmp_path)) == 0
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()
+    assert body == DATA
+    assert os.listdir(tmp_path) == []
+
+
+def test_api_to_bucket_copy_spooled(s3_bucket, gdc, tmp_path):
+    standin = gdc(failing_parts=[])
+    spool_dir = tmp_path / "spool"
+
+    assert (
+        copy(
+            str(tmp_path / "state"),
+            concurrency=2,
+            spool_dir=str(spool_dir),
+            memory_cap=2 * 1024 * 1024,
+        )
+        == 0
+    )
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()
+    assert body == DATA
+    assert requested_parts(standin) == [1, 2, 3, 4]
+    # the spool files are deleted once their part is uploaded and hashed
+    assert os.listdir(spool_dir) == []
+
+
+def test_api_to_bucket_copy_part_checksums(s3_bucket, gdc, tmp_path, monkeypatch):
+    uploaded = []
+    upload_chunk = file_get_upload.upload_chunk
+
+    def record_upload_chunk(*args, **kwargs):
+        uploaded.append(kwargs["checksum"])
+        return upload_chunk(*args, **kwargs)
+
+    monkeypatch.setattr(file_get_upload, "upload_chunk", record_upload_chunk)
+    gdc()
+    assert copy(str(tmp_path)) == 0
+
+    # every part is sent with its checksum, and S3 keeps the object checksum
+    assert uploaded == [
+        checksums.part_checksum(DATA[start : start + CHUNK_SIZE])
+        for start in range(0, len(DATA), CHUNK_SIZE)
+    ]
+    head = s3_bucket.head_object(Bucket=BUCKET, Key=KEY, ChecksumMode="ENABLED")
+    assert checksums.format_checksum(head).startswith(checksums.CHECKSUM_ALGORITHM)
+    assert checksums.object_checksum(s3_bucket, BUCKET, KEY)
+    assert checksums.object_checksum(s3_bucket, BUCKET, "missing") == ""
+
+
+def test_api_to_bucket_copy_resumes_after_failure(s3_bucket, gdc, tmp_path):
+    standin = gdc(failing_parts=[3])
+    assert copy(str(tmp_path)) == 1
+
+    # the upload is kept with the first two parts
+    upload_id = upload_state.find_in_progress_upload(s3_bucket, BUCKET, KEY)
+    assert upload_id
+    assert len(upload_state.list_uploaded_parts(s3_bucket, BUCKET, KEY, upload_id)) == 2
+
+    standin = gdc()
+    assert copy(str(tmp_path)) == 0
+
+    # only the parts that were not uploaded are downloaded again
+    assert requested_parts(standin) == [3, 4]
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()
+    assert body == DATA
+
+
+def test_api_to_bucket_copy_resume_without_checkpoint(s3_bucket, gdc, tmp_path):
+    standin = gdc(failing_parts=[3])
+    assert copy(str(tmp_path)) == 1
+
+    # without a checkpoint the uploaded parts are re-read to rebuild the md5
+    # but are not uploaded again
+    standin = gdc()
+    assert copy(str(tmp_path / "empty")) == 0
+    assert requested_parts(standin) == [1, 2, 3, 4]
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()
+    assert body == DATA
+
+
+def test_api_to_bucket_copy_unwritable_checkpoint(s3_bucket, gdc, capsys):
+    gdc()
+
+    # the checkpoints can not be written, the upload goes on without them
+    assert copy("s3://missing-state-bucket/upload_state") == 0
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()
+    assert body == DATA
+    assert "Can not write upload checkpoint" in capsys.readouterr().out
+
+
+def test_api_to_bucket_copy_abort_on_failure(s3_bucket, gdc, tmp_path):
+    standin = gdc(failing_parts=[2])
+    assert copy(str(tmp_path), abort_on_failure=True) == 1
+
+    assert upload_state.find_in_progress_upload(s3_bucket, BUCKET, KEY) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_resumable_md5_state_round_trip():
+    md5_hash = upload_state.new_md5()
+    md5_hash.update(b"hello ")
+    restored = upload_state.new_md5(upload_state.get_md5_state(md5_hash))
+    restored.update(b"world")
+    assert restored.hexdigest() == hashlib.md5(b"hello world").hexdigest()
+
+
+def test_api_to_bucket_copy_concurrent_parts_reuse_connections(
+    s3_bucket, gdc, tmp_path
+):
+    standin = gdc()
+    assert copy(str(tmp_path), concurrency=2) == 0
+
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()
+    assert body == DATA
+    assert requested_parts(standin) == [1, 2, 3, 4]
+    assert standin.connections <= 2
+
+
+def test_api_to_bucket_copy_planned_parts(s3_bucket, gdc, tmp_path):
+    standin = gdc()
+    assert copy(str(tmp_path), concurrency=2, chunk_size=None) == 0
+
+    # the file is shared between the two streams
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()
+    assert body == DATA
+    assert sorted(standin.requested_starts()) == [0, 8 * 1024 * 1024]
+
+
+def test_api_to_bucket_copy_metrics(s3_bucket, monkeypatch, tmp_path, capsys):
+    with GDCStandIn({FILE_ID: DATA}, fail_starts={part_start(2): 1}) as standin:
+        monkeypatch.setattr(gdc_client, "GDC_API_URL", standin.url)
+        assert copy(str(tmp_path), metrics_location=f"s3://{BUCKET}/metrics") == 0
+
+    (line,) = [
+        line
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith(transfer_metrics.METRICS_PREFIX)
+    ]
+    summary = json.loads(line[len(transfer_metrics.METRICS_PREFIX) :])
+    assert summary["status"] == "SUCCEEDED"
+    assert summary["parts"] == 4
+    assert summary["bytes"] == len(DATA)
+    assert summary["retries"] == {"download": 1, "upload": 0}
+    for stage in ("download", "hash", "upload"):
+        assert summary["histograms"][f"{stage}_seconds"]["count"] == 4
+    written = s3_bucket.get_object(Bucket=BUCKET, Key=f"metrics/{FILE_ID}.json")
+    assert json.loads(written["Body"].read())["parts"] == 4
+
+
+def test_gdc_client_retries_throttled_requests(monkeypatch):
+    delays = []
+    monkeypatch.setattr(gdc_client.time, "sleep", delays.append)
+    with GDCStandIn({FILE_ID: b"0123456789"}, throttle=2, retry_after="7") as standin:
+        with gdc_client.GDCClient("token", api_url=standin.url) as client:
+            assert client.get_range(FILE_ID, 2, 5) == b"2345"
+    # the Retry-After header is a lower bound of the backoff delay
+    assert len(delays) == 2
+    assert all(delay >= 7 for delay in delays)
+
+
+def test_gdc_client_gives_up_after_retries(monkeypatch):
+    monkeypatch.setattr(gdc_client.time, "sleep", lambda s: None)
+    with GDCStandIn({FILE_ID: b"0123456789"}, fail_starts={0: None}) as standin:
+        with gdc_client.GDCClient(
+            "token", retries_num=3, api_url=standin.url
+        ) as client:
+            with pytest.raises(gdc_client.GDCRequestError):
+                client.get_range(FILE_ID, 0, 5)
+        assert len(standin.requests) == 3
+
+
+def test_gdc_standin_load_profile():
+    data = os.urandom(256 * 1024)
+    url = f"/data/{FILE_ID}"
+    with GDCStandIn({FILE_ID: data}, bandwidth=1024 * 1024) as standin:
+        started = time.monotonic()
+        assert requests.get(standin.url + url).content == data
+        # 256 KB at 1 MB/s
+        assert time.monotonic() - started >= 0.2
+        assert standin.bytes_sent == len(data)
+
+    with GDCStandIn({FILE_ID: data}, latency=0.3, max_in_flight=1) as standin:
+        first = threading.Thread(target=requests.get, args=(standin.url + url,))
+        first.start()
+        time.sleep(0.1)
+        # over the in-flight limit while the first request waits
+        assert requests.get(standin.url + url).status_code == 429
+        first.join()
+        assert standin.statuses == {200: 1, 429: 1}
+
+    with GDCStandIn({FILE_ID: data}, error_rate=0.5, seed=1) as standin:
+        codes = [requests.get(standin.url + url).status_code for _ in range(20)]
+        assert 0 < codes.count(500) < 20
+        assert standin.statuses[500] == codes.count(500)
+
+
+def test_concurrency_controller(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(gdc_client.time, "monotonic", lambda: now[0])
+    controller = gdc_client.ConcurrencyController(8, initial_limit=4)
+
+    # additive increase: about +1 every `limit` successful requests
+    for _ in range(5):
+        controller.release(controller.acquire(), nbytes=1024 * 1024)
+    assert int(controller.limit) == 5
+
+    # requests in flight when the API starts to throttle decrease the limit once
+    started = [controller.acquire() for _ in range(3)]
+    now[0] += 1
+    for start in started:
+        controller.release(start, failed=True, retry_after=5)
+    assert int(controller.limit) == 2
+    assert controller.decreases == 1
+    assert controller.paused_until == 6
+    assert controller.in_flight == 0
+
+    # a request much slower per MB than the best one is a sign of saturation
+    now[0] += 5
+    start = controller.acquire()
+    now[0] += 10
+    controller.release(start, nbytes=1024 * 1024)
+    assert controller.decreases == 2
+    assert int(controller.limit) == 1
+
+
+def test_concurrency_controller_fast_outlier(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(gdc_client.time, "monotonic", lambda: now[0])
+    controller = gdc_client.ConcurrencyController(8, initial_limit=4)
+
+    def request(seconds):
+        start = controller.acquire()
+        now[0] += seconds
+        controller.release(start, nbytes=1024 * 1024)
+
+    # one unusually fast response, then responses at the normal speed, before
+    # and after the baseline is set
+    request(0.01)
+    for _ in range(30):
+        request(1)
+    request(0.01)
+    for _ in range(10):
+        request(1)
+
+    # the normal responses are not taken for slow ones
+    assert controller.decreases == 0
+    assert int(controller.limit) == 8
+
+    # while a response much slower than the recent ones still is
+    request(10)
+    assert controller.decreases == 1
+    assert int(controller.limit) == 4
+
+
+def test_gdc_client_controller(monkeypatch):
+    monkeypatch.setattr(gdc_client.time, "sleep", lambda s: None)
+    controller = gdc_client.ConcurrencyController(8)
+    with GDCStandIn({FILE_ID: b"0123456789"}, throttle=2) as standin:
+        with gdc_client.GDCClient(
+            "token", api_url=standin.url, controller=controller
+        ) as client:
+            assert client.get_range(FILE_ID, 2, 5) == b"2345"
+    assert controller.decreases == 2
+    assert int(controller.limit) == 2
+    assert controller.in_flight == 0
+
+
+def test_submission_throttle(monkeypatch):
+    delays = []
+    monkeypatch.setattr(gdc_client.time, "sleep", delays.append)
+    with GDCStandIn({}, throttle=2, retry_after="3") as standin:
+        with gdc_client.GDCClient("token", api_url=standin.url) as client:
+            throttle = gdc_client.SubmissionThrottle(client)
+            assert throttle.wait() >= 6
+            assert throttle.wait() == 0
+        assert standin.requests == [("status", None)] * 4
+    assert len(delays) == 2 and all(delay >= 3 for delay in delays)
+
+
+def test_hedger():
+    hedger = gdc_client.Hedger(90, max_bytes=1, threads=4)
+    for _ in range(gdc_client.HEDGE_MIN_SAMPLES):
+        assert hedger.run(lambda: b"x", 1) == b"x"
+
+    stalled = threading.Event()
+    calls = []
+
+    def request():
+        calls.append(None)
+        if len(calls) == 1:
+            stalled.wait(5)
+            return b"primary"
+        return b"hedge"
+
+    assert hedger.run(request, 1) == b"hedge"
+    assert (hedger.hedges, hedger.wins, hedger.hedged_bytes) == (1, 1, 1)
+    stalled.set()
+
+    # the hedged bytes are capped
+    assert hedger.run(lambda: time.sleep(0.2) or b"slow", 1) == b"slow"
+    assert hedger.hedges == 1
+    hedger.close()
+
+
+def test_gdc_client_hedges_stalled_range():
+    hedger = gdc_client.Hedger(50, max_bytes=100, threads=4)
+    with GDCStandIn({FILE_ID: b"0123456789"}, stall_starts={2: 5}) as standin:
+        with gdc_client.GDCClient(
+            "token", pool_size=4, api_url=standin.url, hedger=hedger
+        ) as client:
+            for start in range(gdc_client.HEDGE_MIN_SAMPLES):
+                client.get_range(FILE_ID, 5, 6)
+            started = time.monotonic()
+            assert client.get_range(FILE_ID, 2, 5) == b"2345"
+            assert time.monotonic() - started < 5
+        assert standin.requested_starts().count(2) == 2
+    assert hedger.wins == 1
+
+
+def test_parse_retry_after():
+    assert gdc_client.parse_retry_after("3") == 3
+    assert gdc_client.parse_retry_after(None) is None
+    assert gdc_client.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+def stream(file_size=len(DATA), expected_md5=hashlib.md5(DATA).hexdigest()):
+    with pytest.raises(SystemExit) as e:
+        file_get_upload.stream_to_bucket(
+            FILE_ID, "token", BUCKET, KEY, file_size, expected_md5, 2, CHUNK_SIZE
+        )
+    return e.value.code
+
+
+def test_stream_to_bucket_small_file(s3_bucket, gdc):
+    small = DATA[:1000]
+    standin = gdc()
+    standin.files[FILE_ID] = small
+
+    assert stream(len(small), hashlib.md5(small).hexdigest()) == 0
+    assert s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read() == small
+    assert checksums.object_checksum(s3_bucket, BUCKET, KEY) == "{}:{}".format(
+        checksums.CHECKSUM_ALGORITHM, *checksums.part_checksum(small).values()
+    )
+
+
+def test_stream_to_bucket_multipart(s3_bucket, gdc):
+    gdc()
+
+    assert stream() == 0
+    assert s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read() == DATA
+
+
+def test_stream_to_bucket_md5_mismatch_writes_nothing(s3_bucket, gdc):
+    standin = gdc()
+
+    assert stream(expected_md5="0" * 32) == 1
+    assert "Contents" not in s3_bucket.list_objects_v2(Bucket=BUCKET)
+    assert upload_state.find_in_progress_upload(s3_bucket, BUCKET, KEY) is None
+    # the transfer is not retried here, gdc_copy_job.sh reruns the command
+    assert len(standin.requested_starts()) == 1
+
+
+def test_stream_to_bucket_size_mismatch_writes_nothing(s3_bucket, gdc):
+    gdc()
+
+    assert stream(file_size=len(DATA) - 1) == 1
+    assert "Contents" not in s3_bucket.list_objects_v2(Bucket=BUCKET)
+    assert upload_state.find_in_progress_upload(s3_bucket, BUCKET, KEY) is None
+
+
+def test_copy_bundle(s3_bucket, gdc):
+    files = {
+        "0f9ee1a6-6a1b-4b55-a6d5-4a4e1c1a1b01": os.urandom(1000),
+        "0f9ee1a6-6a1b-4b55-a6d5-4a4e1c1a1b02": os.urandom(2000),
+        "0f9ee1a6-6a1b-4b55-a6d5-4a4e1c1a1b03": os.urandom(3000),
+    }
+    standin = gdc()
+    standin.files.update(files)
+    rows = ["id\tfile_name\tsize\tmd5\tdestination_bucket"]
+    for file_id, data in files.items():
+        md5 = hashlib.md5(data).hexdigest()
+        rows.append(f"{file_id}\tf.bam\t{len(data)}\t{md5}\t{BUCKET}")
+    # the last file is listed with a wrong md5
+    rows[-1] = rows[-1].replace(hashlib.md5(data).hexdigest(), "0" * 32)
+    s3_bucket.put_object(Bucket=BUCKET, Key="bundle.tsv", Body="\n".join(rows))
+    # the first file was copied by a previous run
+    first_id = next(iter(files))
+    s3_bucket.put_object(Bucket=BUCKET, Key=f"{first_id}/f.bam", Body=files[first_id])
+
+    with pytest.raises(SystemExit) as e:
+        file_get_upload.copy_bundle(
+            f"s3://{BUCKET}/bundle.tsv", f"s3://{BUCKET}/results.jsonl", "token", 2, 2
+        )
+    assert e.value.code == 1
+
+    results = s3_bucket.get_object(Bucket=BUCKET, Key="results.jsonl")["Body"]
+    results_lines = results.read().splitlines()
+    statuses = [json.loads(line)["status"] for line in results_lines]
+    assert statuses == ["SKIPPED", "SUCCESS", "FAILED"]
+    file_ids = list(files)
+    body = s3_bucket.get_object(Bucket=BUCKET, Key=f"{file_ids[1]}/f.bam")["Body"]
+    assert body.read() == files[file_ids[1]]
+    assert "Contents" not in s3_bucket.list_objects_v2(
+        Bucket=BUCKET, Prefix=file_ids[2]
+    )
+    # the skipped file was not downloaded again, the failed file only once
+    requested = [file_id for file_id, _ in standin.requests]
+    assert first_id not in requested
+    assert requested.count(file_ids[2]) == 1
+    assert "md5" in json.loads(results_lines[2])["error"].lower()
+
+
+def test_copy_from_replica(s3_bucket):
+    s3_bucket.put_object(Bucket=BUCKET, Key="old/file", Body=DATA)
+
+    def copy_from_replica(file_size):
+        with pytest.raises(SystemExit) as e:
+            file_get_upload.copy_from_replica(
+                f"s3://{BUCKET}/old/file",
+                BUCKET,
+                KEY,
+                file_size,
+                hashlib.md5(DATA).hexdigest(),
+            )
+        return e.value.code
+
+    # the replica is checked again before it is copied
+    assert copy_from_replica(len(DATA) + 1) == 1
+    assert "Contents" not in s3_bucket.list_objects_v2(Bucket=BUCKET, Prefix=KEY)
+    assert copy_from_replica(len(DATA)) == 0
+    assert s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read() == DATA
+
+
+def upload_parts(upload_id, first_part, last_part):
+    with pytest.raises(SystemExit) as e:
+        file_get_upload.upload_part_range(
+            FILE_ID,
+            "token",
+            BUCKET,
+            KEY,
+            len(DATA),
+            upload_id,
+            CHUNK_SIZE,
+            first_part,
+            last_part,
+            f"s3://{BUCKET}/split_parts/{FILE_ID}",
+            2,
+        )
+    return e.value.code
+
+
+def finalize(upload_id):
+    with pytest.raises(SystemExit) as e:
+        file_get_upload.finalize_upload(
+            BUCKET,
+            KEY,
+            len(DATA),
+            upload_id,
+            CHUNK_SIZE,
+            f"s3://{BUCKET}/split_parts/{FILE_ID}",
+        )
+    return e.value.code
+
+
+def test_split_upload(s3_bucket, gdc):
+    standin = gdc()
+    upload_id = s3_bucket.create_multipart_upload(Bucket=BUCKET, Key=KEY)["UploadId"]
+
+    assert upload_parts(upload_id, 3, 4) == 0
+    assert upload_parts(upload_id, 1, 2) == 0
+    # a rerun of a part job does not upload its parts again
+    assert upload_parts(upload_id, 1, 2) == 0
+    assert requested_parts(standin) == [1, 2, 3, 4]
+
+    assert finalize(upload_id) == 0
+    assert s3_bucket.get_object(Bucket=BUCKET, Key=KEY)["Body"].read() == DATA
+    assert "Contents" not in s3_bucket.list_objects_v2(
+        Bucket=BUCKET, Prefix="split_parts/"
+    )
+
+
+def test_split_upload_finalize_missing_part(s3_bucket, gdc):
+    gdc()
+    upload_id = s3_bucket.create_multipart_upload(Bucket=BUCKET, Key=KEY)["UploadId"]
+
+    assert upload_parts(upload_id, 1, 2) == 0
+    assert upload_parts(upload_id, 4, 4) == 0
+
+    assert finalize(upload_id) == 1
+    assert "Contents" not in s3_bucket.list_objects_v2(Bucket=BUCKET, Prefix=KEY)
+    # the parts of the failed upload and their digests are not kept
+    assert upload_state.find_in_progress_upload(s3_bucket, BUCKET, KEY) is None
+    assert "Contents" not in s3_bucket.list_objects_v2(
+        Bucket=BUCKET, Prefix="split_parts/"
+    )
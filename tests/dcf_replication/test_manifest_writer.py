@@ -0,0 +1,89 @@
+import csv
+import gzip
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from batch_jobs.dcf_replication.manifest_writer import S3ManifestWriter
+
+BUCKET = "output"
+FIELDS = ["guid", "md5", "size"]
+
+
+@pytest.fixture(scope="function")
+def s3(mock_env):
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3
+
+
+def make_rows(count):
+    return [
+        {"guid": os.urandom(16).hex(), "md5": os.urandom(16).hex(), "size": str(i)}
+        for i in range(count)
+    ]
+
+
+def read(s3, key):
+    body = s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+    if key.endswith(".gz"):
+        body = gzip.decompress(body)
+    return list(csv.DictReader(body.decode().splitlines(), delimiter="\t"))
+
+
+def test_small_manifest(s3):
+    rows = make_rows(10)
+    with S3ManifestWriter(s3, BUCKET, "manifest", FIELDS) as writer:
+        writer.writerows(rows)
+
+    assert writer.keys == ["manifest.tsv"]
+    assert read(s3, "manifest.tsv") == rows
+
+
+def test_empty_manifest_has_header(s3):
+    with S3ManifestWriter(s3, BUCKET, "manifest", FIELDS, compress=True) as writer:
+        pass
+
+    assert writer.keys == ["manifest.tsv.gz"]
+    body = s3.get_object(Bucket=BUCKET, Key="manifest.tsv.gz")["Body"].read()
+    assert gzip.decompress(body).decode().splitlines() == ["guid\tmd5\tsize"]
+
+
+def test_multipart_manifest(s3):
+    # about 12 MB of rows, uploaded in parts of 5 MB
+    rows = make_rows(170000)
+    with S3ManifestWriter(
+        s3, BUCKET, "manifest", FIELDS, part_size=5 * 1024 * 1024
+    ) as writer:
+        writer.writerows(rows)
+
+    assert read(s3, "manifest.tsv") == rows
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads") is None
+
+
+def test_sharded_gzip_manifest(s3):
+    rows = make_rows(100)
+    with S3ManifestWriter(
+        s3, BUCKET, "manifest", FIELDS, compress=True, max_shard_size=2000
+    ) as writer:
+        writer.writerows(rows)
+
+    # every shard is a complete gzipped manifest with its own header
+    assert len(writer.keys) > 1
+    assert writer.keys[0] == "manifest_00000.tsv.gz"
+    assert [row for key in writer.keys for row in read(s3, key)] == rows
+
+
+def test_failed_manifest_is_aborted(s3):
+    with pytest.raises(RuntimeError):
+        with S3ManifestWriter(
+            s3, BUCKET, "manifest", FIELDS, part_size=5 * 1024 * 1024
+        ) as writer:
+            writer.writerows(make_rows(100000))
+            raise RuntimeError("submission failed")
+
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET)
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads") is None
@@ -0,0 +1,88 @@
+from batch_jobs.dcf_replication.file_get_upload import generate_chunk_data_list
+from batch_jobs.dcf_replication.part_planner import (
+    DEFAULT_PART_SIZE,
+    MAX_PARTS,
+    MB,
+    MIN_PART_SIZE,
+    PartPlanner,
+    plan_part_size,
+)
+
+GB = 1024 * MB
+TB = 1024 * GB
+
+
+def check_ranges(parts, file_size):
+    offset = 0
+    for part_number, (number, start, end) in enumerate(parts, start=1):
+        assert number == part_number
+        assert start == offset
+        if end < file_size - 1:
+            assert end - start + 1 >= MIN_PART_SIZE
+        offset = end + 1
+    assert offset == file_size
+    assert len(parts) <= MAX_PARTS
+
+
+def test_plan_part_size():
+    assert plan_part_size(10 * GB, 256 * MB) == 256 * MB
+    assert plan_part_size(10 * GB) == DEFAULT_PART_SIZE
+    assert plan_part_size(5 * TB, 8 * MB) == 525 * MB
+    assert plan_part_size(1024, 8 * MB) == 8 * MB
+
+
+def test_fixed_part_size():
+    file_size = 3 * 5 * MB + 1024
+    planner = PartPlanner(file_size, part_size=5 * MB, budget=GB)
+    parts = list(planner)
+    assert [(start, end) for _, start, end in parts] == generate_chunk_data_list(
+        file_size, 5 * MB
+    )
+
+
+def test_part_limit():
+    planner = PartPlanner(TB, part_size=5 * MB, budget=16 * GB)
+    parts = list(planner)
+    check_ranges(parts, TB)
+    assert parts[0][2] - parts[0][1] + 1 == 105 * MB
+
+    # a resumed upload keeps the remaining parts within the limit
+    planner = PartPlanner(
+        TB, part_size=5 * MB, budget=16 * GB, offset=9990 * 5 * MB, part_number=9990
+    )
+    part_number, start, end = planner.next_range()
+    assert part_number == 9991
+    assert start == 9990 * 5 * MB
+    assert sum(1 for _ in planner) == 9
+
+
+def test_memory_budget():
+    planner = PartPlanner(10 * GB, concurrency=8, budget=90 * MB)
+    assert planner.concurrency == 8
+    assert planner.next_part_size() == 10 * MB
+
+    # parts of 105 MB do not fit 8 at a time in 512 MB
+    planner = PartPlanner(TB, concurrency=8, budget=512 * MB)
+    assert planner.concurrency == 3
+    check_ranges(list(planner), TB)
+
+
+def test_adaptive_part_size():
+    planner = PartPlanner(100 * GB, concurrency=4, budget=16 * GB)
+    assert planner.next_range() == (1, 0, DEFAULT_PART_SIZE - 1)
+
+    # 30 seconds at 10 MB/s
+    planner.record(DEFAULT_PART_SIZE, DEFAULT_PART_SIZE / (10 * MB))
+    assert planner.next_part_size() == 300 * MB
+
+    # memory budget of 16 GB for 5 parts
+    planner.record(GB, 1)
+    assert planner.next_part_size() == 3276 * MB
+
+
+def test_small_file_spread_across_streams():
+    planner = PartPlanner(100 * MB, concurrency=4, budget=16 * GB)
+    parts = list(planner)
+    check_ranges(parts, 100 * MB)
+    assert len(parts) == 4
+    assert parts[0][2] - parts[0][1] + 1 == 25 * MB
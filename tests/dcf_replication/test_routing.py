@@ -0,0 +1,54 @@
+import pytest
+
+from batch_jobs.dcf_replication.routing import (
+    compile_routing_table,
+    find_unknown_projects,
+    route,
+)
+import tests.dcf_replication.test_settings as test_settings
+
+
+@pytest.fixture(scope="function")
+def routing():
+    project_acl = dict(test_settings.PROJECT_ACL)
+    project_acl["TARGET-X"] = {"aws_bucket_prefix": "gdc-target-phs000218"}
+    return compile_routing_table(
+        project_acl,
+        test_settings.POSTFIX_1_EXCEPTION,
+        test_settings.POSTFIX_2_EXCEPTION,
+    )
+
+
+def test_compile_routing_table(routing):
+    assert routing == {
+        ("ALICE", True): "test-gdc-xyz-phs000111-open",
+        ("ALICE", False): "test-gdc-xyz-phs000111-controlled",
+        ("BOB", True): "test-gdc-abc-phs000222-2-open",
+        ("BOB", False): "test-gdc-abc-phs000222-2-controlled",
+        ("CHARLIE", True): "test-gdc-def-phs000333-2-open",
+        ("CHARLIE", False): "test-gdc-def-phs000333-controlled",
+        ("TARGET-X", True): "gdc-target-phs000218-2-open",
+        ("TARGET-X", False): "target-controlled",
+    }
+
+
+def test_route(routing):
+    assert route(routing, "BOB", "['open']") == "test-gdc-abc-phs000222-2-open"
+    assert (
+        route(routing, "BOB", "['phs000178']") == "test-gdc-abc-phs000222-2-controlled"
+    )
+    assert route(routing, "DAVE", "['open']") is None
+
+
+def test_find_unknown_projects(routing, tmp_path):
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text(
+        "id\tproject_id\tacl\n"
+        "1\tALICE\t['open']\n"
+        "2\tDAVE\t['open']\n"
+        "3\tEVE\t['open']\n"
+        "4\tDAVE\t['phs000178']\n"
+    )
+
+    # every unknown project is reported, not only the first one
+    assert find_unknown_projects(str(manifest), routing) == {"DAVE": 2, "EVE": 1}
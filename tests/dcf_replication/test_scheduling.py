@@ -0,0 +1,80 @@
+import pytest
+
+from batch_jobs.dcf_replication.dcf_replication_job import ManifestRow
+from batch_jobs.dcf_replication.scheduling import (
+    LARGEST_FIRST,
+    MANIFEST_ORDER,
+    MAX_PRIORITY,
+    SMALLEST_FIRST,
+    order_files,
+    scheduling_parameters,
+    scheduling_priority,
+    share_identifier,
+    size_class,
+)
+
+SIZES = [5, 3000, 0, 2**40, 7, 2**40 + 1, 6, 4096]
+
+
+def files():
+    return (ManifestRow(id=str(i), size=str(size)) for i, size in enumerate(SIZES))
+
+
+def test_size_class():
+    assert size_class(0) == 0
+    assert size_class(1) == 1
+    assert size_class("1023") == 10
+    assert size_class(1024) == 11
+    assert size_class(2**60) == 47
+
+
+def test_order_files():
+    assert [fi["id"] for fi in order_files(files(), MANIFEST_ORDER)] == [
+        str(i) for i in range(len(SIZES))
+    ]
+    # files of the same size class keep their manifest order
+    assert [fi["id"] for fi in order_files(files(), LARGEST_FIRST)] == [
+        "3",
+        "5",
+        "7",
+        "1",
+        "0",
+        "4",
+        "6",
+        "2",
+    ]
+    assert [fi["id"] for fi in order_files(files(), SMALLEST_FIRST)] == [
+        "2",
+        "0",
+        "4",
+        "6",
+        "1",
+        "7",
+        "3",
+        "5",
+    ]
+    ordered = list(order_files(files(), LARGEST_FIRST))
+    assert isinstance(ordered[0], ManifestRow)
+    assert ordered[0].to_dict() == {"id": "3", "size": str(2**40)}
+
+    with pytest.raises(ValueError):
+        list(order_files(files(), "random"))
+
+
+def test_scheduling_priority():
+    assert scheduling_priority(0) == 0
+    assert scheduling_priority(2**60) == MAX_PRIORITY
+    assert scheduling_priority(2**30) > scheduling_priority(2**20)
+    assert scheduling_priority(2**30, SMALLEST_FIRST) < scheduling_priority(
+        2**20, SMALLEST_FIRST
+    )
+    assert scheduling_priority(0, SMALLEST_FIRST) == MAX_PRIORITY
+
+
+def test_scheduling_parameters():
+    assert share_identifier("TCGA-BRCA") == "TCGA_BRCA"
+    assert scheduling_parameters({"size": "1024", "project_id": "TCGA-BRCA"}) == {
+        "schedulingPriorityOverride": scheduling_priority(1024),
+        "shareIdentifier": "TCGA_BRCA",
+    }
+    assert scheduling_parameters({"size": "1024"})["shareIdentifier"] == "default"
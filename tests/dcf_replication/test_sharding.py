@@ -0,0 +1,44 @@
+from batch_jobs.dcf_replication.sharding import (
+    default_run_id,
+    group_shard_keys,
+    shard_of,
+    shard_prefix,
+)
+
+
+def test_shard_of():
+    ids = [f"{i:08d}-7a49-4008-b035-707129c02a1d" for i in range(1000)]
+    shards = [shard_of(file_id, 8) for file_id in ids]
+    assert shards == [shard_of(file_id, 8) for file_id in ids]
+    assert set(shards) == set(range(8))
+    assert all(shard_of(file_id, 1) == 0 for file_id in ids)
+
+
+def test_default_run_id(monkeypatch):
+    monkeypatch.delenv("AWS_BATCH_JOB_ID", raising=False)
+    assert default_run_id() is None
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "1234-abcd:7")
+    assert default_run_id() == "1234-abcd"
+
+
+def test_group_shard_keys():
+    keys = [
+        shard_prefix("run", 1) + "dcf_aws_batch_submitted_20240102.tsv",
+        shard_prefix("run", 0) + "dcf_aws_batch_submitted_20240101_00001.tsv.gz",
+        shard_prefix("run", 0) + "dcf_aws_batch_submitted_20240101_00000.tsv.gz",
+        # an earlier attempt of shard 0
+        shard_prefix("run", 0) + "dcf_aws_batch_submitted_20240100.tsv",
+        shard_prefix("run", 0) + "dcf_aws_batch_validation_20240100.json",
+        shard_prefix("run", 0) + "dcf_aws_batch_validation_20240101.json",
+        shard_prefix("run", 0) + "notes.txt",
+        shard_prefix("other", 2) + "dcf_aws_batch_submitted_20240101.tsv",
+    ]
+    manifests, reports = group_shard_keys(keys, "run")
+    assert manifests == {
+        "dcf_aws_batch_submitted": [
+            "shards/run/00000/dcf_aws_batch_submitted_20240101_00000.tsv.gz",
+            "shards/run/00000/dcf_aws_batch_submitted_20240101_00001.tsv.gz",
+            "shards/run/00001/dcf_aws_batch_submitted_20240102.tsv",
+        ]
+    }
+    assert reports == {0: "shards/run/00000/dcf_aws_batch_validation_20240101.json"}
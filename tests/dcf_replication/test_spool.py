@@ -0,0 +1,37 @@
+import hashlib
+import os
+
+import pytest
+
+from batch_jobs.dcf_replication.spool import MB, PartSpool, SpooledPart
+
+
+def test_spooled_part(tmp_path):
+    data = os.urandom(3 * MB + 10)
+    part = SpooledPart(str(tmp_path), len(data), MB)
+    for start in range(0, len(data), 300 * 1024):
+        part.write(data[start : start + 300 * 1024])
+    assert part.written == len(part) == len(data)
+    assert part.buffer[:] == data
+
+    md5 = hashlib.md5()
+    part.update(md5)
+    assert md5.hexdigest() == hashlib.md5(data).hexdigest()
+    # the temporary file is already unlinked
+    assert os.listdir(tmp_path) == []
+
+    with pytest.raises(ValueError):
+        part.write(b"x")
+    part.rewind()
+    part.write(b"y")
+    assert part.buffer[:1] == b"y"
+    part.close()
+
+
+def test_part_spool(tmp_path):
+    spool = PartSpool(str(tmp_path / "spool"), 3, memory_cap=16 * MB)
+    assert spool.flush_bytes == 4 * MB
+    assert PartSpool(str(tmp_path), 100, memory_cap=16 * MB).flush_bytes == MB
+    part = spool.part(5 * MB)
+    assert len(part.buffer) == 5 * MB
+    part.close()
@@ -0,0 +1,80 @@
+import json
+
+import boto3
+from moto import mock_aws
+
+from batch_jobs.dcf_replication.transfer_metrics import (
+    METRICS_PREFIX,
+    SECONDS_BUCKETS,
+    Histogram,
+    TransferMetrics,
+    merge_summaries,
+)
+
+MB = 1024 * 1024
+
+
+def test_histogram():
+    histogram = Histogram(SECONDS_BUCKETS)
+    assert histogram.percentile(50) is None
+    for value in [0.0005] * 8 + [3, 5000]:
+        histogram.add(value)
+    assert histogram.count == 10
+    assert histogram.min == 0.0005
+    assert histogram.max == 5000
+    assert histogram.percentile(50) == 0.001
+    assert histogram.percentile(90) == 4.096
+    assert histogram.percentile(99) == 5000
+    assert histogram.counts[-1] == 1
+
+    merged = Histogram.from_dict(SECONDS_BUCKETS, histogram.to_dict())
+    merged.merge(histogram)
+    assert merged.count == 20
+    assert merged.total == 2 * histogram.total
+    assert merged.counts == [2 * count for count in histogram.counts]
+
+
+def test_transfer_metrics(capsys):
+    metrics = TransferMetrics("file", 3 * MB)
+    metrics.record_part(
+        2 * MB, {"download": 1, "hash": 0.01, "upload": 0.5}, {"download": 2}
+    )
+    metrics.record_part(MB, {"download": 1, "hash": 0.01, "upload": 0.5})
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="output")
+        summary = metrics.emit("SUCCEEDED", s3, "s3://output/metrics/run")
+        written = s3.get_object(Bucket="output", Key="metrics/run/file.json")
+        assert json.loads(written["Body"].read()) == summary
+
+    assert capsys.readouterr().out == METRICS_PREFIX + json.dumps(summary) + "\n"
+    assert summary["parts"] == 2
+    assert summary["bytes"] == 3 * MB
+    assert summary["retries"] == {"download": 2, "upload": 0}
+    assert summary["histograms"]["download_mb_per_second"]["max"] == 2
+    assert summary["histograms"]["upload_mb_per_second"]["min"] == 2
+    assert summary["histograms"]["hash_seconds"]["count"] == 2
+
+
+def test_merge_summaries():
+    slow_download = TransferMetrics("a", MB)
+    slow_download.record_part(MB, {"download": 10, "hash": 0.1, "upload": 1})
+    slow_upload = TransferMetrics("b", MB)
+    slow_upload.record_part(
+        MB, {"download": 1, "hash": 0.1, "upload": 2}, {"upload": 1}
+    )
+
+    report = merge_summaries(
+        [slow_download.summary("SUCCEEDED"), slow_upload.summary("FAILED")]
+    )
+    assert report["files"] == 2
+    assert report["statuses"] == {"SUCCEEDED": 1, "FAILED": 1}
+    assert report["parts"] == 2
+    assert report["bytes"] == 2 * MB
+    assert report["retries"] == {"download": 0, "upload": 1}
+    assert report["bottleneck"] == "download"
+    assert round(report["stage_share"]["download"], 3) == round(11 / 14.2, 3)
+    assert report["histograms"]["download_seconds"]["count"] == 2
+
+    assert merge_summaries([])["bottleneck"] is None
@@ -0,0 +1,239 @@
+import csv
+import hashlib
+import json
+
+import boto3
+import pytest
+from botocore.exceptions import ReadTimeoutError, ResponseStreamingError
+from moto import mock_aws
+
+from batch_jobs.dcf_replication.checksums import object_checksum, part_checksum
+from batch_jobs.dcf_replication.destination_index import DestinationIndex
+from batch_jobs.dcf_replication.verification import (
+    CHECKSUM_MISMATCH,
+    MD5_MISMATCH,
+    MISSING,
+    SIZE_MISMATCH,
+    UNREADABLE,
+    UNVERIFIED,
+    VERIFIED_CHECKSUM,
+    VERIFIED_ETAG,
+    VERIFIED_HASH,
+    check_listing,
+    manifest_objects,
+    verify_objects,
+)
+import batch_jobs.dcf_replication.dcf_replication_job as dcf_replication_job
+
+PART = b"p" * 5 * 1024 * 1024
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def put_multipart(s3, bucket, key, parts):
+    upload = s3.create_multipart_upload(
+        Bucket=bucket, Key=key, ChecksumAlgorithm="SHA256"
+    )
+    completed = []
+    for number, data in enumerate(parts, 1):
+        checksum = part_checksum(data, "SHA256")
+        response = s3.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload["UploadId"],
+            PartNumber=number,
+            Body=data,
+            **checksum,
+        )
+        completed.append({"PartNumber": number, "ETag": response["ETag"], **checksum})
+    s3.complete_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload["UploadId"],
+        MultipartUpload={"Parts": completed},
+    )
+
+
+def obj(url, data=None, size=None, md5_value=None, checksum=""):
+    bucket, _, key = url.replace("s3://", "", 1).partition("/")
+    return {
+        "url": url,
+        "bucket": bucket,
+        "key": key,
+        "guid": key.split("/")[0],
+        "size": len(data) if size is None else size,
+        "md5": md5(data) if md5_value is None else md5_value,
+        "checksum": checksum,
+    }
+
+
+@pytest.fixture(scope="function")
+def replicated(mock_env):
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dest")
+        s3.put_object(Bucket="dest", Key="a/a", Body=b"a" * 10)
+        s3.put_object(Bucket="dest", Key="b/b", Body=b"b" * 10)
+        s3.put_object(Bucket="dest", Key="c/c", Body=b"c" * 5)
+        put_multipart(s3, "dest", "d/d", [PART, b"d"])
+        put_multipart(s3, "dest", "e/e", [PART, b"e"])
+        put_multipart(s3, "dest", "f/f", [PART, b"f"])
+        yield s3
+
+
+def test_manifest_objects():
+    rows = [
+        {
+            "guid": "a",
+            "md5": "ABC",
+            "size": "3",
+            "urls": "['s3://dest/a/a', 'gs://other/a/a']",
+            "checksum": "SHA256:x",
+        },
+        {"url": "s3://bucket/key", "size": "", "md5": "abc"},
+    ]
+    first, second = manifest_objects(rows)
+    assert (first["bucket"], first["key"], first["size"]) == ("dest", "a/a", 3)
+    assert (first["md5"], first["checksum"]) == ("abc", "SHA256:x")
+    assert (second["bucket"], second["key"], second["size"]) == ("bucket", "key", None)
+
+
+def test_check_listing():
+    data = b"x" * 4
+    assert check_listing(obj("s3://b/k", data), None)[0] == MISSING
+    assert check_listing(obj("s3://b/k", data), (3, md5(data)))[0] == SIZE_MISMATCH
+    assert check_listing(obj("s3://b/k", data), (4, f'"{md5(data)}"'))[0] == (
+        VERIFIED_ETAG
+    )
+    assert check_listing(obj("s3://b/k", data), (4, md5(b"y")))[0] == MD5_MISMATCH
+    assert check_listing(obj("s3://b/k", data), (4, "abc-2")) == (None, "")
+
+
+@pytest.mark.parametrize("listed", [True, False])
+@pytest.mark.parametrize("batch_size", [2, 100])
+def test_verify_objects(replicated, listed, batch_size):
+    s3 = replicated
+    objects = [
+        obj("s3://dest/a/a", b"a" * 10),
+        # overwritten since the copy
+        obj("s3://dest/b/b", b"B" * 10),
+        obj("s3://dest/c/c", b"c" * 10),
+        obj("s3://dest/missing/missing", b"m"),
+        obj("s3://dest/d/d", PART + b"d", checksum=object_checksum(s3, "dest", "d/d")),
+        obj("s3://dest/e/e", PART + b"e", checksum="SHA256:other-2"),
+        obj("s3://dest/f/f", PART + b"f"),
+    ]
+    rows = []
+    with DestinationIndex(s3, ":memory:") as index:
+        if listed:
+            index.build({"dest": [o["key"] for o in objects]})
+        report = verify_objects(
+            iter(objects), index, lambda bucket: s3, rows.append, batch_size=batch_size
+        )
+
+    assert report.statuses == {
+        VERIFIED_ETAG: 1,
+        MD5_MISMATCH: 1,
+        SIZE_MISMATCH: 1,
+        MISSING: 1,
+        VERIFIED_CHECKSUM: 1,
+        CHECKSUM_MISMATCH: 1,
+        VERIFIED_HASH: 1,
+    }
+    # only the multipart object without checksum is downloaded
+    assert report.hashed_bytes == len(PART) + 1
+    assert [row["url"] for row in rows] == [
+        "s3://dest/b/b",
+        "s3://dest/c/c",
+        "s3://dest/missing/missing",
+        "s3://dest/e/e",
+    ]
+    assert report.to_dict()["failed"] == 4
+
+
+def test_verify_objects_hash_budget(replicated):
+    s3 = replicated
+    objects = [obj("s3://dest/f/f", PART + b"f")]
+    with DestinationIndex(s3, ":memory:") as index:
+        index.build({"dest": ["f/f"]})
+        report = verify_objects(objects, index, lambda bucket: s3, max_hash_bytes=1)
+    assert report.statuses == {UNVERIFIED: 1}
+    assert report.hashed_bytes == 0
+
+
+def test_verify_objects_unreadable(replicated):
+    s3 = replicated
+
+    class Unreadable:
+        def head_object(self, **kwargs):
+            raise ReadTimeoutError(endpoint_url="https://dest")
+
+        def get_object(self, **kwargs):
+            raise ResponseStreamingError(error="Connection reset by peer")
+
+    # the unindexed bucket is checked with a HEAD request, the multipart
+    # object of the indexed bucket is hashed
+    objects = [obj("s3://other/a/a", b"a" * 10), obj("s3://dest/f/f", PART + b"f")]
+    rows = []
+    with DestinationIndex(s3, ":memory:") as index:
+        index.build({"dest": ["f/f"]})
+        report = verify_objects(
+            objects, index, lambda bucket: Unreadable(), rows.append
+        )
+    assert report.statuses == {UNREADABLE: 2}
+    assert "Read timeout" in rows[0]["detail"]
+    assert "Connection reset" in rows[1]["detail"]
+
+
+def test_verify_replication(replicated, monkeypatch):
+    s3 = replicated
+    session = boto3.Session
+    monkeypatch.setattr(
+        boto3, "Session", lambda profile_name=None, **kwargs: session(**kwargs)
+    )
+    s3.create_bucket(Bucket="output")
+    rows = [
+        convert_row("a", b"a" * 10),
+        convert_row("c", b"c" * 10),
+        convert_row("f", PART + b"f"),
+    ]
+    with dcf_replication_job.open_output_manifest(
+        "output",
+        "dcf_aws_batch_completed",
+        dcf_replication_job.COMPLETED_MANIFEST_FIELDS,
+    ) as writer:
+        writer.writerows(rows)
+
+    report = dcf_replication_job.verify_replication(
+        [f"s3://output/{key}" for key in writer.keys], "output"
+    )
+    assert report["statuses"] == {VERIFIED_ETAG: 1, SIZE_MISMATCH: 1, VERIFIED_HASH: 1}
+    assert [d["guid"] for d in report["discrepancies"]] == ["c"]
+
+    (key,) = report["discrepancy_manifest"]
+    body = s3.get_object(Bucket="output", Key=key)["Body"].read().decode()
+    (row,) = csv.DictReader(body.splitlines(), delimiter="\t")
+    assert (row["url"], row["status"], row["size"]) == (
+        "s3://dest/c/c",
+        SIZE_MISMATCH,
+        "5",
+    )
+    (obj_,) = s3.list_objects_v2(Bucket="output", Prefix="dcf_aws_batch_verification_")[
+        "Contents"
+    ]
+    body = s3.get_object(Bucket="output", Key=obj_["Key"])["Body"]
+    assert json.loads(body.read())["objects"] == 3
+
+
+def convert_row(guid, data):
+    return {
+        "guid": guid,
+        "md5": md5(data),
+        "size": len(data),
+        "acl": "['open']",
+        "file_name": guid,
+        "urls": str([f"s3://dest/{guid}/{guid}"]),
+        "checksum": "",
+    }
@@ -1,4 +1,5 @@
 import os
+import json
 import pytest
 from unittest.mock import MagicMock
 from contextlib import contextmanager
@@ -68,6 +69,14 @@ def test_send_message_success(create_mock_sqs):
     assert send_message("test", {})
 
 
+def test_send_message_with_queue_url(create_mock_sqs):
+    sqs = boto3.client("sqs", region_name="us-east-1")
+    queue_url = sqs.get_queue_url(QueueName="test")["QueueUrl"]
+    assert send_message("unused", {"md5": "abc"}, queue_url)
+    messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)
+    assert {"md5": "abc"} in [json.loads(m["Body"]) for m in messages["Messages"]]
+
+
 def test_send_message_fail_due_to_queue_not_exist(create_mock_sqs):
     with pytest.raises(ClientError):
         send_message("test2", {})
@@ -94,18 +103,39 @@ def test_submit_jobs_success(monkeypatch):
     stubber.add_response(
         "submit_job", service_response={"jobName": "bucket_manifest", "jobId": "123"}
     )
-    boto3.client = MagicMock()
-    boto3.client.return_value = client
+    monkeypatch.setattr(boto3, "client", MagicMock(return_value=client))
     with stubber:
         assert submit_job("test", "rest", "key")
 
 
+def test_submit_job_with_queue_url(monkeypatch):
+    client = boto3.client("batch", region_name="us-east-1")
+    stubber = Stubber(client)
+    stubber.add_response(
+        "submit_job",
+        service_response={"jobName": "bucket_manifest", "jobId": "123"},
+        expected_params={
+            "jobName": "bucket_manifest",
+            "jobQueue": "test",
+            "jobDefinition": "rest",
+            "containerOverrides": {
+                "environment": [
+                    {"value": "key", "name": "KEY"},
+                    {"value": "https://queue", "name": "QUEUE_URL"},
+                ]
+            },
+        },
+    )
+    monkeypatch.setattr(boto3, "client", MagicMock(return_value=client))
+    with stubber:
+        assert submit_job("test", "rest", "key", "https://queue")
+
+
 def test_submit_jobs_fail(monkeypatch):
     monkeypatch.setattr("batch_jobs.bucket_manifest.bucket_manifest_job.MAX_RETRIES", 1)
     client = boto3.client("batch", region_name="us-east-1")
     stubber = Stubber(client)
     stubber.add_client_error("submit_job")
-    boto3.client = MagicMock()
-    boto3.client.return_value = client
+    monkeypatch.setattr(boto3, "client", MagicMock(return_value=client))
     with stubber:
         assert submit_job("test", "rest", "key") == False
@@ -0,0 +1,51 @@
+from multiprocessing.pool import Pool
+
+import boto3
+from moto import mock_aws
+
+from batch_jobs.utils.clients import bucket_region, get_bucket_client, get_client
+
+
+def _client_id(_):
+    return id(get_client("s3", region_name="us-east-1"))
+
+
+def test_get_client_is_cached(mock_env):
+    client = get_client("batch", region_name="us-east-1")
+
+    assert get_client("batch", region_name="us-east-1") is client
+    assert get_client("batch", region_name="us-west-2") is not client
+    assert get_client("s3", region_name="us-east-1") is not client
+    assert client.meta.config.max_pool_connections == 50
+
+
+def test_get_client_per_process(mock_env):
+    parent_client = get_client("s3", region_name="us-east-1")
+
+    with Pool(2) as pool:
+        ids = pool.map(_client_id, range(8))
+
+    assert id(parent_client) not in ids
+    # one client per worker process
+    assert len(set(ids)) <= 2
+
+
+def test_get_bucket_client(mock_env):
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(
+            Bucket="eu-bucket",
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3.create_bucket(Bucket="us-bucket")
+
+        assert bucket_region("eu-bucket") == "eu-west-2"
+        assert bucket_region("us-bucket") == "us-east-1"
+        assert bucket_region("missing-bucket") is None
+        client = get_bucket_client("eu-bucket", profile_name=None)
+        assert client.meta.region_name == "eu-west-2"
+        assert get_bucket_client("eu-bucket") is client
+
+        # regions are looked up once per run
+        s3.delete_bucket(Bucket="eu-bucket")
+        assert bucket_region("eu-bucket") == "eu-west-2"
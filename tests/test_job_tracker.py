@@ -0,0 +1,60 @@
+from unittest.mock import MagicMock
+
+from batch_jobs.utils import job_tracker
+
+
+def test_poll_jobs_adapts_interval(monkeypatch):
+    delays = []
+    monkeypatch.setattr(job_tracker.time, "sleep", delays.append)
+    statuses = iter(
+        [
+            ["RUNNING", "RUNNING", "RUNNING"],
+            ["RUNNING", "RUNNING", "RUNNING"],
+            ["RUNNING", "RUNNING", "RUNNING"],
+            ["SUCCEEDED", "RUNNING", "RUNNING"],
+            ["RUNNING", "FAILED"],
+            ["SUCCEEDED"],
+        ]
+    )
+
+    def describe_jobs(jobs):
+        return {
+            "jobs": [
+                {"jobId": job_id, "status": status}
+                for job_id, status in zip(jobs, next(statuses))
+            ]
+        }
+
+    batch = MagicMock()
+    batch.describe_jobs.side_effect = describe_jobs
+
+    finished = list(job_tracker.poll_jobs(batch, ["a", "b", "c"], 10, 30))
+
+    assert [[job["jobId"] for job in jobs] for jobs in finished] == [
+        ["a"],
+        ["c"],
+        ["b"],
+    ]
+    # the interval doubles while nothing finishes and is reset when jobs finish
+    assert delays == [20, 30, 30, 10, 10]
+
+
+def test_poll_jobs_describes_in_batches(monkeypatch):
+    monkeypatch.setattr(job_tracker.time, "sleep", lambda s: None)
+    batch = MagicMock()
+    batch.describe_jobs.side_effect = lambda jobs: {
+        "jobs": [{"jobId": job_id, "status": "SUCCEEDED"} for job_id in jobs[1:]]
+    }
+
+    finished = list(job_tracker.poll_jobs(batch, [str(i) for i in range(250)]))
+
+    assert [
+        len(call.kwargs["jobs"]) for call in batch.describe_jobs.call_args_list
+    ] == [
+        100,
+        100,
+        50,
+    ]
+    # the jobs Batch does not know are reported as failed
+    failed = [job for job in finished[0] if job["status"] == "FAILED"]
+    assert [job["jobId"] for job in failed] == ["0", "100", "200"]
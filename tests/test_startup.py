@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+import batch_jobs.bin.settings as settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_settings_are_read_on_first_use(monkeypatch, tmp_path):
+    credentials = tmp_path / "credentials.json"
+    credentials.write_text(json.dumps({"GDC_TOKEN": "token", "SLACK_URL": "slack"}))
+    monkeypatch.setattr(settings, "CREDENTIALS_FILE", str(credentials))
+    monkeypatch.setattr(settings, "PROJECT_MAP_FILE", str(tmp_path / "missing.json"))
+    for name in list(settings.CREDENTIALS_DEFAULTS) + ["PROJECT_ACL"]:
+        monkeypatch.delattr(settings, name, raising=False)
+
+    assert settings.GDC_TOKEN == "token"
+    assert settings.SLACK_URL == "slack"
+    assert settings.POSTFIX_1_EXCEPTION == []
+    assert settings.PROJECT_ACL == {}
+
+
+def test_copy_job_does_not_import_the_coordinator():
+    code = (
+        "import sys; import batch_jobs.dcf_replication.file_get_upload; "
+        "print('batch_jobs.dcf_replication.dcf_replication_job' in sys.modules, "
+        "'batch_jobs.bin.settings' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.split() == ["False", "False"]